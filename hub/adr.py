@@ -0,0 +1,225 @@
+# BLOOM Hub
+# Adaptive data rate
+# Author: Simon Aschenbrenner
+
+from array import array
+from radio import airtime, BANDWIDTHS, ModemConfig
+import constants
+import struct
+
+_VERSION = 1
+_FORMAT = "<BBB"  # Version, data rate (RadioHead modem configuration index), TX power in dBm
+
+# Modem configurations from fastest to most robust with their index in RadioHead (RH_RF95::ModemConfigChoice)
+# and the minimum SNR they need in quarter dB, normalized to a bandwidth of 125 kHz (see _normalize())
+DATA_RATES = (
+    (ModemConfig.Bw500Cr45Sf128, 1, -6),     # SF7: -7.5 dB, but 6 dB more noise in 4 times the bandwidth
+    (ModemConfig.Bw125Cr45Sf128, 0, -30),    # SF7: -7.5 dB
+    (ModemConfig.Bw125Cr45Sf2048, 4, -70),   # SF11: -17.5 dB
+    (ModemConfig.Bw31_25Cr48Sf512, 2, -74),  # SF9: -12.5 dB, but 6 dB less noise in a quarter of the bandwidth
+    (ModemConfig.Bw125Cr48Sf4096, 3, -80)    # SF12: -20 dB
+    )
+DEFAULT_DATA_RATE = 1  # Index in DATA_RATES of the configuration all devices start with
+MIN_TX_POWER = 5  # dBm
+MAX_TX_POWER = 23  # dBm
+
+
+class AdaptiveDataRate(object):
+    """
+    Adapts the data rate and the TX power of the paired sensors to their link quality, keeping the SNR of their last constants.LORA_ADR_WINDOW measurements.
+
+    The hub can only receive one data rate at a time, so all its sensors share the fastest data rate the weakest of them supports with a margin of constants.LORA_ADR_MARGIN.
+    A change is announced to every sensor in a command answering its measurement. Once all sensors acknowledged it, the next schedule beacon announces the switch
+    and the hub switches right after. The TX power is set per sensor, as low as the margin allows.
+    If a paired sensor isn't heard for constants.LORA_ADR_FALLBACK_TIME after a switch, the hub falls back on the default data rate (as the sensors do if they lose the hub).
+    """
+
+    def __init__(self, lora, registry, window=constants.LORA_ADR_WINDOW):
+        """
+        :param LoRa lora: The radio to switch
+        :param SensorRegistry registry: The paired sensors
+        :param int window: Number of measurements per sensor to decide on, default is constants.LORA_ADR_WINDOW
+        """
+
+        self._lora = lora
+        self._registry = registry
+        self._window = window
+        self._snr = array("b", [0] * (constants.LORA_MAX_PAIRED_SENSORS * window))  # Normalized quarter dB, ring per sensor
+        self._samples = bytearray(constants.LORA_MAX_PAIRED_SENSORS)  # Number of samples per sensor (up to window)
+        self._next_sample = bytearray(constants.LORA_MAX_PAIRED_SENSORS)
+        self._tx_power = bytearray([MAX_TX_POWER] * constants.LORA_MAX_PAIRED_SENSORS)  # Acknowledged by the sensor
+        self._data_rate = bytearray([DEFAULT_DATA_RATE] * constants.LORA_MAX_PAIRED_SENSORS)  # Acknowledged by the sensor
+        self._last_heard = array("l", [0] * constants.LORA_MAX_PAIRED_SENSORS)
+        self._current = DEFAULT_DATA_RATE
+        self._target = DEFAULT_DATA_RATE
+        self._switched = 0  # Time of the last switch in seconds
+        self.airtime_saved = 0  # us of uplink airtime saved since boot compared to the default data rate
+        self.commands = 0  # Commands acknowledged by the sensors since boot
+        self.switches = 0  # Data rate switches (including fallbacks) since boot
+
+    def observe(self, sensor_id, packet, timestamp):
+        """
+        Adds the link quality of a measurement received from a sensor.
+
+        :param radio.Packet packet: The measurement received
+        :param int timestamp: Time of reception in seconds
+        """
+
+        index = sensor_id * self._window + self._next_sample[sensor_id]
+        self._snr[index] = max(min(round(packet.snr * 4) + _normalize(DATA_RATES[self._current][0]), 127), -128)
+        self._next_sample[sensor_id] = (self._next_sample[sensor_id] + 1) % self._window
+        if self._samples[sensor_id] < self._window:
+            self._samples[sensor_id] += 1
+        self._last_heard[sensor_id] = timestamp
+        self.airtime_saved += airtime(DATA_RATES[DEFAULT_DATA_RATE][0], packet.length) - airtime(DATA_RATES[self._current][0], packet.length)
+        self._update_target()
+
+    def command(self, sensor_id):
+        """
+        :return: The command to send to the sensor in answer to its measurement or None if it is up to date
+        :rtype: bytes or None
+        """
+
+        tx_power = self._tx_power_for(sensor_id)
+        if self._data_rate[sensor_id] == self._target and (tx_power is None or self._tx_power[sensor_id] == tx_power):
+            return None
+        if tx_power is None:
+            tx_power = self._tx_power[sensor_id]
+        return constants.LORA_PREAMBLE + b" " + struct.pack(_FORMAT, _VERSION, DATA_RATES[self._target][1], tx_power)
+
+    def acknowledged(self, sensor_id, command):
+        """
+        Marks a command as received by the sensor.
+
+        :param bytes command: The command returned by command()
+        """
+
+        data_rate, tx_power = struct.unpack_from(_FORMAT, command, len(constants.LORA_PREAMBLE) + 1)[1:]
+        self._data_rate[sensor_id] = self._index_of(data_rate)
+        if tx_power != self._tx_power[sensor_id]:  # The samples were taken with the former TX power
+            self._samples[sensor_id] = 0
+            self._next_sample[sensor_id] = 0
+        self._tx_power[sensor_id] = tx_power
+        self.commands += 1
+
+    def forget(self, sensor_id):
+        """
+        Drops the link quality of a sensor that got (un)paired. A newly paired sensor already uses the current data rate and the maximum TX power.
+        """
+
+        self._samples[sensor_id] = 0
+        self._next_sample[sensor_id] = 0
+        self._data_rate[sensor_id] = self._current
+        self._tx_power[sensor_id] = MAX_TX_POWER
+
+    def announced(self):
+        """
+        :return: The data rate (RadioHead modem configuration index) the hub will use after the next beacon
+        :rtype: int
+        """
+
+        return DATA_RATES[self._target if self._ready() else self._current][1]
+
+    def switch(self, timestamp):
+        """
+        Switches the radio to the data rate announced (call right after the beacon) or falls back on the default data rate if a sensor got lost.
+
+        :param int timestamp: Current time in seconds
+        """
+
+        if self._ready():
+            self._set(self._target, timestamp)
+        elif self._current != DEFAULT_DATA_RATE:
+            for sensor_id in self._registry.paired_ids():
+                if timestamp - max(self._last_heard[sensor_id], self._switched) > constants.LORA_ADR_FALLBACK_TIME:
+                    print("Sensor #{} lost after data rate switch, falling back".format(sensor_id))
+                    for other_id in range(constants.LORA_MAX_PAIRED_SENSORS):
+                        self._data_rate[other_id] = DEFAULT_DATA_RATE
+                        self._tx_power[other_id] = MAX_TX_POWER
+                    self._target = DEFAULT_DATA_RATE
+                    self._set(DEFAULT_DATA_RATE, timestamp)
+                    break
+
+    def counters(self):
+        """
+        :return: Current and target data rate (index in DATA_RATES), uplink airtime saved in us, commands acknowledged and switches since boot
+        :rtype: dict
+        """
+
+        return {
+            "data_rate": self._current,
+            "target": self._target,
+            "airtime_saved": self.airtime_saved,
+            "commands": self.commands,
+            "switches": self.switches
+            }
+
+    def _best_data_rate(self, sensor_id):
+        # Fastest data rate the sensor supports with the margin or None if there are not enough samples yet
+
+        if self._samples[sensor_id] < self._window:
+            return None
+        snr = self._min_snr(sensor_id)
+        for index in range(len(DATA_RATES)):
+            if snr - DATA_RATES[index][2] >= constants.LORA_ADR_MARGIN * 4:
+                return index
+        return len(DATA_RATES) - 1
+
+    def _tx_power_for(self, sensor_id):
+        # Lowest TX power (in steps of 3 dB) that keeps the margin at the target data rate or None if there are not enough samples yet
+
+        if self._samples[sensor_id] < self._window:
+            return None
+        excess = (self._min_snr(sensor_id) - DATA_RATES[self._target][2]) // 4 - constants.LORA_ADR_MARGIN  # dB
+        tx_power = self._tx_power[sensor_id] - (excess // 3) * 3  # The samples were taken with the current TX power
+        return max(min(tx_power, MAX_TX_POWER), MIN_TX_POWER)
+
+    def _min_snr(self, sensor_id):
+        start = sensor_id * self._window
+        return min(self._snr[start:start + self._window])
+
+    def _update_target(self):
+        target = None
+        for sensor_id in self._registry.paired_ids():
+            best = self._best_data_rate(sensor_id)
+            if best is None:  # Not enough samples, keep the current target
+                return
+            target = best if target is None else max(target, best)
+        if target is not None and target != self._target:
+            print("Target data rate changed to {}".format(target))
+            self._target = target
+
+    def _ready(self):
+        if self._target == self._current:
+            return False
+        for sensor_id in self._registry.paired_ids():
+            if self._data_rate[sensor_id] != self._target:
+                return False
+        return True
+
+    def _set(self, data_rate, timestamp):
+        self._lora.set_modem_config(DATA_RATES[data_rate][0])
+        self._current = data_rate
+        self._switched = timestamp
+        self.switches += 1
+        print("Switched to data rate {}".format(data_rate))
+
+    def _index_of(self, radiohead_index):
+        for index in range(len(DATA_RATES)):
+            if DATA_RATES[index][1] == radiohead_index:
+                return index
+        return DEFAULT_DATA_RATE
+
+
+def _normalize(modem_config):
+    # Quarter dB to add to an SNR measured with the modem configuration to compare it at 125 kHz (3 dB less noise per halving of the bandwidth)
+
+    bandwidth = BANDWIDTHS[modem_config[0] >> 4]
+    offset = 0
+    while bandwidth > 125000:
+        bandwidth //= 2
+        offset += 12
+    while bandwidth < 125000:
+        bandwidth *= 2
+        offset -= 12
+    return offset
@@ -6,6 +6,15 @@ from binascii import b2a_base64
 import constants
 import http
 
+_bulk_sensor_update = None  # Whether the backend supports constants.ENDPOINT_UPDATE_SENSORS, None until it advertised its features
+_bulk_zone_update = None  # Whether the backend supports constants.ENDPOINT_UPDATE_ZONES, None until it advertised its features
+_zone_ids = None  # Cached result of get_zone_ids(cached=True), None until fetched or after the backend signaled a change
+_zones_version = None  # Version of the zones as advertised in the hub ("zones_version", see get_hub())
+_policy_version = None  # Version of the irrigation policy as advertised in the hub ("policy_version", see get_hub())
+_decision_reports = True  # Whether the backend supports constants.ENDPOINT_ADD_DECISIONS
+_sync_supported = True  # Whether the backend supports constants.ENDPOINT_SYNC
+_sync_hold = None  # Whether the backend may hold constants.ENDPOINT_SYNC, None until it advertised its features
+
 
 # HUB
 
@@ -37,14 +46,14 @@ def get_hub():
     :raises BackendError: If the HTTP request fails or the response is not a dictionary (or None)
     """
 
-    hub = http.request_handler(constants.ENDPOINT_GET_HUB, [constants.HUB_ID])
-    if hub is None:
-        raise http.BackendError("hub is None")
-    elif not isinstance(hub, dict):
-        raise http.BackendError("hub is not a dictionary")
-    else:
-        print("backend.get_hub():", hub)
-        return hub
+    return http.run(get_hub_async())
+
+
+async def get_hub_async():
+    # Async counterpart of get_hub()
+
+    hub = await http.request_handler_async(constants.ENDPOINT_GET_HUB, [constants.HUB_ID])
+    return _handle_hub(hub)
 
 
 def update_hub(is_empty, outlet_count=None):
@@ -57,24 +66,103 @@ def update_hub(is_empty, outlet_count=None):
     :raises BackendError: if the HTTP request fails (e.g. the hub does not get updated on the backend)
     """
 
-    payload = { "bucket_empty": is_empty }
-    if outlet_count is not None:
-        payload["outlet_count"] = outlet_count
-    http.request_handler(constants.ENDPOINT_UPDATE_HUB, [constants.HUB_ID], json_dict=payload)
-    print("backend.update_hub({}, {})".format(is_empty, outlet_count))
+    http.run(update_hub_async(is_empty, outlet_count))
+
+
+async def update_hub_async(is_empty, outlet_count=None):
+    # Async counterpart of update_hub()
+
+    await http.request_handler_async(constants.ENDPOINT_UPDATE_HUB, [constants.HUB_ID], json_dict=_hub_payload(is_empty, outlet_count))
+    print("backend.update_hub_async({}, {})".format(is_empty, outlet_count))
+
+
+def sync_hold_supported():
+    """
+    :return: Whether sync_async() may be held by the backend (see there), as advertised in the features of this hub (see get_hub())
+    :rtype: bool
+    """
+
+    return bool(_sync_supported and _sync_hold)
+
+
+async def sync_async(is_empty=None, zone_states=None, deleted_sensor_ids=None, hold=0):
+    """
+    Synchronize this hub with the backend in a single request to the combined endpoint, instead of get_hub(), get_pending_zone_ids(), get_sensor_ids(),
+    update_hub(), update_zone() (or update_zones()) and delete_sensor(): Sends the state of this hub that changed since the last synchronization and receives the state of the backend.
+    The zone IDs cached for get_zone_ids() are refreshed along.
+
+    :param bool is_empty: Whether the bucket is empty, if this changed since the last synchronization, default is None (not sent)
+    :param dict zone_states: is_watering status by zone ID of the zones that changed since the last synchronization, default is None
+    :param set deleted_sensor_ids: IDs of the sensors that should be deactivated (deleted) on the backend, default is None
+    :param int hold: Time in milliseconds the backend may hold the response until the state of this hub changes on its side (e.g. a zone becomes pending or a sensor is added),
+                     if sync_hold_supported(), default is 0 (answer right away)
+    :return: This hub as persisted on the backend (see get_hub()), the pending zone IDs and the activated sensor IDs (after the deletions)
+             or None if the backend does not support the combined endpoint (nothing was sent, use the single endpoints instead)
+    :rtype: (dict, set, set) or None
+    :raises BackendError: if the HTTP request fails or the response is erroneous
+    """
+
+    global _sync_supported, _zone_ids
+
+    if not _sync_supported:
+        return None
+    payload = _zones_payload(zone_states or {})
+    if is_empty is not None:
+        payload["bucket_empty"] = is_empty
+    if deleted_sensor_ids:
+        payload["deleted_sensors"] = [_transform_id_to_backend(sensor_id) for sensor_id in deleted_sensor_ids]
+    if hold:
+        payload["hold"] = hold
+    try:
+        state = await http.request_handler_async(constants.ENDPOINT_SYNC, json_dict=payload, timeout=constants.HTTP_TIMEOUT + hold)
+    except http.NotFoundError:
+        print("Backend does not support combined synchronization, falling back to single requests")
+        _sync_supported = False
+        return None
+    if not isinstance(state, dict):
+        raise http.BackendError("state is not a dictionary")
+    try:
+        hub = _handle_hub(state["hub"])
+        pending_zone_ids = _handle_pending_zones(state["pending_zones"])
+        _zone_ids = _handle_list(state["zones"])
+        sensor_ids = _handle_list(state["sensors"])
+    except KeyError as e:
+        raise http.BackendError("state dictionary does not contain key {}".format(e))
+    return hub, pending_zone_ids, sensor_ids
 
 
 # ZONES
 
-def get_zone_ids():
+def cached_zone_ids():
     """
+    :return: The zone IDs cached by get_zone_ids() or sync_async() without making a request, None if there are none (or the backend signaled a change)
+    :rtype: set of ints or None
+    """
+
+    return _zone_ids
+
+
+def get_zone_ids(cached=False):
+    """
+    :param bool cached: If True, return the zone IDs requested last, unless the backend signaled a change since (a new zones_version of the hub,
+                        a pending zone that is not in the list or a zone that was not found), default is False
     :return: The activated zone IDs associated with this hub as persisted on the backend - 1 (zone 1 on the backend is zone 0 on the hub).
     :rtype: set of ints
     :raises BackendError: If the HTTP request fails or the response is erroneous (see _handle_list)
     """
 
-    zones = http.request_handler(constants.ENDPOINT_GET_ALL_ZONES, [constants.HUB_ID])
-    return _handle_list(zones)
+    return http.run(get_zone_ids_async(cached))
+
+
+async def get_zone_ids_async(cached=False):
+    # Async counterpart of get_zone_ids()
+
+    global _zone_ids
+
+    if not cached or _zone_ids is None:
+        zones = await http.request_handler_async(constants.ENDPOINT_GET_ALL_ZONES, [constants.HUB_ID])
+        _zone_ids = _handle_list(zones)
+    return _zone_ids
 
 
 def get_pending_zone_ids():
@@ -84,13 +172,14 @@ def get_pending_zone_ids():
     :raises BackendError: If the HTTP request fails or the response is not a list (or None)
     """
 
-    pending_zones = http.request_handler(constants.ENDPOINT_GET_ALL_PENDING_ZONES, [constants.HUB_ID])
-    if pending_zones is None:
-        raise http.BackendError("pending_zones is None")
-    elif not isinstance(pending_zones, list):
-        raise http.BackendError("pending_zones is not a list")
-    else:
-        return set(map(_transform_id_from_backend, pending_zones))
+    return http.run(get_pending_zone_ids_async())
+
+
+async def get_pending_zone_ids_async():
+    # Async counterpart of get_pending_zone_ids()
+
+    pending_zones = await http.request_handler_async(constants.ENDPOINT_GET_ALL_PENDING_ZONES, [constants.HUB_ID])
+    return _handle_pending_zones(pending_zones)
 
 
 def update_zone(zone_id, is_watering):
@@ -102,10 +191,106 @@ def update_zone(zone_id, is_watering):
     :return: None
     :raises BackendError: if the HTTP request fails (e.g. the zone does not get updated on the backend)
     """
-    
-    query_dict = { "hub_id": constants.HUB_ID, "zone_id": _transform_id_to_backend(zone_id) }
-    payload = { "is_watering": is_watering }
-    http.request_handler(constants.ENDPOINT_UPDATE_ZONE, query_dict=query_dict, json_dict=payload)
+
+    http.run(update_zone_async(zone_id, is_watering))
+
+
+async def update_zone_async(zone_id, is_watering):
+    # Async counterpart of update_zone()
+
+    try:
+        await http.request_handler_async(constants.ENDPOINT_UPDATE_ZONE, query_dict=_query_dict(zone_id), json_dict={ "is_watering": is_watering })
+    except http.NotFoundError:
+        invalidate_zone_ids()  # The zone got deleted
+        raise
+
+
+def update_zones(zone_states):
+    """
+    Update the is_watering status of several zones in one request to the bulk endpoint, if the backend advertised it in the features of this hub (see get_hub()).
+    The zones are encoded as a compact JSON array of [zone_id, is_watering] arrays.
+
+    :param dict zone_states: is_watering status by zone ID (as this hub refers to it)
+    :return: True if the zones were updated, False if the backend does not support the bulk endpoint (nothing was sent, use update_zone() instead)
+    :rtype: bool
+    :raises BackendError: if the HTTP request fails
+    """
+
+    return http.run(update_zones_async(zone_states))
+
+
+async def update_zones_async(zone_states):
+    # Async counterpart of update_zones()
+
+    global _bulk_zone_update
+
+    if not _bulk_zone_update:
+        return False
+    try:
+        await http.request_handler_async(constants.ENDPOINT_UPDATE_ZONES, json_dict=_zones_payload(zone_states))
+    except http.NotFoundError:
+        print("Backend does not support bulk zone updates, falling back to single updates")
+        _bulk_zone_update = False
+        return False
+    return True
+
+
+def invalidate_zone_ids():
+    """
+    Drop the zone IDs cached by get_zone_ids(), so the next call requests them again.
+    """
+
+    global _zone_ids
+
+    _zone_ids = None
+
+
+# IRRIGATION POLICY
+
+def policy_version():
+    """
+    :return: The version of the irrigation policy as advertised by the backend in the last response of get_hub() or None
+    :rtype: int or None
+    """
+
+    return _policy_version
+
+
+async def get_policy_async():
+    """
+    :return: The irrigation policy of this hub, see controller.IrrigationController.set_policy()
+    :rtype: dictionary
+    :raises BackendError: If the HTTP request fails or the response is not a dictionary (or None)
+    """
+
+    policy = await http.request_handler_async(constants.ENDPOINT_GET_POLICY, [constants.HUB_ID])
+    if not isinstance(policy, dict):
+        raise http.BackendError("policy is not a dictionary")
+    return policy
+
+
+async def add_decisions_async(decisions):
+    """
+    Report the decisions of the irrigation controller, encoded as a compact JSON array of [timestamp, zone_id, is_watering, moisture, reason] arrays.
+
+    :param list decisions: Decisions as returned by controller.IrrigationController.decisions()
+    :return: True if the decisions were sent, False if the backend does not support the endpoint (they can be dropped)
+    :rtype: bool
+    :raises BackendError: if the HTTP request fails
+    """
+
+    global _decision_reports
+
+    if not _decision_reports:
+        return False
+    payload = { "hub_id": constants.HUB_ID, "decisions": [[decision[0], _transform_id_to_backend(decision[1])] + decision[2:] for decision in decisions] }
+    try:
+        await http.request_handler_async(constants.ENDPOINT_ADD_DECISIONS, json_dict=payload)
+    except http.NotFoundError:
+        print("Backend does not support decision reports")
+        _decision_reports = False
+        return False
+    return True
 
 
 # SENSORS
@@ -113,37 +298,141 @@ def update_zone(zone_id, is_watering):
 def add_sensor(sensor_id):
     # TODO write docstring
 
-    payload = { "hub_id": constants.HUB_ID, "zone_id": _transform_id_to_backend(sensor_id) }
-    http.request_handler(constants.ENDPOINT_ADD_SENSOR, json_dict=payload)
+    http.run(add_sensor_async(sensor_id))
+
+
+async def add_sensor_async(sensor_id):
+    # Async counterpart of add_sensor()
+
+    await http.request_handler_async(constants.ENDPOINT_ADD_SENSOR, json_dict=_sensor_payload(sensor_id))
 
 
 def get_sensor_ids():
     # TODO write docstring
 
-    sensors = http.request_handler(constants.ENDPOINT_GET_ALL_SENSORS, [constants.HUB_ID])
-    return _handle_list(sensors)
+    return http.run(get_sensor_ids_async())
 
 
+async def get_sensor_ids_async():
+    # Async counterpart of get_sensor_ids()
+
+    sensors = await http.request_handler_async(constants.ENDPOINT_GET_ALL_SENSORS, [constants.HUB_ID])
+    return _handle_list(sensors)
+
 
 def update_sensor(data):
     """
-    # TODO rewrite docstring
     Send received sensor data to the backend.
-    Uses the data cache in sensors.py, a list of namedtuples containing the keys 'sensor_id', 'moisture' and 'battery'
 
+    :param dict data: Measurement containing the keys 'sensor_id', 'moisture' and 'battery'
     :raises BackendError: if the HTTP request fails
     """
 
-    query_dict = { "hub_id": constants.HUB_ID, "zone_id": _transform_id_to_backend(data["sensor_id"]) }
-    payload = { "moisture_value": data["moisture"], "battery": data["battery"] }
-    http.request_handler(constants.ENDPOINT_UPDATE_SENSOR, query_dict=query_dict, json_dict=payload)
+    http.run(update_sensor_async(data))
+
+
+async def update_sensor_async(data):
+    # Async counterpart of update_sensor()
+
+    await http.request_handler_async(constants.ENDPOINT_UPDATE_SENSOR, query_dict=_query_dict(data["sensor_id"]), json_dict=_measurement_payload(data))
+
+
+async def update_sensors_async(data_list):
+    """
+    Send several measurements in one request to the bulk endpoint, if the backend advertised it in the features of this hub (see get_hub()).
+    The measurements are encoded as a compact JSON array of [zone_id, moisture_value, battery] arrays.
+
+    :param list data_list: Measurements as dictionaries containing the keys 'sensor_id', 'moisture' and 'battery'
+    :return: True if the measurements were sent, False if the backend does not support the bulk endpoint (nothing was sent, use update_sensor_async() instead)
+    :rtype: bool
+    :raises BackendError: if the HTTP request fails
+    """
+
+    global _bulk_sensor_update
+
+    if not _bulk_sensor_update:
+        return False
+    payload = { "hub_id": constants.HUB_ID, "sensors": [[_transform_id_to_backend(data["sensor_id"]), data["moisture"], data["battery"]] for data in data_list] }
+    try:
+        await http.request_handler_async(constants.ENDPOINT_UPDATE_SENSORS, json_dict=payload)
+    except http.NotFoundError:
+        print("Backend does not support bulk sensor updates, falling back to single updates")
+        _bulk_sensor_update = False
+        return False
+    return True
 
 
 def delete_sensor(sensor_id):
     # TODO write docstring
 
-    query_dict = { "hub_id": constants.HUB_ID, "zone_id": _transform_id_to_backend(sensor_id) }
-    http.request_handler(constants.ENDPOINT_DELETE_SENSOR, query_dict=query_dict)
+    http.run(delete_sensor_async(sensor_id))
+
+
+async def delete_sensor_async(sensor_id):
+    # Async counterpart of delete_sensor()
+
+    await http.request_handler_async(constants.ENDPOINT_DELETE_SENSOR, query_dict=_query_dict(sensor_id))
+
+
+# PAYLOADS AND RESPONSES
+
+def _hub_payload(is_empty, outlet_count):
+    payload = { "bucket_empty": is_empty }
+    if outlet_count is not None:
+        payload["outlet_count"] = outlet_count
+    return payload
+
+
+def _zones_payload(zone_states):
+    return { "hub_id": constants.HUB_ID, "zones": [[_transform_id_to_backend(zone_id), is_watering] for zone_id, is_watering in zone_states.items()] }
+
+
+def _sensor_payload(sensor_id):
+    return { "hub_id": constants.HUB_ID, "zone_id": _transform_id_to_backend(sensor_id) }
+
+
+def _measurement_payload(data):
+    return { "moisture_value": data["moisture"], "battery": data["battery"] }
+
+
+def _query_dict(zone_id):
+    return { "hub_id": constants.HUB_ID, "zone_id": _transform_id_to_backend(zone_id) }
+
+
+def _handle_hub(hub):
+    global _bulk_sensor_update, _bulk_zone_update, _sync_hold, _policy_version, _zones_version
+
+    if hub is None:
+        raise http.BackendError("hub is None")
+    elif not isinstance(hub, dict):
+        raise http.BackendError("hub is not a dictionary")
+    else:
+        print("backend.get_hub():", hub)
+        features = hub.get("features")
+        if _bulk_sensor_update is None and isinstance(features, list):
+            _bulk_sensor_update = constants.FEATURE_BULK_SENSOR_UPDATE in features
+        if _bulk_zone_update is None and isinstance(features, list):
+            _bulk_zone_update = constants.FEATURE_BULK_ZONE_UPDATE in features
+        if _sync_hold is None and isinstance(features, list):
+            _sync_hold = constants.FEATURE_SYNC_HOLD in features
+        _policy_version = hub.get("policy_version")
+        zones_version = hub.get("zones_version")
+        if zones_version != _zones_version:
+            _zones_version = zones_version
+            invalidate_zone_ids()
+        return hub
+
+
+def _handle_pending_zones(pending_zones):
+    if pending_zones is None:
+        raise http.BackendError("pending_zones is None")
+    elif not isinstance(pending_zones, list):
+        raise http.BackendError("pending_zones is not a list")
+    else:
+        pending_zone_ids = set(map(_transform_id_from_backend, pending_zones))
+        if _zone_ids is not None and not pending_zone_ids.issubset(_zone_ids):
+            invalidate_zone_ids()  # A zone was activated since the zone IDs were cached
+        return pending_zone_ids
 
 
 def _handle_list(input):
@@ -11,19 +11,32 @@ BACKEND_HOST = "127.0.0.1"
 BACKEND_PORT = 443
 SSL_KEY = "key"
 SSL_CERT = "cert"
+HTTP_SEND_BUFFER_SIZE = const(512)     # A request with 15 measurements and the session token, larger ones are written in parts
+HTTP_RECEIVE_BUFFER_SIZE = const(512)  # Longest status or header line of a response (the session token), bodies longer than the rest are read into a new buffer
+HTTP_POOL_SIZE = const(2)
+HTTP_CACHE_SIZE = const(8)  # Responses to GET requests kept for conditional requests
 ENDPOINT_REGISTER_HUB = ("POST", "hubRegistration/postHubRegistration")
 ENDPOINT_GET_HUB = ("GET", "hub/getHub")
 ENDPOINT_UPDATE_HUB = ("PUT", "hub/updateHub")
 ENDPOINT_GET_ALL_ZONES = ("GET", "zone/getAllZonesByHubId")
 ENDPOINT_GET_ALL_PENDING_ZONES = ("GET", "zone/getAllPendingZones")
 ENDPOINT_UPDATE_ZONE = ("PUT", "zone/updateZone")
+ENDPOINT_UPDATE_ZONES = ("PUT", "zone/updateZones")
 ENDPOINT_ADD_SENSOR = ("POST", "sensor/addSensor")
 ENDPOINT_GET_ALL_SENSORS = ("GET", "sensor/getAllSensorsByHubId")
 ENDPOINT_UPDATE_SENSOR = ("PUT", "sensor/updateSensor")
+ENDPOINT_UPDATE_SENSORS = ("PUT", "sensor/updateSensors")
 ENDPOINT_DELETE_SENSOR = ("DELETE", "sensor/")
+ENDPOINT_GET_POLICY = ("GET", "hub/getPolicy")
+ENDPOINT_ADD_DECISIONS = ("POST", "zone/addDecisions")
+ENDPOINT_SYNC = ("POST", "hub/sync")
+FEATURE_BULK_SENSOR_UPDATE = "updateSensors"  # Advertised in the "features" of the hub, if the backend supports ENDPOINT_UPDATE_SENSORS
+FEATURE_BULK_ZONE_UPDATE = "updateZones"  # Advertised in the "features" of the hub, if the backend supports ENDPOINT_UPDATE_ZONES
+FEATURE_SYNC_HOLD = "syncHold"  # Advertised in the "features" of the hub, if the backend may hold ENDPOINT_SYNC until the state of the hub changes (long polling)
 
 # LoRa
 LORA_PREAMBLE = b"BLOOM"
+LORA_BINARY_PREAMBLE = const(0xb0)  # First byte of binary messages, the lower nibble holds the version
 LORA_MAX_PAIRED_SENSORS = const(15)
 LORA_BROADCAST_ADDRESS = const(255)
 LORA_FREQUENCY = const(868)
@@ -34,8 +47,17 @@ LORA_FLAG_PAIRING_REQ = const(0b0001)
 LORA_FLAG_PAIRING_ACK = const(0b0010)
 LORA_FLAG_ADDRESS_AVL = const(0b0100)
 LORA_FLAG_SHUTDOWN_ORDER = const(0b1000)
+LORA_FLAG_SCHEDULE_BEACON = const(0b0011)
+LORA_FLAG_LINK_COMMAND = const(0b0101)
 LORA_BIT_MASK = const(0b00001111)
 LORA_DATA_CACHE_SIZE = const(10)
+LORA_COLLECT_BATCH_SIZE = const(5)
+LORA_CAD_RETRIES = const(5)
+LORA_DISCOVERY_PROBES = const(5)  # Probes per Hub ID, see hub._discover_address()
+LORA_DUTY_CYCLE = const(100)  # 1 % of the time on air (868 MHz g1 sub-band)
+LORA_SCHEDULE_SLOTS = const(60)
+LORA_ADR_WINDOW = const(8)  # Measurements per sensor
+LORA_ADR_MARGIN = const(10)  # dB
 
 # NVS
 NVS_NAMESPACE = "configuration"
@@ -47,11 +69,47 @@ NVS_KEY_PAIRED_SENSOR_PREFIX = "lora_sens_id_"
 NVS_KEY_REBOOT_COUNTER = "reboot_counter"
 NVS_KEY_LAST_REBOOT_TIMESTAMP = "last_reboot"
 
+# Journal
+JOURNAL_FILE = "journal"
+JOURNAL_CAPACITY = const(256)
+JOURNAL_HEADER_INTERVAL = const(16)  # Acknowledgements per header write, see journal.Journal
+UPLOAD_BATCH_SIZE = const(32)
+
+# Irrigation controller
+POLICY_FILE = "policy"
+CONTROLLER_MAX_DECISIONS = const(32)
+
 # Times
-BACKEND_CALL_DELAY = const(2000)        #  2 seconds
+BACKEND_POLL_MIN_DELAY = const(1000)    #  1 second (while zones are pending or changed)
+BACKEND_POLL_MAX_DELAY = const(30000)   # 30 seconds (idle)
+BACKEND_ADDRESS_TTL = const(3600000)    #  1 hour
+HTTP_TIMEOUT = const(10000)             # 10 seconds
 MAX_FAILED_REQUESTS = const(3)          #  3 times
 EMPTY_DELAY = const(3)                  #  3 seconds
-LORA_MAX_SILENT_TIME = const(7260)      #  2 hours 1 minute (2 transmits may be missed)
+RADIO_TASK_DELAY = const(50)            # 50 milliseconds
+UPLOAD_TASK_DELAY = const(100)          # 100 milliseconds
+WATERING_TASK_DELAY = const(500)        # 500 milliseconds
+DISPLAY_TASK_DELAY = const(200)         # 200 milliseconds
+BUTTON_TASK_DELAY = const(10)           # 10 milliseconds
+DISPLAY_HOLD_TIME = const(5000)         #  5 seconds
+UPLOAD_BATCH_WINDOW = const(10)         # 10 seconds
+# The sensors transmit once per LORA_SCHEDULE_PERIOD (sent to them in the schedule, see schedule.SlotTable), so moisture
+# readings reach the controller and silent sensors are noticed only that often. Shorten it for faster reactions at the cost of air time
+LORA_SCHEDULE_PERIOD = const(3600)      #  1 hour (transmit interval of the sensors, at most 65535)
+LORA_MAX_SILENT_TIME = const(2 * LORA_SCHEDULE_PERIOD + 60) # 2 hours 1 minute (2 transmits may be missed)
+LORA_DUPLICATE_WINDOW = const(30000)    # 30 seconds
+LORA_DISCOVERY_TIMEOUT = const(10000)   # 10 seconds
+LORA_DISCOVERY_ACK_TIMEOUT = const(60)  # 60 milliseconds (extended by a random delay of up to the same length, an acknowledgement is 31 ms on air)
+LORA_BACKOFF_MIN = const(20)            # 20 milliseconds
+LORA_BACKOFF_MAX = const(1000)          #  1 second
+LORA_DUTY_CYCLE_WINDOW = const(3600000) #  1 hour
+LORA_BEACON_INTERVAL = const(900000)    # 15 minutes
+LORA_ADR_FALLBACK_TIME = const(LORA_MAX_SILENT_TIME) # 2 hours 1 minute (2 transmits may be missed)
+REGISTRY_FLUSH_INTERVAL = const(600000) # 10 minutes
+# A sensor's last-seen timestamp is persisted once it moved on by more than REGISTRY_FLUSH_THRESHOLD (see registry.SensorRegistry),
+# so after an unclean reboot it lags behind by up to that much. It must be longer than LORA_SCHEDULE_PERIOD (or every measurement is written),
+# but leave a full period within LORA_MAX_SILENT_TIME (or a sensor may be taken for silent right after the reboot, before its next transmit)
+REGISTRY_FLUSH_THRESHOLD = const(LORA_MAX_SILENT_TIME - LORA_SCHEDULE_PERIOD) # 1 hour 1 minute
 
 WLAN_TIMEOUT = const(30000)             # 30 seconds
 USER_KEY_TIMEOUT = const(60000)         # 60 seconds
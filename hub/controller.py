@@ -0,0 +1,184 @@
+# BLOOM Hub
+# Closed-loop irrigation controller
+# Author: Simon Aschenbrenner
+
+from array import array
+import constants
+import ujson
+
+# Reasons of the decisions
+REASON_DRY = "dry"          # Moisture fell below the lower threshold
+REASON_WET = "wet"          # Moisture reached the upper threshold
+REASON_MAX_RUN = "max_run"  # Zone watered for the maximum run-time
+REASON_POLICY = "policy"    # Zone removed from the policy
+
+_POLICY_KEYS = ("zone_id", "on_below", "off_above", "max_run", "cool_down")
+
+
+class IrrigationController(object):
+    """
+    Waters the zones on the hub, driven by the moisture measured by their sensors (sensor n measures zone n), so no backend round-trip is needed and watering goes on offline.
+
+    The backend owns the policy, a small document with the rules of each zone (see set_policy()):
+    A zone starts watering when a new measurement is below on_below, but not within cool_down seconds after it stopped.
+    It stops when a measurement reaches off_above (hysteresis) or after max_run seconds, whatever comes first.
+    The policy is stored in constants.POLICY_FILE, so it survives a reboot without backend.
+    Every decision is queued (up to constants.CONTROLLER_MAX_DECISIONS) until the backend acknowledged it, see decisions().
+    """
+
+    def __init__(self, zone_count, path=constants.POLICY_FILE):
+        """
+        :param int zone_count: Number of zones (outlets) of the hub
+        :param str path: Path of the policy file, default is constants.POLICY_FILE
+        """
+
+        self.zone_count = zone_count
+        self.path = path
+        self.version = None  # Version of the policy, None if there is none
+        self.dropped = 0     # Decisions dropped since boot because the queue was full
+        self._rules = [None] * zone_count  # Tuples of on_below, off_above, max_run and cool_down per zone
+        self._watering = 0  # Bit n is set if zone n is watered
+        self._started = array("l", [0] * zone_count)  # Times in seconds
+        self._stopped = array("l", [0] * zone_count)
+        self._measured = array("l", [0] * zone_count)
+        self._moisture = [None] * zone_count
+        self._decisions = []
+        try:
+            with open(self.path) as file:
+                self._apply(ujson.load(file), 0)
+            print("Irrigation policy version {} loaded".format(self.version))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print("No irrigation policy:", e)
+
+    def set_policy(self, policy, timestamp):
+        """
+        Apply and store a new policy. Zones that are not part of it anymore stop watering.
+
+        :param dict policy: { "version": int, "zones": [{ "zone_id": int, "on_below": float, "off_above": float, "max_run": int, "cool_down": int }, ...] }
+                            with the zone IDs of the backend and moisture between 0.0 and 1.0, times in seconds
+        :param int timestamp: Current time in seconds
+        :raises ValueError: if the policy is malformed (the current policy stays in place)
+        """
+
+        try:
+            self._apply(policy, timestamp)
+        except (KeyError, TypeError) as e:
+            raise ValueError("Malformed policy: {}".format(e))
+        with open(self.path, "w") as file:
+            ujson.dump(policy, file)
+        print("Irrigation policy version {} applied".format(self.version))
+
+    def observe(self, zone_id, moisture, timestamp):
+        """
+        Decide on a zone upon a new measurement of its sensor.
+
+        :param int zone_id: ID of the zone (and its sensor)
+        :param float moisture: Moisture between 0.0 and 1.0
+        :param int timestamp: Time of the measurement in seconds
+        :return: True if the zone started or stopped watering
+        :rtype: bool
+        """
+
+        if not 0 <= zone_id < self.zone_count:
+            return False
+        self._moisture[zone_id] = moisture
+        self._measured[zone_id] = timestamp
+        return self._evaluate(zone_id, timestamp)
+
+    def update(self, timestamp):
+        """
+        Enforce the maximum run-time, call periodically.
+
+        :param int timestamp: Current time in seconds
+        :return: True if a zone stopped watering
+        :rtype: bool
+        """
+
+        changed = False
+        for zone_id in range(self.zone_count):
+            if self._is_watering(zone_id):
+                changed |= self._evaluate(zone_id, timestamp)
+        return changed
+
+    def active_zones(self):
+        """
+        :return: The IDs of the zones the controller waters
+        :rtype: set of ints
+        """
+
+        return set(zone_id for zone_id in range(self.zone_count) if self._is_watering(zone_id))
+
+    def decisions(self):
+        """
+        :return: The decisions not yet acknowledged by the backend, oldest first, as lists of timestamp, zone ID (as the hub refers to it), is_watering, moisture and reason
+        :rtype: list
+        """
+
+        return self._decisions
+
+    def acknowledge(self, decisions):
+        """
+        Remove decisions after the backend accepted them.
+
+        :param list decisions: Decisions as returned by decisions() (a copy, as more may be queued or dropped in the meantime)
+        """
+
+        self._decisions = [decision for decision in self._decisions if not any(decision is acknowledged for acknowledged in decisions)]
+
+    def counters(self):
+        """
+        :return: Version of the policy, zones watered, decisions pending and decisions dropped since boot
+        :rtype: dict
+        """
+
+        return { "version": self.version, "watering": len(self.active_zones()), "pending": len(self._decisions), "dropped": self.dropped }
+
+    def _apply(self, policy, timestamp):
+        rules = [None] * self.zone_count
+        for zone in policy["zones"]:
+            zone_id, on_below, off_above, max_run, cool_down = (zone[key] for key in _POLICY_KEYS)
+            zone_id -= 1  # Zone 1 on the backend is zone 0 on the hub
+            if not on_below < off_above or max_run <= 0 or cool_down < 0:
+                raise ValueError("Invalid rules for zone {}".format(zone_id + 1))
+            if 0 <= zone_id < self.zone_count:
+                rules[zone_id] = (on_below, off_above, max_run, cool_down)
+        self._rules = rules
+        self.version = policy["version"]
+        for zone_id in range(self.zone_count):
+            if rules[zone_id] is None and self._is_watering(zone_id):
+                self._set(zone_id, False, REASON_POLICY, timestamp)
+
+    def _evaluate(self, zone_id, timestamp):
+        rules = self._rules[zone_id]
+        moisture = self._moisture[zone_id]
+        if rules is None or moisture is None:
+            return False
+        on_below, off_above, max_run, cool_down = rules
+        if self._is_watering(zone_id):
+            if moisture >= off_above and self._measured[zone_id] >= self._started[zone_id]:
+                self._set(zone_id, False, REASON_WET, timestamp)
+            elif timestamp - self._started[zone_id] >= max_run:
+                self._set(zone_id, False, REASON_MAX_RUN, timestamp)
+            else:
+                return False
+            return True
+        if moisture < on_below and self._measured[zone_id] > self._stopped[zone_id] and timestamp - self._stopped[zone_id] >= cool_down:
+            self._set(zone_id, True, REASON_DRY, timestamp)  # Only on a measurement taken after the zone stopped
+            return True
+        return False
+
+    def _is_watering(self, zone_id):
+        return bool((self._watering >> zone_id) & 1)
+
+    def _set(self, zone_id, is_watering, reason, timestamp):
+        if is_watering:
+            self._watering |= 1 << zone_id
+            self._started[zone_id] = timestamp
+        else:
+            self._watering &= ~(1 << zone_id)
+            self._stopped[zone_id] = timestamp
+        if len(self._decisions) >= constants.CONTROLLER_MAX_DECISIONS:
+            del self._decisions[0]
+            self.dropped += 1
+        self._decisions.append([timestamp, zone_id, is_watering, self._moisture[zone_id], reason])
+        print("Zone {} {} ({})".format(zone_id, "started" if is_watering else "stopped", reason))
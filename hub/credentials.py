@@ -0,0 +1,81 @@
+# BLOOM Hub
+# Backend credentials and endpoint cache
+# Author: Simon Aschenbrenner
+
+from time import ticks_add, ticks_diff, ticks_ms
+import constants
+import socket
+import ssl
+
+_key = None
+_cert = None
+_context = None  # Prebuilt SSL context, only used if the port supports ssl.SSLContext
+_address = None
+_address_deadline = 0
+_counters = { "credentials_hits": 0, "credentials_misses": 0, "address_hits": 0, "address_misses": 0 }
+
+
+def wrap_socket(sckt, do_handshake=True):
+    """
+    Wraps a (connecting) socket for TLS with the SSL key and certificate, which are only read from flash on first use.
+
+    :param socket sckt: Socket connected (or connecting) to the backend
+    :param bool do_handshake: False for non-blocking sockets, the handshake is then done by the first reads and writes, default is True
+    :return: The ssl-wrapped socket
+    :raises OSError:
+    """
+
+    global _cert, _context, _key
+
+    if _key is None or _cert is None:
+        _counters["credentials_misses"] += 1
+        with open(constants.SSL_KEY, 'rb') as f:
+            _key = f.read()
+        with open(constants.SSL_CERT, 'rb') as f:
+            _cert = f.read()
+        if hasattr(ssl, "SSLContext"):
+            _context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            _context.verify_mode = ssl.CERT_NONE  # Same behaviour as ssl.wrap_socket() without cadata
+            _context.load_cert_chain(_cert, _key)
+    else:
+        _counters["credentials_hits"] += 1
+    if _context is not None:
+        return _context.wrap_socket(sckt, server_hostname=constants.BACKEND_HOST, do_handshake_on_connect=do_handshake)
+    return ssl.wrap_socket(sckt, server_hostname=constants.BACKEND_HOST, key=_key, cert=_cert, do_handshake=do_handshake)
+
+
+def address():
+    """
+    :return: The address info of the backend as returned by socket.getaddrinfo(), which is only resolved again after constants.BACKEND_ADDRESS_TTL or invalidate_address()
+    :rtype: tuple
+    :raises OSError: if the backend host can not be resolved
+    """
+
+    global _address, _address_deadline
+
+    if _address is not None and ticks_diff(_address_deadline, ticks_ms()) > 0:
+        _counters["address_hits"] += 1
+    else:
+        _counters["address_misses"] += 1
+        _address = socket.getaddrinfo(constants.BACKEND_HOST, constants.BACKEND_PORT, 0, socket.SOCK_STREAM)[0]
+        _address_deadline = ticks_add(ticks_ms(), constants.BACKEND_ADDRESS_TTL)
+    return _address
+
+
+def invalidate_address():
+    """
+    Forget the resolved backend address (e.g. after a failed connect), so it will be resolved again on the next call of address().
+    """
+
+    global _address
+
+    _address = None
+
+
+def counters():
+    """
+    :return: Cache hits and misses for the SSL credentials and the backend address since boot
+    :rtype: dict
+    """
+
+    return dict(_counters)
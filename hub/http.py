@@ -7,9 +7,11 @@
 # (15.12.21, MIT License)
 
 import constants
-import ujson
+import credentials
+import errno
 import socket
-import ssl
+import uasyncio as asyncio
+import ujson
 
 
 class BackendError(Exception):
@@ -18,26 +20,67 @@ class BackendError(Exception):
 class UnauthorizedError(BackendError):
     pass
 
+class NotFoundError(BackendError):
+    pass
+
+_IDEMPOTENT_METHODS = ("GET", "HEAD")  # Sent again if a kept alive connection fails before a response arrived
 _current_session_token = ""
+_cache = {}  # Path of a GET request of the current session -> entity tag and data of its last response, see request_handler_async()
+_cache_hits = 0    # Conditional requests answered with 304 Not Modified since boot
+_cache_misses = 0  # GET requests answered with a body that carried an ETag since boot
 
         
 def request_handler(endpoint, params_list=None, query_dict=None, json_dict=None, auth_header=None):
     """
-    Outside facing general HTTP request handler. Use this function to make any requests to the backend.
+    Outside facing general HTTP request handler for code running outside of the main loop (e.g. the setup routines).
+    Blocking wrapper of request_handler_async(), see there for parameters, return value and exceptions.
+    Must not be called from within a task of the main loop, use request_handler_async() there.
+
+    :raises RuntimeError: if called from within a task
+    """
+
+    return run(request_handler_async(endpoint, params_list, query_dict, json_dict, auth_header))
+
+
+def run(coroutine):
+    """
+    Runs coroutine (e.g. of request_handler_async() or of the async functions of the backend module) to completion, for code running outside of the main loop.
+
+    :return: The return value of coroutine
+    :raises RuntimeError: if called from within a task, await coroutine there instead
+    """
+
+    try:
+        asyncio.current_task()
+    except RuntimeError:  # No task running, as it should be
+        return asyncio.run(coroutine)
+    coroutine.close()
+    raise RuntimeError("Blocking request called from a task, use its async counterpart")
+
+
+async def request_handler_async(endpoint, params_list=None, query_dict=None, json_dict=None, auth_header=None, timeout=constants.HTTP_TIMEOUT):
+    """
+    Outside facing general HTTP request handler. Use this function (or request_handler()) to make any requests to the backend.
+    Several requests may be in flight at the same time (e.g. from different tasks or via asyncio.gather()), they share a pool of up to constants.HTTP_POOL_SIZE connections.
 
     :param str endpoint: A tuple containing the HTTP method and the path without leading and trailing '/', e.g. ("GET", "hub/getHub")
     :param list params_list: Optional list of parameters (e.g. IDs) to be added to the URL seperated by '/', default is None
     :param dict query_dict: Optional dictionary of paramaters as key/value-pairs to be added to the URL using a query string (see make_query_string() for more details)
     :param dict json_dict: Optional dictionary that should be encoded as a JSON string and added in the request body, default is None
     :param dict auth_header: Optional dictionary of headers (e.g. for basic authentication), will be overriden with a Authorization header for token based authentication with the current session token if not specified, default is None
+    :param int timeout: Time in milliseconds the complete response may take, default is constants.HTTP_TIMEOUT
     :return: The dictionary of the JSON in the HTTP response body or None if the response status code was 200 but there was no (valid) JSON in the body
     :rtype: dict or None
     :raises UnauthorizedError:
-    :raises BackendError:
-    
+    :raises NotFoundError: if the endpoint does not exist on the backend
+    :raises BackendError: also if there is no complete response within timeout
+
+    GET responses that carry an ETag (which may as well be a version counter of the backend) are cached by path, if the request was authenticated with the session token.
+    The next GET request of the path is conditional (If-None-Match), if the backend answers 304 Not Modified, a copy of the cached data is returned without reading and parsing a body again.
+    The cache is cleared when the session changes (a new token in response to a request with its own auth_header, e.g. a new login, or 401 Unauthorized).
     """
 
-    global _current_session_token
+    global _cache_hits, _cache_misses, _current_session_token
 
     method = endpoint[0]
     path = endpoint[1]
@@ -48,30 +91,77 @@ def request_handler(endpoint, params_list=None, query_dict=None, json_dict=None,
         path += make_query_string(query_dict)
     # print("Trying HTTP {} {}".format(method, path))
     # print("Payload:", json_dict)
-    if auth_header is None:
+    session = auth_header is None  # Authenticated with the session token, only those responses are cached
+    if session:
         auth_header = { "Authorization": "Bearer {}".format(_current_session_token) }
+    cached = _cache.get(path) if method == "GET" and session else None
+    if cached is not None:
+        auth_header = dict(auth_header)
+        auth_header["If-None-Match"] = cached[0]
     try:
-        response = request(method, path, json=json_dict, headers=auth_header)
-        if response.status_code == 200:
+        response = await request(method, path, json=json_dict, headers=auth_header, timeout=timeout)
+        if response.status_code == 200 or (response.status_code == 304 and cached is not None):
             new_session_token = response.token()
             if new_session_token is not None:
+                if not session and new_session_token != _current_session_token:
+                    _cache.clear()  # New session, possibly of another user
                 _current_session_token = new_session_token
+            if response.status_code == 304:
+                _cache_hits += 1
+                return _copy(cached[1])
             try:
                 data = response.json()
                 # print("Success:", data)
-                return data
             except ValueError:
                 # print("Status 200, but no valid JSON in response body:\n", response.text())
-                return None
+                data = None
+            if method == "GET" and session:
+                if response.etag is not None:
+                    _cache_misses += 1
+                _store(path, response.etag, data)
+            return data
         elif response.status_code == 401:
+            _cache.clear()
             raise UnauthorizedError("Error 401: Not authorized")
+        elif response.status_code == 404:
+            raise NotFoundError("Error 404: Not found")
         else:
             message = "Error " + str(response.status_code) + " " + response.reason.decode(response.encoding)
             raise BackendError(message)
+    except BackendError:
+        raise
     except Exception as e:
         raise BackendError(e)
 
 
+def counters():
+    """
+    :return: Conditional requests answered from the cache (hits), GET requests answered with a body that can be revalidated (misses) since boot and the number of responses cached
+    :rtype: dict
+    """
+
+    return { "hits": _cache_hits, "misses": _cache_misses, "cached": len(_cache) }
+
+
+def _copy(data):
+    # Copies the containers of parsed JSON, so callers may modify what they get without changing the cache
+
+    if isinstance(data, dict):
+        return { key: _copy(value) for key, value in data.items() }
+    if isinstance(data, list):
+        return [_copy(value) for value in data]
+    return data
+
+
+def _store(path, etag, data):
+    if etag is None:
+        _cache.pop(path, None)
+        return
+    if path not in _cache and len(_cache) >= constants.HTTP_CACHE_SIZE:
+        del _cache[next(iter(_cache))]
+    _cache[path] = (etag, _copy(data))  # The caller may modify data
+
+
 def make_query_string(dictionary):
     """
     :param dict dictionary: Dictionary of the key/value pairs that should be added to the URL
@@ -84,103 +174,456 @@ def make_query_string(dictionary):
     return query_string[:-1]
 
 
-def request(method, path, json=None, headers={}):
+async def request(method, path, json=None, headers={}, timeout=constants.HTTP_TIMEOUT):
     """
-    Makes the HTTPS request using a ssl-wrapped socket with an optional JSON payload.
-    Do not call this function directly, use request_handler() instead.
+    Makes the HTTPS request over a persistent (keep-alive) ssl-wrapped connection of the pool with an optional JSON payload.
+    A new connection is only opened if there is no idle one or the server has closed the previous one.
+    If a kept alive connection turns out to be closed, the request is sent again on a new one, unless the backend may have received it already:
+    Only GET and HEAD requests are repeated once the request was written, none once any part of the response was received.
+    If a new connection fails with an OSError (also when sending again), the backend address is resolved again for the next request, see credentials.address().
+    Do not call this function directly, use request_handler_async() instead.
 
     :param str method: HTTP method of the request ('GET', 'PUT', 'POST', etc.)
     :param str path: The full path for the requested endpoint on the webserver (without the host)
     :param dict json: Optional dictionary that should be encoded as a JSON string and added in the request body, default is None
     :param dict headers: Optional dictionary containing headers (key as header key and value as header value), default is an empty dictionary, meaning no additional headers
+    :param int timeout: Time in milliseconds the complete response may take, default is constants.HTTP_TIMEOUT
     :return: response containing the fields 'status_code' and 'reason'. The body may be accessed via text() or json() and the (new) session token may be accessed via token()
     :rtype: Response
     :raises OSError:
-    """    
-    
-    host = constants.BACKEND_HOST
-    port = constants.BACKEND_PORT
-
-    ai = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
-    ai = ai[0]
+    :raises TimeoutError: if there is no complete response within timeout
+    """
 
-    body = b""
-    sckt = socket.socket(ai[0], ai[1], ai[2])
+    connection = await _acquire()
+    fresh = not connection.is_open()  # Whether the current attempt opens a new connection
     try:
-        sckt.connect(ai[-1])
-
-        with open(constants.SSL_KEY, 'rb') as f:
-            key = f.read()
-        with open(constants.SSL_CERT, 'rb') as f:
-            cert = f.read()
-        sckt = ssl.wrap_socket(sckt, server_hostname=host, key=key, cert=cert)
-
-        sckt.write(b"%s /%s HTTP/1.0\r\n" % (method, path))
-        if not "Host" in headers:
-            sckt.write(b"Host: %s\r\n" % host)
-        for k in headers:
-            sckt.write(k)
-            sckt.write(b": ")
-            sckt.write(headers[k])
-            sckt.write(b"\r\n")
-        if json is not None:
-            body = ujson.dumps(json)
-            sckt.write(b"Content-Type: application/json\r\n")
-            sckt.write(b"Content-Length: %d\r\n" % len(body))
-        sckt.write(b"\r\n")
-        sckt.write(body)
-
-        line = sckt.readline()
-        # print(line)
-        status = line.split(None, 2)
-        status_code = int(status[1])
-        reason = ""
-        if len(status) > 2:
-            reason = status[2].rstrip()
-        session_token = ""
+        try:
+            resp = await asyncio.wait_for_ms(_exchange(connection, method, path, json, headers), timeout)
+        except (OSError, ValueError, IndexError):
+            if fresh:
+                raise
+            if connection.received or (connection.written and method not in _IDEMPOTENT_METHODS):
+                raise  # The backend may have processed the request, sending it again could e.g. store measurements twice
+            # The server probably closed the kept alive connection in the meantime, retry once with a new one
+            # print("Kept alive connection is stale, reconnecting")
+            connection.close()
+            fresh = True
+            resp = await asyncio.wait_for_ms(_exchange(connection, method, path, json, headers), timeout)
+        if not resp.keep_alive:
+            connection.close()
+        return resp
+    except OSError:
+        connection.close()
+        if fresh:
+            credentials.invalidate_address()  # A new connection failed, the backend may have moved, resolve again on the next try
+        raise
+    except:
+        connection.close()  # The state of the connection is unknown (e.g. after a timeout)
+        raise
+    finally:
+        _release(connection)
+
+
+def close():
+    """
+    Close all persistent connections to the backend (if any). The next request will open a new one.
+    """
+
+    for connection in _pool:
+        connection.close()
+
+
+async def _acquire():
+    """
+    :return: An idle connection of the pool, preferably one that is still open. Waits if all connections are in use.
+    :rtype: _Connection
+    """
+
+    while True:
+        idle = None
+        for connection in _pool:
+            if not connection.busy and (idle is None or connection.is_open()):
+                idle = connection
+        if idle is not None:
+            idle.busy = True
+            return idle
+        _connection_released.clear()
+        await _connection_released.wait()
+
+
+def _release(connection):
+    connection.busy = False
+    _connection_released.set()
+
+
+async def _exchange(connection, method, path, json, headers):
+    if not connection.is_open():
+        connection.open()
+    connection.written = 0
+    connection.received = 0
+    _send(connection, method, path, json, headers)
+    await connection.flush()
+    return await _receive(connection)
+
+
+def _send(connection, method, path, json, headers):
+    """
+    Serializes the request line, headers and body into the connection's send buffer, which gets written to the socket in as few writes as possible by connection.flush().
+    Not a coroutine, so the body is encoded without a generator frame of its own on the heap.
+    """
+
+    connection.put(method)
+    connection.put(b" /")
+    connection.put(path)
+    connection.put(b" HTTP/1.1\r\n")
+    if not "Host" in headers:
+        connection.put(b"Host: ")
+        connection.put(constants.BACKEND_HOST)
+        connection.put(b"\r\n")
+    for k in headers:
+        connection.put(k)
+        connection.put(b": ")
+        connection.put(headers[k])
+        connection.put(b"\r\n")
+    if json is not None:
+        body = ujson.dumps(json)
+        connection.put(b"Content-Type: application/json\r\nContent-Length: ")
+        connection.put(str(len(body)))
+        connection.put(b"\r\n\r\n")
+        connection.put(body)
+    else:
+        connection.put(b"\r\n")
+
+
+async def _receive(connection):
+    """
+    Reads a complete HTTP/1.1 response (status line, headers and body) from the connection, so it may be reused afterwards.
+    Status line and headers are parsed in place in the connection's receive buffer.
+    The body is delimited by the Content-Length header, chunked transfer encoding or (as a fallback) by the server closing the connection.
+
+    :return: The response with its body already read
+    :rtype: Response
+    :raises OSError: if the connection is closed before the response is complete
+    :raises ValueError: if the status line or a chunk size can not be parsed
+    """
+
+    buffer = connection.receive_buffer
+    start, end = await connection.readline()
+    if end - start < 12 or buffer[start + 8] != 32:  # 'HTTP/1.x 200'
+        raise ValueError("Invalid status line")
+    resp = Response()
+    resp.status_code = _parse_int(buffer, start + 9, start + 12)
+    if end - start > 13:
+        resp.reason = bytes(connection.receive_view[start + 13:end])
+    resp.keep_alive = buffer[start + 7] != 48  # HTTP/1.0 closes the connection by default
+    content_length = None
+    chunked = False
+    while True:
+        start, end = await connection.readline()
+        if start == end:  # Empty line after the headers
+            break
+        colon = _find(buffer, 58, start, end)  # ':'
+        if colon < 0:
+            continue
+        value = _skip_spaces(buffer, colon + 1, end)
+        if _equals(buffer, start, colon, b"authorization"):
+            # print("New token in response")
+            token = _find(buffer, 32, value, end)  # The token follows the authentication scheme, e.g. 'Bearer <token>'
+            if token >= 0:
+                resp.session_token = bytes(connection.receive_view[_skip_spaces(buffer, token, end):end])
+        elif _equals(buffer, start, colon, b"content-length"):
+            content_length = _parse_int(buffer, value, end)
+        elif _equals(buffer, start, colon, b"transfer-encoding"):
+            chunked = _equals(buffer, value, end, b"chunked")
+        elif _equals(buffer, start, colon, b"connection"):
+            resp.keep_alive = not _equals(buffer, value, end, b"close")
+        elif _equals(buffer, start, colon, b"etag"):
+            resp.etag = bytes(connection.receive_view[value:end])
+
+    if resp.status_code == 304 or resp.status_code == 204:  # Never have a body
+        body = b""
+    elif chunked:
+        body = bytearray()
         while True:
-            line = sckt.readline()
-            # print(line)
-            if not line or line == b"\r\n":
+            start, end = await connection.readline()
+            chunk_size = _parse_int(buffer, start, end, 16)
+            if chunk_size == 0:
+                while True:  # Skip trailers until the empty line
+                    start, end = await connection.readline()
+                    if start == end:
+                        break
                 break
+            body.extend(await connection.read(chunk_size))
+            await connection.readline()  # CRLF after each chunk
+        body = bytes(body)
+    elif content_length is not None:
+        body = await connection.read(content_length)
+    else:  # Body is delimited by the server closing the connection
+        body = await connection.read()
+        resp.keep_alive = False
+    resp.set_content(body)
+    return resp
+
+
+def _find(buffer, byte, start, end):
+    for index in range(start, end):
+        if buffer[index] == byte:
+            return index
+    return -1
+
+
+def _skip_spaces(buffer, start, end):
+    while start < end and buffer[start] == 32:
+        start += 1
+    return start
+
+
+def _equals(buffer, start, end, name):
+    """
+    :return: True if buffer[start:end] equals name (which must be lower case), ignoring the case of the buffer's letters and without allocating a slice
+    :rtype: bool
+    """
+
+    if end - start != len(name):
+        return False
+    for index in range(len(name)):
+        if buffer[start + index] | 0x20 != name[index] | 0x20:
+            return False
+    return True
+
+
+def _parse_int(buffer, start, end, base=10):
+    """
+    :return: The (decimal or hexadecimal) unsigned integer at the beginning of buffer[start:end], parsing stops at the first invalid character
+    :rtype: int
+    :raises ValueError: if there is no digit
+    """
+
+    value = 0
+    index = start
+    while index < end:
+        digit = buffer[index] | 0x20  # Lower case for hexadecimal letters
+        if 48 <= digit <= 57:  # '0' to '9'
+            digit -= 48
+        elif base == 16 and 97 <= digit <= 102:  # 'a' to 'f'
+            digit -= 87
+        else:
+            break
+        value = value * base + digit
+        index += 1
+    if index == start:
+        raise ValueError("Invalid integer")
+    return value
+
+
+class _Connection:
+    """
+    Persistent (keep-alive) ssl-wrapped connection to the backend using a non-blocking socket and an uasyncio stream.
+    Requests get serialized into a reusable send buffer and responses read into a reusable receive buffer, so there is no allocation per header line.
+    The buffers are only allocated when the connection is opened for the first time, so connections of the pool that are never used take no heap.
+    """
+
+    def __init__(self, send_size=constants.HTTP_SEND_BUFFER_SIZE, receive_size=constants.HTTP_RECEIVE_BUFFER_SIZE):
+        """
+        :param int send_size: Size of the send buffer, a request that does not fit is written in several parts, default is constants.HTTP_SEND_BUFFER_SIZE
+        :param int receive_size: Size of the receive buffer, which must fit the longest line of the status line and headers of a response, default is constants.HTTP_RECEIVE_BUFFER_SIZE
+        """
+
+        self.busy = False
+        self.sckt = None
+        self.stream = None
+        self.send_size = send_size
+        self.send_buffer = None
+        self.send_view = None
+        self.send_length = 0
+        self.send_queued = 0  # Bytes of the current request handed to the stream, but not yet written to the socket
+        self.receive_size = receive_size
+        self.receive_buffer = None
+        self.receive_view = None
+        self.receive_start = 0
+        self.receive_end = 0
+        self.written = 0   # Bytes of the current request written to the socket
+        self.received = 0  # Bytes of the current response read from the socket
+
+    def is_open(self):
+        return self.stream is not None
+
+    def open(self):
+        """
+        Starts connecting to the backend without blocking, the connection and the TLS handshake get completed by the first write.
+
+        :raises OSError: if the backend can not be resolved
+        """
+
+        ai = credentials.address()
+        sckt = socket.socket(ai[0], ai[1], ai[2])
+        sckt.setblocking(False)
+        try:
+            sckt.connect(ai[-1])
+        except OSError as e:
+            if e.errno != errno.EINPROGRESS:
+                sckt.close()
+                raise
+        try:
+            sckt = credentials.wrap_socket(sckt, do_handshake=False)
+        except OSError:
+            sckt.close()
+            raise
+        if self.send_buffer is None:
+            self.send_buffer = bytearray(self.send_size)
+            self.send_view = memoryview(self.send_buffer)
+            self.receive_buffer = bytearray(self.receive_size)
+            self.receive_view = memoryview(self.receive_buffer)
+        self.sckt = sckt
+        self.stream = asyncio.StreamReader(sckt)
+        self.send_length = 0
+        self.send_queued = 0
+        self.receive_start = 0
+        self.receive_end = 0
+
+    def close(self):
+        if self.stream is not None:
+            try:
+                self.sckt.close()
+            except OSError:
+                pass
+            self.sckt = None
+            self.stream = None
+
+    # Sending
+    def put(self, data):
+        """
+        Copy data (str or bytes) into the send buffer. A full buffer is handed to the stream, which writes it to the socket on flush().
+        """
+
+        position = 0
+        length = len(data)
+        while position < length:
+            count = min(length - position, len(self.send_buffer) - self.send_length)
+            if count < length:  # Only slice (and thus allocate) if data does not fit at once
+                self.send_view[self.send_length:self.send_length + count] = data[position:position + count]
             else:
-                header = line.split(None, 2)
-                if len(header) == 3 and header[0] == b"Authorization:":
-                    # print("New token in response")
-                    session_token = header[2].rstrip()
+                self.send_view[self.send_length:self.send_length + count] = data
+            self.send_length += count
+            position += count
+            if self.send_length == len(self.send_buffer):
+                self.stream.write(self.send_view)  # Copied by the stream
+                self.send_queued += self.send_length
+                self.send_length = 0
+
+    async def flush(self):
+        self.stream.write(self.send_view[:self.send_length])
+        await self.stream.drain()
+        self.written += self.send_queued + self.send_length
+        self.send_queued = 0
+        self.send_length = 0
+
+    # Receiving
+    async def readline(self):
+        """
+        Find the next line in the receive buffer (reading from the socket as needed).
+        The line stays valid in self.receive_buffer until the next call of any reading method.
 
-    except OSError:
-        sckt.close()
-        raise
+        :return: Start and end index of the line in self.receive_buffer, without the trailing CRLF
+        :rtype: (int, int)
+        :raises OSError: if the connection gets closed
+        :raises ValueError: if the line does not fit into the receive buffer
+        """
 
-    resp = Response(sckt)
-    resp.status_code = status_code
-    resp.reason = reason
-    resp.session_token = session_token
-    return resp
+        position = self.receive_start
+        while True:
+            position = _find(self.receive_buffer, 10, position, self.receive_end)  # '\n'
+            if position >= 0:
+                break
+            position = self.receive_end - self.receive_start  # Already searched, relative to the start after _fill()
+            await self._fill()
+        start = self.receive_start
+        self.receive_start = position + 1
+        if position > start and self.receive_buffer[position - 1] == 13:  # '\r'
+            position -= 1
+        return start, position
+
+    async def read(self, length=None):
+        """
+        :param int length: Number of bytes to read or None to read until the server closes the connection
+        :return: The next length bytes of the response
+        :rtype: bytes
+        :raises OSError: if the connection gets closed before length bytes were read
+        """
+
+        if length is None:
+            data = bytearray(self.receive_view[self.receive_start:self.receive_end])
+            while True:
+                try:
+                    count = await self._read_into(self.receive_view)
+                except OSError:
+                    break
+                data.extend(self.receive_view[:count])
+            self.receive_start = self.receive_end = 0
+            return bytes(data)
+        buffered = min(length, self.receive_end - self.receive_start)
+        if buffered == length:  # The common case: the whole body has already been received
+            data = bytes(self.receive_view[self.receive_start:self.receive_start + length])
+            self.receive_start += length
+            return data
+        data = bytearray(length)
+        view = memoryview(data)
+        view[:buffered] = self.receive_view[self.receive_start:self.receive_start + buffered]
+        self.receive_start = self.receive_end = 0
+        position = buffered
+        while position < length:
+            position += await self._read_into(view[position:])
+        return bytes(data)
+
+    async def _fill(self):
+        if self.receive_start > 0:  # Move unread data to the front of the buffer
+            self.receive_end -= self.receive_start
+            self.receive_view[:self.receive_end] = self.receive_view[self.receive_start:self.receive_start + self.receive_end]
+            self.receive_start = 0
+        if self.receive_end == len(self.receive_buffer):
+            raise ValueError("Line does not fit into the receive buffer")
+        self.receive_end += await self._read_into(self.receive_view[self.receive_end:])
+
+    async def _read_into(self, view):
+        while True:
+            count = await self.stream.readinto(view)
+            if count is None:  # Only part of a TLS record available yet
+                continue
+            elif count == 0:
+                raise OSError("Connection closed by server")
+            else:
+                self.received += count
+                return count
+
+
+_pool = [_Connection() for _ in range(constants.HTTP_POOL_SIZE)]
+_connection_released = asyncio.Event()
 
 
 class Response:
-    def __init__(self, sckt):
-        self.sckt = sckt
+    def __init__(self):
+        self.status_code = None
+        self.reason = b""
         self.encoding = "utf-8"
         self.session_token = ""
+        self.keep_alive = True
+        self.etag = None
         self._cached = None
 
+    def set_content(self, content):
+        """
+        Store the body of the HTTP response. As the connection is kept alive, the body is always read completely by request().
+        """
+
+        self._cached = content
+
     @property
     def content(self):
         """
-        Access the body of the HTTP response, will close the socket after all data has been read.
+        Access the body of the HTTP response.
         Do not use this funktion directly, use text() or json() instead.
         """
 
-        if self._cached is None:
-            try:
-                self._cached = self.sckt.read()
-                # print(self._cached)
-            finally:
-                self.sckt.close()
-                self.sckt = None
         return self._cached
 
     def text(self):
@@ -2,12 +2,17 @@
 # Hub utilities and setup routines
 # Author: Simon Aschenbrenner
 
+from adr import AdaptiveDataRate
+from controller import IrrigationController
 from http import BackendError
+from journal import Journal
 from machine import Pin, SoftI2C
 from network import WLAN, STA_IF
 from ntptime import settime
 from nvs import NVS
 from radio import LoRa
+from registry import SensorRegistry
+from schedule import SlotTable
 import backend
 import constants
 import reset
@@ -22,6 +27,11 @@ class LoRaAddressUnavailableError(Exception):
     pass
 
 
+_posted_message = None
+_shown_message = None
+_display_hold_deadline = 0
+
+
 # UTILITIES
 
 def has_user() -> bool:
@@ -31,7 +41,23 @@ def has_user() -> bool:
     :raises BackendError: if any HTTP request fails
     """
 
-    hub = backend.get_hub()
+    return has_user_in(backend.get_hub())
+
+
+async def has_user_async() -> bool:
+    # Async counterpart of has_user()
+
+    return has_user_in(await backend.get_hub_async())
+
+
+def has_user_in(hub):
+    """
+    :param dict hub: This hub as persisted on the backend
+    :return: True if the backend has paired a user to this hub, False if not.
+    :rtype: bool
+    :raises BackendError: if the dictionary does not contain the key 'user'
+    """
+
     try:
         user = hub["user"]
     except KeyError as e:
@@ -75,6 +101,40 @@ def display_message(message=None):
         display.show()
 
 
+def post_message(message=None):
+    """
+    Post a message (see display_message()) that the display task of the main loop will show, as soon as no other message is held on the display.
+    The display only gets redrawn if the posted message differs from the one shown.
+    """
+
+    global _posted_message
+
+    _posted_message = message
+
+
+def hold_display(duration=constants.DISPLAY_HOLD_TIME):
+    """
+    Keep the message currently shown (e.g. the result of a pairing) on the display for duration milliseconds before posted messages get shown again.
+    """
+
+    global _display_hold_deadline, _shown_message
+
+    _display_hold_deadline = time.ticks_add(time.ticks_ms(), duration)
+    _shown_message = None  # The posted message needs to be redrawn afterwards
+
+
+def update_display():
+    """
+    Show the last posted message if it changed and the display is not held. Called periodically by the display task of the main loop.
+    """
+
+    global _shown_message
+
+    if _posted_message != _shown_message and time.ticks_diff(time.ticks_ms(), _display_hold_deadline) >= 0:
+        display_message(_posted_message)
+        _shown_message = _posted_message
+
+
 # SETUP ROUTINES
 
 def setup():
@@ -83,7 +143,7 @@ def setup():
     Exception safe, will automatically reboot or reset.ask() if any of the steps fail.
     """
 
-    global button, configuration, display, display_block, empty, led, lora, outlets, outlets_mask, pump
+    global adr, button, configuration, controller, display, display_block, empty, journal, led, lora, outlets, outlets_mask, pump, registry, schedule
 
     print("BEGIN SETUP")
 
@@ -108,6 +168,21 @@ def setup():
         # NVS setup
         configuration = NVS()
 
+        # Paired sensor registry setup
+        registry = SensorRegistry(configuration)
+
+        # Uplink schedule setup
+        schedule = SlotTable()
+
+        # Adaptive data rate setup
+        adr = AdaptiveDataRate(lora, registry)
+
+        # Measurement journal setup
+        journal = Journal()
+
+        # Irrigation controller setup
+        controller = IrrigationController(len(outlets))
+
         print("Hardware setup finished")
 
     except Exception as e:
@@ -197,8 +272,9 @@ def _wlan_connect():
     """
 
     # Debug wlan config TODO delete
-    configuration.write_str(constants.NVS_KEY_WLAN_ESSID, "ssid")
-    configuration.write_str(constants.NVS_KEY_WLAN_PASSWORD, "password")
+    with configuration.transaction():
+        configuration.write_str(constants.NVS_KEY_WLAN_ESSID, "ssid")
+        configuration.write_str(constants.NVS_KEY_WLAN_PASSWORD, "password")
 
     print("WLAN SETUP")
     wlan_essid = configuration.read_str(constants.NVS_KEY_WLAN_ESSID)
@@ -303,17 +379,15 @@ def _user_key_loop(user_key):
 
 def _lora_setup():
     """
-    # TODO rewrite docstring
-    Sets up the hub with a persisted and/or free LoRa address
+    Sets up the hub with a persisted and/or free LoRa address.
+    Without a persisted Hub ID, the hub discovers a free one, see _discover_address().
 
     :raises LoRaAddressUnavailableError: if no address is available on the channel or the persisted address is unavailable
     """
 
     print("LORA SETUP")
     hub_id = configuration.read_int(constants.NVS_KEY_LORA_HUB_ID)
-    address_increment = 0b10000
     first_address = 0b1111
-    lora_address = None
     
     if hub_id is not None:
         configured_address = (hub_id << 4) + first_address
@@ -325,20 +399,57 @@ def _lora_setup():
             raise LoRaAddressUnavailableError("Configured Hub ID in NVS #{} is unavailable".format(hub_id))
     
     else:
-        potential_address = first_address
-        while potential_address < constants.LORA_BROADCAST_ADDRESS:
-            hub_id = potential_address >> 4
-            print("Trying Hub ID #{}".format(hub_id))
-            if not lora.send_reliably(constants.LORA_PREAMBLE, potential_address, constants.LORA_FLAG_ADDRESS_AVL):
-                print("Hub ID is available")
-                configuration.write_int(constants.NVS_KEY_LORA_HUB_ID, hub_id)
-                lora_address = potential_address
-                break
-            else:
-                potential_address += address_increment
-        if lora_address is None:
-            raise LoRaAddressUnavailableError("No Hub ID/address is available on the channel")
+        lora_address = _discover_address()
 
     lora.address = lora_address
     print("LoRa address successfully set to {:08b}\nNow continuously listening for packets".format(lora.address))
     lora.receive_continuously()
+
+
+def _discover_address():
+    """
+    Finds a free Hub ID within constants.LORA_DISCOVERY_TIMEOUT and stores it in NVS.
+    The Hub IDs are probed in turn, each up to constants.LORA_DISCOVERY_PROBES times with a short wait for the acknowledgement (constants.LORA_DISCOVERY_ACK_TIMEOUT),
+    while the radio overhears the channel (without acknowledging anything): Hub IDs overheard are not probed, and a Hub ID is not taken if it was overheard while it was probed.
+    Unicast packets are exchanged between a hub and its sensors, so the high nibble of both their addresses is the Hub ID.
+
+    :return: The LoRa address of the Hub ID
+    :rtype: int
+    :raises LoRaAddressUnavailableError: if no Hub ID is available on the channel or none was found in time
+    """
+
+    occupied_hub_ids = set()
+
+    def handle_packet(payload):
+        if payload.header_to != constants.LORA_BROADCAST_ADDRESS:
+            occupied_hub_ids.add(payload.header_to >> 4)
+            occupied_hub_ids.add(payload.header_from >> 4)
+
+    send_retries, receive_timeout = lora.send_retries, lora.receive_timeout
+    lora.receive_timeout = constants.LORA_DISCOVERY_ACK_TIMEOUT  # A hub in use acknowledges right away
+    lora.receive_continuously(receive_all=True, acknowledge=False)
+    deadline = time.ticks_add(time.ticks_ms(), constants.LORA_DISCOVERY_TIMEOUT)
+    try:
+        for hub_id in range(constants.LORA_BROADCAST_ADDRESS >> 4):
+            lora.drain(handle_packet)
+            if hub_id in occupied_hub_ids:  # No need to probe
+                continue
+            if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                raise LoRaAddressUnavailableError("No Hub ID/address found within {} ms".format(constants.LORA_DISCOVERY_TIMEOUT))
+            print("Trying Hub ID #{}".format(hub_id))
+            address = (hub_id << 4) | 0b1111
+            if lora.send_reliably(constants.LORA_PREAMBLE, address, constants.LORA_FLAG_ADDRESS_AVL, retries=constants.LORA_DISCOVERY_PROBES):
+                continue
+            lora.drain(handle_packet)
+            if hub_id in occupied_hub_ids:  # Overheard, its acknowledgements got lost
+                continue
+            print("Hub ID is available")
+            configuration.write_int(constants.NVS_KEY_LORA_HUB_ID, hub_id)
+            return address
+    finally:
+        print("Hub IDs in use on the channel:", sorted(occupied_hub_ids))
+        lora.idle()
+        lora.receive_all = False
+        lora.acknowledge = True
+        lora.send_retries, lora.receive_timeout = send_retries, receive_timeout
+    raise LoRaAddressUnavailableError("No Hub ID/address is available on the channel")
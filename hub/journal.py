@@ -0,0 +1,199 @@
+# BLOOM Hub
+# Measurement journal
+# Author: Simon Aschenbrenner
+
+from binascii import crc32
+import constants
+import struct
+
+_MAGIC = b"BLMJ"
+_VERSION = 2
+_HEADER_FORMAT = "<4sBHI"  # Magic, version, capacity, sequence number of the oldest record not yet flushed
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_RECORD_FORMAT = "<IBHHII"  # Sequence number, sensor ID, moisture and battery (fixed point), timestamp, CRC-32 of the fields before
+_FIXED_POINT_SCALE = 10000
+_RECORD_SIZE = struct.calcsize(_RECORD_FORMAT)
+_CHECKSUM_SIZE = 4
+
+
+class Journal(object):
+    """
+    Durable, bounded write-ahead queue for received measurements, stored as a ring of fixed size records in a file on flash.
+    Measurements are appended first and only removed after they have been flushed to the backend, so they survive a WLAN outage or a reboot.
+    If the journal is full, the oldest measurement gets dropped.
+
+    Appending is crash-safe: Every record carries its sequence number and a CRC-32, so an interrupted write only invalidates this one record.
+    The file header only stores the sequence number of the oldest record not yet flushed, all other state is recovered by scanning the records.
+    To spare the flash, the header is only rewritten every constants.JOURNAL_HEADER_INTERVAL acknowledgements (and by sync()),
+    so after an unclean reboot up to that many batches may be flushed to the backend a second time.
+    """
+
+    def __init__(self, path=constants.JOURNAL_FILE, capacity=constants.JOURNAL_CAPACITY):
+        """
+        :param str path: Path of the journal file, default is constants.JOURNAL_FILE
+        :param int capacity: Maximum number of records, default is constants.JOURNAL_CAPACITY (a journal with a different capacity will be recreated)
+        """
+
+        self.path = path
+        self.capacity = capacity
+        self.queued = 0   # Measurements appended since boot
+        self.flushed = 0  # Measurements flushed since boot
+        self.dropped = 0  # Measurements dropped since boot (journal full or record corrupted)
+        self._buffer = bytearray(_RECORD_SIZE)
+        self._checked = memoryview(self._buffer)[:_RECORD_SIZE - _CHECKSUM_SIZE]  # The fields covered by the checksum
+        self._corrupted = set()  # Sequence numbers of the corrupted records found by peek() behind the oldest one
+        self._unsaved = 0  # Acknowledgements not yet written to the header
+        self._first = 0  # Sequence number of the oldest record
+        self._next = 0   # Sequence number of the next record to append
+        self._file = None
+        try:
+            self._file = open(self.path, "r+b")
+            self._recover()
+        except (OSError, ValueError) as e:
+            print("Creating new journal:", e)
+            if self._file is not None:
+                self._file.close()
+            self._create()
+
+    def __len__(self):
+        return self._next - self._first
+
+    def append(self, sensor_id, moisture, battery, timestamp):
+        """
+        Persist a measurement at the end of the journal, dropping the oldest one if the journal is full.
+
+        :param int sensor_id: ID of the sensor that sent the measurement
+        :param float moisture: Moisture between 0.0 and 1.0
+        :param float battery: Battery level between 0.0 and 1.0
+        :param int timestamp: Time of reception in seconds
+        """
+
+        if len(self) >= self.capacity:
+            self._first += 1
+            self.dropped += 1
+        struct.pack_into(_RECORD_FORMAT, self._buffer, 0, self._next, sensor_id, round(moisture * _FIXED_POINT_SCALE), round(battery * _FIXED_POINT_SCALE), timestamp, 0)
+        struct.pack_into("<I", self._buffer, _RECORD_SIZE - _CHECKSUM_SIZE, crc32(self._checked))
+        self._file.seek(self._offset(self._next))
+        self._file.write(self._buffer)
+        self._file.flush()  # Durability is the point of the journal (a record per measurement, i.e. per sensor and schedule period)
+        self._next += 1
+        self.queued += 1
+
+    def peek(self, count=1):
+        """
+        :param int count: Maximum number of records to return, default is 1
+        :return: The oldest records not yet flushed as tuples of sequence number, sensor ID, moisture, battery and timestamp, oldest first
+        :rtype: list
+        """
+
+        records = []
+        sequence_number = self._first
+        while sequence_number < self._next and len(records) < count:
+            record = self._read(sequence_number)
+            if record is None:  # Corrupted by an interrupted write, skip it
+                if sequence_number == self._first:
+                    self._first += 1
+                    self.dropped += 1
+                    self._corrupted.discard(sequence_number)
+                else:  # Counted as dropped once acknowledged, see acknowledge()
+                    self._corrupted.add(sequence_number)
+            else:
+                records.append(record)
+            sequence_number += 1
+        return records
+
+    def acknowledge(self, sequence_number):
+        """
+        Mark all records up to and including sequence_number as flushed to the backend (the corrupted ones skipped by peek() as dropped).
+        Records that have already been dropped in the meantime are ignored.
+        """
+
+        if sequence_number < self._first:
+            return
+        sequence_number = min(sequence_number + 1, self._next)
+        skipped = 0
+        for corrupted in list(self._corrupted):
+            if corrupted < sequence_number:
+                self._corrupted.discard(corrupted)
+                if corrupted >= self._first:
+                    skipped += 1
+        self.flushed += sequence_number - self._first - skipped
+        self.dropped += skipped
+        self._first = sequence_number
+        self._unsaved += 1
+        if self._unsaved >= constants.JOURNAL_HEADER_INTERVAL:
+            self._write_header()
+
+    def sync(self):
+        """
+        Write the acknowledgements not yet written to the header (e.g. before a reboot).
+        """
+
+        if self._unsaved:
+            self._write_header()
+
+    def clear(self):
+        """
+        Drop all records (e.g. when all sensors get unpaired).
+        """
+
+        self.dropped += len(self)
+        self._first = self._next
+        self._corrupted.clear()
+        self._write_header()
+
+    def counters(self):
+        """
+        :return: Measurements queued, flushed and dropped since boot and the number of records currently pending
+        :rtype: dict
+        """
+
+        return { "queued": self.queued, "flushed": self.flushed, "dropped": self.dropped, "pending": len(self) }
+
+    def _offset(self, sequence_number):
+        return _HEADER_SIZE + (sequence_number % self.capacity) * _RECORD_SIZE
+
+    def _read(self, sequence_number):
+        self._file.seek(self._offset(sequence_number))
+        if self._file.readinto(self._buffer) != _RECORD_SIZE or not self._is_valid():
+            return None
+        record = struct.unpack_from(_RECORD_FORMAT, self._buffer)
+        if record[0] != sequence_number:  # Stale record of an earlier round of the ring
+            return None
+        return record[0], record[1], record[2] / _FIXED_POINT_SCALE, record[3] / _FIXED_POINT_SCALE, record[4]
+
+    def _recover(self):
+        magic, version, capacity, first = struct.unpack(_HEADER_FORMAT, self._file.read(_HEADER_SIZE))
+        if magic != _MAGIC or version != _VERSION or capacity != self.capacity:
+            raise ValueError("incompatible journal")
+        last = None
+        for index in range(self.capacity):
+            self._file.seek(_HEADER_SIZE + index * _RECORD_SIZE)
+            if self._file.readinto(self._buffer) == _RECORD_SIZE and self._is_valid():
+                sequence_number = struct.unpack_from("<I", self._buffer)[0]
+                if last is None or sequence_number > last:
+                    last = sequence_number
+        if last is None or last < first:
+            self._first = self._next = first
+        else:
+            self._next = last + 1
+            self._first = max(first, self._next - self.capacity)
+        print("Journal recovered with {} pending measurements".format(len(self)))
+
+    def _create(self):
+        self._file = open(self.path, "w+b")
+        self._first = self._next = 0
+        self._write_header()
+        empty = bytearray(_RECORD_SIZE)  # Invalid checksum (the CRC-32 of the zero fields is not zero)
+        for _ in range(self.capacity):
+            self._file.write(empty)
+        self._file.flush()
+
+    def _is_valid(self):
+        return struct.unpack_from("<I", self._buffer, _RECORD_SIZE - _CHECKSUM_SIZE)[0] == crc32(self._checked)
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(struct.pack(_HEADER_FORMAT, _MAGIC, _VERSION, self.capacity, self._first))
+        self._file.flush()
+        self._unsaved = 0
@@ -3,57 +3,187 @@
 # Author: Simon Aschenbrenner
 
 from http import BackendError
-from time import ticks_diff, ticks_ms
+from poller import PollScheduler
+import backend
 import constants
 import hub
 import reset
 import sensors
+import uasyncio as asyncio
 import watering
 
+_backend_wakeup = asyncio.Event()  # Set to make the backend task call the backend right away
+_poller = PollScheduler()  # Delay between the calls of the backend task
 
 
 def main_loop():
     """
     Hub will enter this loop after setup and stay in it for eternity if not powercycled or rebooted.
-    Exception safe, will automatically enter reset.ask() if more than constants.MAX_FAILED_REQUESTS requests to the backend fail.
+    The tasks below run cooperatively, each with its own timing, so e.g. a slow backend never stalls the LoRa reception.
+    Exception safe, will automatically enter reset.ask() if more than constants.MAX_FAILED_REQUESTS requests to the backend fail and reboot on any other exception.
     """
 
     print("ENTER MAIN LOOP")
     hub.led.on()
-    failed_request_counter = 0
-    last_backend_call = 0
+    loop = asyncio.get_event_loop()
+    loop.set_exception_handler(_handle_exception)
+    loop.create_task(_radio_task())
+    loop.create_task(_upload_task())
+    loop.create_task(_backend_task())
+    loop.create_task(_watering_task())
+    loop.create_task(_display_task())
+    loop.create_task(_button_task())
+    loop.create_task(_registry_task())
+    loop.create_task(_beacon_task())
+    loop.run_forever()
+
+
+async def _radio_task():
+    # Handles received LoRa messages (acknowledgements are already sent by the radio), idles until the radio received a packet
 
+    dropped = 0
     while True:
+        if not len(hub.lora.cache):
+            await hub.lora.packet_received.wait()
+        await sensors.collect_async()
+        if hub.lora.cache.dropped != dropped:  # Helps sizing constants.LORA_DATA_CACHE_SIZE
+            dropped = hub.lora.cache.dropped
+            print("LoRa packets dropped:", hub.lora.counters())
+        await asyncio.sleep_ms(constants.RADIO_TASK_DELAY)
+
+
+async def _upload_task():
+    # Flushes the journaled measurements and new pairings to the backend
+
+    while True:
+        try:
+            if await sensors.upload_async():
+                _backend_wakeup.set()  # Sensors got paired, fetch the activated sensors right away
+        except BackendError as e:
+            print(e)
+            print("Measurement journal:", hub.journal.counters())
+            await asyncio.sleep_ms(constants.BACKEND_POLL_MAX_DELAY)  # Journaled measurements will be retried
+        await asyncio.sleep_ms(constants.UPLOAD_TASK_DELAY)
+
 
+async def _backend_task():
+    # Synchronizes the hub, its zones and its sensors with the backend, as often as the poll scheduler decides or right away when woken up
+    # While idle, a backend that supports it holds the synchronization for the delay instead (long polling), so e.g. "water now" reaches the hub right away.
+    # A wakeup does not cut a held synchronization short: the backend answers as soon as the hub's state changes on its side (e.g. a sensor paired meanwhile was added)
+
+    failed_request_counter = 0
+    hold = 0  # Time in milliseconds the backend may hold the next synchronization
+    while True:
+        _backend_wakeup.clear()
         try:
-            sensors.collect()
-            time_since_last_backend_call = ticks_diff(ticks_ms(), last_backend_call)
-
-            if (time_since_last_backend_call > constants.BACKEND_CALL_DELAY) or (time_since_last_backend_call < 0):  # overflow protection
-                if hub.has_user():
-                    print("Hub has user")
-                    watering.water()
-                    sensors.check()
-                else:  # Remote reset happened
-                    print("Hub has no user, remote factory reset")
-                    reset.reset(wlan=True, lora=True)
-                last_backend_call = ticks_ms()
-                failed_request_counter = 0
+            has_user = await _sync_async(hold)
+            if has_user is None:  # Backend does not support the combined endpoint
+                has_user = await hub.has_user_async()
+                if has_user:
+                    await watering.water_async()
+                    await sensors.check_async()
+            if has_user:
+                print("Hub has user")
+                await watering.sync_controller_async()
+            else:  # Remote reset happened
+                print("Hub has no user, remote factory reset")
+                reset.reset(wlan=True, lora=True)
+            failed_request_counter = 0
+            _poller.update(watering.is_active())
+            # print("Backend polling:", _poller.counters())
+            hold = _poller.delay() if backend.sync_hold_supported() and not watering.is_active() else 0
 
         except BackendError as e:
-            watering.stop_water()
+            hold = 0
+            watering.stop_remote_water()  # The irrigation controller keeps watering
             print(e)
             failed_request_counter += 1
             print("Failed request #", failed_request_counter)
 
-        except Exception as e:
-            print(e)
-            reset.reset(wlan=False, lora=False)  # Reboot
-
         if failed_request_counter >= constants.MAX_FAILED_REQUESTS:
             print("Too many failed requests, asking for WLAN reset")
             reset.ask(constants.MESSAGE_ERROR_BACKEND, wlan=True, lora=False)
 
+        if hold:  # The delay passes on the backend
+            continue
+        try:
+            await asyncio.wait_for_ms(_backend_wakeup.wait(), _poller.delay())
+            _poller.wake()
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _sync_async(hold=0):
+    # Synchronizes the hub with a single request (see backend.sync_async()), returns whether the hub has a user or None if the backend does not support it
+
+    is_empty = await watering.check_bucket_async()
+    zone_states = watering.zone_changes()
+    state = await backend.sync_async(is_empty, zone_states, sensors.silent_sensor_ids(), hold)
+    if state is None:
+        return None
+    hub_document, pending_zone_ids, activated_sensor_ids = state
+    if not hub.has_user_in(hub_document):
+        return False
+    watering.synced(is_empty, zone_states, pending_zone_ids)
+    sensors.synced(activated_sensor_ids)
+    return True
+
+
+async def _watering_task():
+    # Watches the bucket while watering and the run-time of the zones watered by the irrigation controller
+
+    while True:
+        watering.check_bucket()
+        watering.check_controller()
+        await asyncio.sleep_ms(constants.WATERING_TASK_DELAY)
+
+
+async def _display_task():
+    # Shows the messages posted by the other tasks
+
+    while True:
+        hub.update_display()
+        await asyncio.sleep_ms(constants.DISPLAY_TASK_DELAY)
+
+
+async def _button_task():
+    # A (debounced) press of the PRG button makes the hub call the backend right away
+
+    button_active_time = 0
+    while True:
+        if hub.button_is_pressed():
+            if button_active_time < constants.BUTTON_DEBOUNCE_TIME <= button_active_time + constants.BUTTON_TASK_DELAY:
+                print("Button pressed")
+                _backend_wakeup.set()
+            button_active_time += constants.BUTTON_TASK_DELAY
+        else:
+            button_active_time = 0
+        await asyncio.sleep_ms(constants.BUTTON_TASK_DELAY)
+
+
+async def _registry_task():
+    # Persists the last-seen timestamps of the sensors every constants.REGISTRY_FLUSH_INTERVAL
+
+    while True:
+        await asyncio.sleep_ms(constants.REGISTRY_FLUSH_INTERVAL)
+        hub.registry.flush()
+        print("Sensor registry:", hub.registry.counters())
+
+
+async def _beacon_task():
+    # Broadcasts the uplink schedule of the sensors every constants.LORA_BEACON_INTERVAL (and switches their data rate if due)
+
+    while True:
+        await asyncio.sleep_ms(constants.LORA_BEACON_INTERVAL)
+        await sensors.send_beacon_async()
+        print("Uplink schedule:", hub.schedule.counters())
+        print("Adaptive data rate:", hub.adr.counters())
+
+
+def _handle_exception(loop, context):
+    print(context["exception"])
+    reset.reset(wlan=False, lora=False)  # Reboot
+
 
 if __name__ == "__main__":
     hub.setup()
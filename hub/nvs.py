@@ -4,50 +4,198 @@
 
 import constants
 import esp32
+import struct
+
+_KEY = "config"  # NVS key of the packed configuration record
+_MAGIC = b"BLMC"
+_VERSION = 1
+_INT_KEYS = (
+    constants.NVS_KEY_LORA_HUB_ID,
+    constants.NVS_KEY_REBOOT_COUNTER,
+    constants.NVS_KEY_LAST_REBOOT_TIMESTAMP
+    ) + tuple(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id) for sensor_id in range(constants.LORA_MAX_PAIRED_SENSORS))
+_STR_KEYS = (
+    constants.NVS_KEY_WLAN_ESSID,
+    constants.NVS_KEY_WLAN_PASSWORD
+    )
+# Magic, version, bitmap of the values present (integers first, strings last), integers, strings
+_FORMAT = "<4sBI" + "i" * len(_INT_KEYS) + "{}s".format(constants.NVS_MAX_BUFFER_SIZE) * len(_STR_KEYS)
+_SIZE = struct.calcsize(_FORMAT)
 
 
 class NVS(object):
+    """
+    Configuration of the hub, stored in the NVS as one packed and versioned record
+    (WLAN credentials, hub ID, paired sensors and reboot counters, see _INT_KEYS and _STR_KEYS).
+    The record is read once and kept in RAM, every change writes and commits it as a whole,
+    so changes made within a transaction() are written with a single commit.
+    Values stored by earlier firmware under their own keys are migrated on first use.
+    """
 
     def __init__(self):
         self.nvs_instance = esp32.NVS(constants.NVS_NAMESPACE)
+        self.commits = 0  # Commits since boot
+        self._buffer = bytearray(_SIZE)
+        self._values = {}
+        self._transaction_depth = 0
+        self._changed = False
+        self._participants = []  # Objects that keep state derived from the configuration in RAM, see register()
+        if not self._load():
+            self._migrate()
 
 
     def read_int(self, key):
-        try:
-            value = self.nvs_instance.get_i32(str(key))
-        except OSError as e:
-            # print(e)
-            return None
-        else:
-            return value
+        return self._values.get(str(key))
 
 
     def read_str(self, key):
-        buffer = bytearray(constants.NVS_MAX_BUFFER_SIZE)
-        try:
-            self.nvs_instance.get_blob(str(key), buffer)
-        except OSError as e:
-            # print(e)
-            return None
-        else:
-            return buffer.decode()
+        return self._values.get(str(key))
 
 
     def write_int(self, key, value):
-        self.nvs_instance.set_i32(str(key), value)
-        self.nvs_instance.commit()
+        self._set(str(key), int(value), _INT_KEYS)
 
 
     def write_str(self, key, value):
-        self.nvs_instance.set_blob(str(key), str(value))
-        self.nvs_instance.commit()
+        value = str(value)
+        if len(value.encode()) > constants.NVS_MAX_BUFFER_SIZE:
+            raise ValueError("value of {} exceeds {} bytes".format(key, constants.NVS_MAX_BUFFER_SIZE))
+        self._set(str(key), value, _STR_KEYS)
 
 
     def delete(self, key):
+        key = str(key)
+        if key not in self._values:
+            return False
+        del self._values[key]
+        self._changed = True
+        self._commit()
+        return True
+
+
+    def transaction(self):
+        """
+        Group several changes into a single commit:
+
+            with configuration.transaction():
+                configuration.write_int(...)
+                configuration.delete(...)
+
+        If the block raises an exception, its changes are discarded (and the participants restored, see register()). Transactions may be nested, the outermost one commits.
+        Don't await inside a transaction, changes of other tasks would be committed (or discarded) with it.
+
+        :return: Context manager
+        """
+
+        return _Transaction(self)
+
+
+    def register(self, participant):
+        """
+        Let participant take part in the transactions: Its state is saved by participant.snapshot() when the outermost transaction starts
+        and given back to participant.restore() if the transaction is rolled back, so its RAM state matches the configuration again.
+
+        :param participant: Object with the methods snapshot() and restore(snapshot), e.g. a SensorRegistry
+        """
+
+        self._participants.append(participant)
+
+
+    def _set(self, key, value, keys):
+        if key not in keys:
+            raise KeyError(key)
+        if self._values.get(key) != value:
+            self._values[key] = value
+            self._changed = True
+            self._commit()
+
+
+    def _commit(self):
+        if self._transaction_depth > 0 or not self._changed:
+            return
+        present = 0
+        values = []
+        for index, key in enumerate(_INT_KEYS):
+            value = self._values.get(key)
+            if value is not None:
+                present |= 1 << index
+            values.append(value or 0)
+        for index, key in enumerate(_STR_KEYS):
+            value = self._values.get(key)
+            if value is not None:
+                present |= 1 << (len(_INT_KEYS) + index)
+            values.append(value.encode() if value is not None else b"")
+        struct.pack_into(_FORMAT, self._buffer, 0, _MAGIC, _VERSION, present, *values)
+        self.nvs_instance.set_blob(_KEY, self._buffer)
+        self.nvs_instance.commit()
+        self._changed = False
+        self.commits += 1
+
+
+    def _load(self):
         try:
-            self.nvs_instance.erase_key(str(key))
-            self.nvs_instance.commit()
-            return True
+            length = self.nvs_instance.get_blob(_KEY, self._buffer)
         except OSError as e:
             # print(e)
             return False
+        record = struct.unpack_from(_FORMAT, self._buffer) if length == _SIZE else None
+        if record is None or record[0] != _MAGIC or record[1] != _VERSION:
+            print("Incompatible configuration record, migrating")
+            return False
+        present = record[2]
+        for index, key in enumerate(_INT_KEYS + _STR_KEYS):
+            if present & (1 << index):
+                value = record[3 + index]
+                if key in _STR_KEYS:
+                    value = value.rstrip(b"\x00").decode()
+                self._values[key] = value
+        return True
+
+
+    def _migrate(self):
+        # Moves the values of the former one-key-per-value layout into the record
+
+        buffer = bytearray(constants.NVS_MAX_BUFFER_SIZE)
+        for key in _INT_KEYS + _STR_KEYS:
+            try:
+                if key in _STR_KEYS:
+                    length = self.nvs_instance.get_blob(key, buffer)
+                    self._values[key] = bytes(buffer[:length]).decode()
+                else:
+                    self._values[key] = self.nvs_instance.get_i32(key)
+                self.nvs_instance.erase_key(key)
+            except OSError as e:
+                # print(e)
+                pass
+        self._changed = True
+        self._commit()
+        print("Configuration migrated with {} values".format(len(self._values)))
+
+
+class _Transaction(object):
+
+    def __init__(self, nvs):
+        self._nvs = nvs
+        self._snapshot = None
+        self._participant_snapshots = None
+
+
+    def __enter__(self):
+        if self._nvs._transaction_depth == 0:
+            self._snapshot = dict(self._nvs._values)
+            self._participant_snapshots = [participant.snapshot() for participant in self._nvs._participants]
+        self._nvs._transaction_depth += 1
+        return self._nvs
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._nvs._transaction_depth -= 1
+        if self._nvs._transaction_depth == 0:
+            if exc_type is not None:
+                self._nvs._values = self._snapshot
+                self._nvs._changed = False
+                for participant, snapshot in zip(self._nvs._participants, self._participant_snapshots):
+                    participant.restore(snapshot)
+            else:
+                self._nvs._commit()
+        return False
@@ -0,0 +1,67 @@
+# BLOOM Hub
+# Adaptive backend polling
+# Author: Simon Aschenbrenner
+
+from random import getrandbits
+import constants
+
+
+class PollScheduler(object):
+    """
+    Adapts the delay between two calls of the backend task to the activity of the hub, instead of polling at a fixed rate around the clock.
+
+    While zones are pending or their outlets changed, the backend is called every min_delay. Once idle, the delay doubles with every call up to max_delay.
+    A wakeup (e.g. by the PRG button or a new pairing) makes the backend task call right away and polls fast again.
+    Every delay is spread randomly between 3/4 and 5/4 of the current interval (within min_delay and max_delay), so a fleet of hubs does not call in lockstep.
+    While idle, the backend task lets a backend that supports it hold the synchronization for the delay instead of waiting (long polling, see main._backend_task()).
+    """
+
+    def __init__(self, min_delay=constants.BACKEND_POLL_MIN_DELAY, max_delay=constants.BACKEND_POLL_MAX_DELAY):
+        """
+        :param int min_delay: Floor of the delay in milliseconds, default is constants.BACKEND_POLL_MIN_DELAY
+        :param int max_delay: Ceiling of the delay in milliseconds, default is constants.BACKEND_POLL_MAX_DELAY
+        """
+
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.interval = min_delay  # Current interval in milliseconds, before jitter
+        self.polls = 0    # Backend calls since boot
+        self.wakeups = 0  # Backend calls made early by a wakeup since boot
+
+    def update(self, is_active):
+        """
+        Call after every successful backend call. A failed call leaves the interval as it is.
+
+        :param bool is_active: True if zones are pending or their outlets changed (see watering.is_active())
+        """
+
+        self.polls += 1
+        if is_active:
+            self.interval = self.min_delay
+        else:
+            self.interval = min(self.interval * 2, self.max_delay)
+
+    def wake(self):
+        """
+        Call if the backend task got woken up before the delay ran out.
+        """
+
+        self.wakeups += 1
+        self.interval = self.min_delay
+
+    def delay(self):
+        """
+        :return: The delay until the next backend call in milliseconds
+        :rtype: int
+        """
+
+        delay = self.interval - (self.interval >> 2) + (((self.interval >> 1) * getrandbits(16)) >> 16)
+        return max(self.min_delay, min(delay, self.max_delay))
+
+    def counters(self):
+        """
+        :return: Current interval in milliseconds, backend calls and wakeups since boot
+        :rtype: dict
+        """
+
+        return { "interval": self.interval, "polls": self.polls, "wakeups": self.wakeups }
@@ -7,12 +7,14 @@
 # (12.12.21, GNU GPL v3)
 
 import constants
-from machine import Pin, SPI
+from machine import idle, Pin, SPI
 from math import ceil
-from collections import namedtuple, deque
 from micropython import schedule
 from random import getrandbits
-from time import time, sleep
+from array import array
+import struct
+from time import sleep, sleep_ms, ticks_add, ticks_diff, ticks_ms
+import uasyncio as asyncio
 
 
 # Constants
@@ -63,6 +65,17 @@ REG_09_PA_CONFIG = 0x09
 FXOSC = 32000000.0
 FSTEP = (FXOSC / 524288)
 
+# Register values written at once by the mode switches, see LoRa._spi_write_registers()
+MODE_TX_REGISTERS = bytes((REG_01_OP_MODE, MODE_TX, REG_40_DIO_MAPPING1, 0x40))  # Interrupt on TxDone
+MODE_RX_REGISTERS = bytes((REG_01_OP_MODE, MODE_RXCONTINUOUS, REG_40_DIO_MAPPING1, 0x00))  # Interrupt on RxDone
+MODE_CAD_REGISTERS = bytes((REG_01_OP_MODE, MODE_CAD, REG_40_DIO_MAPPING1, 0x80))  # Interrupt on CadDone
+
+CAD_TIMEOUT = 100  # ms
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)  # Hz, indexed by the upper nibble of REG_1D_MODEM_CONFIG1
+
+HEADER_LENGTH = 4
+MAX_PACKET_LENGTH = 255
+
 
 class ModemConfig():
 
@@ -73,6 +86,221 @@ class ModemConfig():
     Bw125Cr45Sf2048 = (0x72, 0xb4, 0x04)  # Bw = 125 kHz, Cr = 4/5, Sf = 11 (2048 chips/symbol), CRC on. Slow + long range
 
 
+def airtime(modem_config, length, preamble_length=8):
+    """
+    :param ModemConfig modem_config: see ModemConfig
+    :param int length: Length of the packet including the header in bytes
+    :param int preamble_length: default is 8
+    :return: Time on air of a packet in microseconds (see SX1276 datasheet, 4.1.1.7)
+    :rtype: int
+    """
+
+    coding_rate = (modem_config[0] >> 1) & 0x07
+    implicit_header = modem_config[0] & 0x01
+    spreading_factor = modem_config[1] >> 4
+    crc = (modem_config[1] >> 2) & 0x01
+    low_data_rate_optimize = (modem_config[2] >> 3) & 0x01
+    symbol_time = (1000000 << spreading_factor) // BANDWIDTHS[modem_config[0] >> 4]
+    bits = 8 * length - 4 * spreading_factor + 28 + 16 * crc - 20 * implicit_header
+    divisor = 4 * (spreading_factor - 2 * low_data_rate_optimize)
+    payload_symbols = 8 + max((bits + divisor - 1) // divisor * (coding_rate + 4), 0)
+    return ((4 * preamble_length + 17) * symbol_time) // 4 + payload_symbols * symbol_time  # Preamble plus 4.25 symbols
+
+
+class Packet(object):
+    """
+    Preallocated slot the radio receives a packet into, so no objects are created per packet.
+    Slots are owned by the PacketRing, so a packet (and its message view) is only valid while it is handled, see PacketRing.drain().
+    """
+
+    __slots__ = ("buffer", "length", "header_to", "header_from", "header_id", "header_flags", "rssi", "_snr", "_view")
+
+    def __init__(self):
+        self.buffer = bytearray(MAX_PACKET_LENGTH)
+        self.length = 0
+        self.header_to = 0
+        self.header_from = 0
+        self.header_id = 0
+        self.header_flags = 0
+        self.rssi = 0  # dBm
+        self._snr = 0  # Quarter dB
+        self._view = memoryview(self.buffer)
+
+    @property
+    def message(self):
+        """
+        :return: View of the message in the slot (no copy, use bytes() to keep it)
+        :rtype: memoryview
+        """
+
+        return self._view[HEADER_LENGTH:self.length]
+
+    @property
+    def message_length(self):
+        return self.length - HEADER_LENGTH
+
+    @property
+    def snr(self):
+        return self._snr / 4
+
+    def byte_at(self, index):
+        """
+        :return: The byte of the message at index (read in place)
+        :rtype: int
+        """
+
+        return self.buffer[HEADER_LENGTH + index]
+
+    def unpack_from(self, format, offset=0):
+        """
+        Unpack a binary message in place, see struct.unpack_from().
+
+        :param str format: struct format of the message
+        :param int offset: Offset in the message, default is 0
+        :rtype: tuple
+        """
+
+        return struct.unpack_from(format, self.buffer, HEADER_LENGTH + offset)
+
+    def message_starts_with(self, word):
+        """
+        :param bytes word: The expected first word of the message
+        :return: True if the message starts with word, followed by white space or the end of the message (compared in place)
+        :rtype: bool
+        """
+
+        end = HEADER_LENGTH + len(word)
+        if end > self.length:
+            return False
+        for index in range(len(word)):
+            if self.buffer[HEADER_LENGTH + index] != word[index]:
+                return False
+        return end == self.length or self.buffer[end] in b" \t\r\n"
+
+
+class PacketRing(object):
+    """
+    Single-producer/single-consumer ring buffer of preallocated packet slots.
+    The producer is the radio's scheduled receive callback, the consumer the application.
+    Each side only moves its own index, so no locking is needed. If the ring is full, new packets are dropped (and counted),
+    as the producer must not touch the slots the consumer has not yet handled.
+    """
+
+    def __init__(self, capacity=constants.LORA_DATA_CACHE_SIZE):
+        """
+        :param int capacity: Maximum number of packets waiting to be handled, default is constants.LORA_DATA_CACHE_SIZE
+        """
+
+        self.capacity = capacity
+        self.received = 0    # Packets put in the ring since boot
+        self.dropped = 0     # Packets dropped since boot because the ring was full
+        self.overflows = 0   # Times the ring ran full since boot
+        self.high_water = 0  # Maximum number of packets waiting at once since boot
+        self._slots = [Packet() for _ in range(capacity + 1)]  # The slot at the head is always free for the producer
+        self._head = 0  # Written by the producer only
+        self._tail = 0  # Written by the consumer only
+        self._full = False
+
+    def __len__(self):
+        return (self._head - self._tail) % len(self._slots)
+
+    def reserve(self):
+        """
+        Producer side: The free slot the next packet can be received into. It only becomes visible to the consumer with commit().
+
+        :rtype: Packet
+        """
+
+        return self._slots[self._head]
+
+    def commit(self):
+        """
+        Producer side: Append the packet received into the reserved slot or drop it if the ring is full.
+
+        :return: False if the packet was dropped
+        :rtype: bool
+        """
+
+        head = (self._head + 1) % len(self._slots)
+        if head == self._tail:
+            if not self._full:
+                self._full = True
+                self.overflows += 1
+            self.dropped += 1
+            return False
+        self._full = False
+        self._head = head
+        self.received += 1
+        length = len(self)
+        if length > self.high_water:
+            self.high_water = length
+        return True
+
+    def pop(self):
+        """
+        Consumer side: Remove the oldest packet. Its slot may be reused as soon as the ring runs full again.
+
+        :return: The oldest packet or None if the ring is empty
+        :rtype: Packet or None
+        """
+
+        if self._tail == self._head:
+            return None
+        packet = self._slots[self._tail]
+        self._tail = (self._tail + 1) % len(self._slots)
+        return packet
+
+    def drain(self, handler, count=None):
+        """
+        Consumer side: Hand up to count of the oldest packets to handler, one at a time. Each slot is only released after the handler returned.
+        Only for the setup outside the event loop, see drain_async().
+
+        :param function handler: Called with each Packet
+        :param int count: Maximum number of packets to handle, default is None (all waiting)
+        :return: Number of packets handled
+        :rtype: int
+        """
+
+        handled = 0
+        while self._tail != self._head and (count is None or handled < count):
+            try:
+                handler(self._slots[self._tail])
+            finally:
+                self._tail = (self._tail + 1) % len(self._slots)
+            handled += 1
+        return handled
+
+    async def drain_async(self, handler, count=None):
+        # Async counterpart of drain(), handler is a coroutine function (e.g. it sends a reply with LoRa.send_reliably_async())
+
+        handled = 0
+        while self._tail != self._head and (count is None or handled < count):
+            try:
+                await handler(self._slots[self._tail])
+            finally:
+                self._tail = (self._tail + 1) % len(self._slots)
+            handled += 1
+        return handled
+
+    def clear(self):
+        self._tail = self._head
+
+    def counters(self):
+        """
+        :return: Packets received and dropped, overflows, high-water mark, capacity and packets currently waiting since boot
+        :rtype: dict
+        """
+
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "overflows": self.overflows,
+            "high_water": self.high_water,
+            "capacity": self.capacity,
+            "waiting": len(self)
+            }
+
+
 class LoRa(object):
 
     def __init__(
@@ -83,7 +311,8 @@ class LoRa(object):
         modem_config=ModemConfig.Bw125Cr45Sf128,
         receive_all=False,
         acknowledge=True,
-        crypto=None
+        crypto=None,
+        cache_size=constants.LORA_DATA_CACHE_SIZE
         ):
         """
         :param int address: address for this device [0-255], default constants.LORA_BROADCAST_ADDRESS
@@ -93,6 +322,7 @@ class LoRa(object):
         :param bool receive_all: if True, don't filter packets on address, default is False
         :param bool acknowledge: if True, acknowledge received messages (only those addressed to us and except broadcasts), default is True
         :param AES crypto: if desired, an instance of ucrypto AES (https://docs.pycom.io/firmwareapi/micropython/ucrypto/), default is None
+        :param int cache_size: maximum number of received packets waiting to be handled, default is constants.LORA_DATA_CACHE_SIZE
         """
 
         # Public attributes (change values at will)
@@ -101,9 +331,11 @@ class LoRa(object):
         self.acknowledge = acknowledge
         self.crypto = crypto
         self.send_retries = 3
-        self.cad_timeout = 0
-        self.wait_packet_sent_timeout = 0.2
-        self.receive_timeout = 0.2
+        self.cad_retries = constants.LORA_CAD_RETRIES  # Channel activity detections per frame before giving up, 0 disables listen-before-talk (frames are sent right away)
+        self.wait_packet_sent_timeout = 200  # ms
+        self.receive_timeout = 200  # ms, extended by a random delay of up to the same length
+        self.packet_received = asyncio.ThreadSafeFlag()  # Set whenever a packet was put in the cache, to be awaited by the application
+        self.send_lock = asyncio.Lock()  # Held by send_reliably_async(), hold it to change the radio's settings from a task (e.g. set_modem_config())
         
         # Constant attributes (do not change values)
         self._spi_mode = constants.LORA_SPI_MODE
@@ -122,12 +354,35 @@ class LoRa(object):
         self._receive_continuously = False
         self._mode = None
         self._cad = None
+        self._cad_done = False  # Set by _handle_interrupt()
+        self._airtime_credit = constants.LORA_DUTY_CYCLE_WINDOW * 1000 // constants.LORA_DUTY_CYCLE  # us that may still be sent within the duty cycle
+        self._airtime_credit_updated = ticks_ms()
+        self.airtime = 0  # us sent since boot
+        self.channel_busy = 0  # Channel activity detected before sending since boot
+        self.channel_access_failures = 0  # Frames not sent since boot, because the channel stayed busy
+        self.collisions = 0  # Frames sent reliably but not acknowledged (lost or collided) since boot
+        self.duty_cycle_blocked = 0  # Frames not sent since boot, because the duty cycle was used up
+        self._tx_done = False  # Set by _handle_interrupt()
+        self._radio_event = asyncio.ThreadSafeFlag()  # Set by _handle_interrupt() and whenever a packet was received, wakes the async waits up
+        self._in_callback = False  # True while a received packet is handled (see _receive_if_pending()), the waits read the IRQ flags directly then
+        self._busy = 0  # Depth of the register accesses in progress, the interrupt handler and the receive callback are deferred until it is back to 0, see _release()
+        self._interrupt_deferred = False  # The interrupt handler ran during a register access and is serviced by _release()
+        self._receive_pending = False  # A packet was received (RxDone) but not yet read from the FIFO
+        self._receive_deferred = False  # The receive callback ran during a register access and is run again by _release()
         self._last_header_id = 0
         self._last_payload = None
         self._prepare_payload_ref = self._prepare_payload
         self._new_payload = False
-        self._data_cache = deque((), constants.LORA_DATA_CACHE_SIZE)
-        
+        self._data_cache = PacketRing(cache_size)
+        self._last_header_ids = bytearray(256)  # Header ID of the last packet delivered from each address
+        self._last_receptions = array("l", [0] * 256)  # Time in ms (ticks) the last packet from each address was delivered
+        self._received_from = bytearray(32)  # Bit n is set if a packet from address n has been delivered
+        self.duplicates = 0  # Retransmitted packets that were acknowledged again but not delivered since boot
+        self._command_buffer = bytearray(2)  # Register address and value of single register accesses
+        self._response_buffer = bytearray(2)  # Response to single register reads
+        self._address_buffer = bytearray(1)  # Register address of burst accesses
+        self._header_buffer = bytearray(HEADER_LENGTH)  # Header of the packet to send
+        self._data_buffer = bytearray(1)  # Single byte data to send
         
         # MODULE SETUP
         self._reset()
@@ -148,52 +403,53 @@ class LoRa(object):
         assert self._spi_read(REG_01_OP_MODE) == (MODE_SLEEP | LONG_RANGE_MODE), \
             "LoRa initialization failed"
 
-        # Set address
-        self._spi_write(REG_0E_FIFO_TX_BASE_ADDR, 0)
-        self._spi_write(REG_0F_FIFO_RX_BASE_ADDR, 0)
-        
-        # Set modem configuration
-        self._spi_write(REG_1D_MODEM_CONFIG1, self._modem_config[0])
-        self._spi_write(REG_1E_MODEM_CONFIG2, self._modem_config[1])
-        self._spi_write(REG_26_MODEM_CONFIG3, self._modem_config[2])
-
-        # Set preamble length to 8
-        self._spi_write(REG_20_PREAMBLE_MSB, 0)
-        self._spi_write(REG_21_PREAMBLE_LSB, 8)
-
-        # Set frequency
-        frf = int((self._freq * 1000000.0) / FSTEP)
-        self._spi_write(REG_06_FRF_MSB, (frf >> 16) & 0xff)
-        self._spi_write(REG_07_FRF_MID, (frf >> 8) & 0xff)
-        self._spi_write(REG_08_FRF_LSB, frf & 0xff)
-        
         # Set TX power
         if self._tx_power < 5:
             self._tx_power = 5
         if self._tx_power > 23:
             self._tx_power = 23
         if self._tx_power < 20:
-            self._spi_write(REG_4D_PA_DAC, PA_DAC_ENABLE)
+            pa_dac = PA_DAC_ENABLE
             self._tx_power -= 3
         else:
-            self._spi_write(REG_4D_PA_DAC, PA_DAC_DISABLE)
-        self._spi_write(REG_09_PA_CONFIG, PA_SELECT | (self._tx_power - 5))
+            pa_dac = PA_DAC_DISABLE
+
+        frf = int((self._freq * 1000000.0) / FSTEP)
+        self._spi_write_registers(bytes((
+            # Set address
+            REG_0E_FIFO_TX_BASE_ADDR, 0,
+            REG_0F_FIFO_RX_BASE_ADDR, 0,
+            # Set modem configuration
+            REG_1D_MODEM_CONFIG1, self._modem_config[0],
+            REG_1E_MODEM_CONFIG2, self._modem_config[1],
+            REG_26_MODEM_CONFIG3, self._modem_config[2],
+            # Set preamble length to 8
+            REG_20_PREAMBLE_MSB, 0,
+            REG_21_PREAMBLE_LSB, 8,
+            # Set frequency
+            REG_06_FRF_MSB, (frf >> 16) & 0xff,
+            REG_07_FRF_MID, (frf >> 8) & 0xff,
+            REG_08_FRF_LSB, frf & 0xff,
+            # Set TX power
+            REG_4D_PA_DAC, pa_dac,
+            REG_09_PA_CONFIG, PA_SELECT | (self._tx_power - 5)
+            )))
 
         # Set continuous mode
         self._set_continuous_mode()
 
     # PUBLIC METHODS
+    # send_reliably() and send() block until the radio is done, they are meant for the setup outside the event loop (and the acknowledgements sent by the receive callback).
+    # Tasks use send_reliably_async(), which lets the other tasks run while the radio sends, listens before talk and waits for the acknowledgement.
 
     def send_reliably(self, data, header_to, header_flags=0, retries=None):
         self._set_mode_idle()
         if retries is not None:
             self.send_retries = retries
-        self._last_header_id += 1
-        if self._last_header_id > 0xff:  # RadioHead reliable datagram protocol only supports 8 bit unsigned int as header ID
-            self._last_header_id = 0
+        header_id = self._next_header_id()
         acknowledged = False
         for _ in range(self.send_retries):
-            if self.send(data, header_to, header_id=self._last_header_id, header_flags=header_flags):
+            if self.send(data, header_to, header_id=header_id, header_flags=header_flags):
                 if header_to == BROADCAST_ADDRESS:  # Don't wait for acknowledgements on broadcasts
                     acknowledged = True
                     break
@@ -201,48 +457,145 @@ class LoRa(object):
                     acknowledged = self._receive_timeout(receive_acknowledgements=True) is not None
                     if acknowledged:
                         break  # else retry
+                    self.collisions += 1
         self._set_continuous_mode()
         return acknowledged
 
+    async def send_reliably_async(self, data, header_to, header_flags=0):
+        """
+        Async counterpart of send_reliably(): Sends data to header_to and waits for its acknowledgement (unless broadcast), retrying up to self.send_retries times.
+        The task awaits the radio's interrupts meanwhile, so the other tasks keep running. Sends of several tasks are serialized by self.send_lock.
+
+        :param data: bytes-like, str or int (single byte)
+        :param int header_to: Address of the receiver
+        :param int header_flags: default is 0
+        :return: True if the data was acknowledged (broadcasts: sent)
+        :rtype: bool
+        """
+
+        async with self.send_lock:
+            header_id = self._next_header_id()
+            acknowledged = False
+            for _ in range(self.send_retries):
+                if await self._send_async(data, header_to, header_id, header_flags):
+                    if header_to == BROADCAST_ADDRESS:  # Don't wait for acknowledgements on broadcasts
+                        acknowledged = True
+                        break
+                    acknowledged = await self._receive_acknowledgement_async()
+                    if acknowledged:
+                        break  # else retry
+                    self.collisions += 1
+            self._set_continuous_mode()
+            return acknowledged
+
     def send(self, data, header_to, header_id=0, header_flags=0):
         self._set_mode_idle()
-        header = [header_to, self.address, header_id, header_flags]
-        if type(data) == int:
-            data = [data]
-        elif type(data) == bytes:
-            data = [p for p in data]
-        elif type(data) == str:
-            data = [ord(s) for s in data]
-        if self.crypto:
-            data = [b for b in self._encrypt(bytes(data))]
-        payload = header + data
-        self._spi_write(REG_0D_FIFO_ADDR_PTR, 0)
-        self._spi_write(REG_00_FIFO, payload)
-        self._spi_write(REG_22_PAYLOAD_LENGTH, len(payload))
-        self._wait_cad()
-        self._set_mode_tx()
+        data = self._encode(data)
+        airtime = self.airtime_of(HEADER_LENGTH + len(data))
+        if not self._use_airtime(airtime):
+            self.duty_cycle_blocked += 1
+            self._set_continuous_mode()
+            return False
+        if not header_flags & FLAGS_ACK and not self._wait_cad():  # Acknowledgements are awaited right away, no need to listen before
+            self._airtime_credit += airtime
+            self.channel_access_failures += 1
+            self._set_continuous_mode()
+            return False
+        self._start_tx(data, header_to, header_id, header_flags)
         success = self._wait_packet_sent()
+        self.airtime += airtime
         self._set_continuous_mode()
         return success
 
+    def airtime_of(self, length, modem_config=None):
+        """
+        :param int length: Length of the packet including the header in bytes
+        :param ModemConfig modem_config: default is None (the current modem configuration)
+        :return: Time on air of the packet in microseconds, see airtime()
+        :rtype: int
+        """
+
+        return airtime(modem_config or self._modem_config, length)
+
+    @property
+    def modem_config(self):
+        return self._modem_config
+
+    def set_modem_config(self, modem_config):
+        """
+        Switch to another modem configuration (both for sending and receiving).
+        The timeouts are extended to the time on air of a full packet (sending) and twice that of an ACK (receiving) if these are longer.
+
+        :param ModemConfig modem_config: see ModemConfig
+        """
+
+        self._set_mode_idle()
+        self._spi_write_registers(bytes((
+            REG_1D_MODEM_CONFIG1, modem_config[0],
+            REG_1E_MODEM_CONFIG2, modem_config[1],
+            REG_26_MODEM_CONFIG3, modem_config[2]
+            )))
+        self._modem_config = modem_config
+        self.wait_packet_sent_timeout = max(200, self.airtime_of(MAX_PACKET_LENGTH) // 1000 + CAD_TIMEOUT)
+        self.receive_timeout = max(200, 2 * self.airtime_of(HEADER_LENGTH + 1) // 1000)
+        self._set_continuous_mode()
+
     def receive(self, receive_all=None, acknowledge=None, receive_acknowledgements=False):
         if receive_all is not None:
             self.receive_all = receive_all
         if acknowledge is not None:
             self.acknowledge = acknowledge
-        if bool(self._data_cache) and self._receive_continuously:
-            return self._data_cache.popleft()
+        if len(self._data_cache) and self._receive_continuously:
+            return self._data_cache.pop()
         else:
             payload = self._receive_timeout(receive_acknowledgements=receive_acknowledgements)
-            if bool(self._data_cache):
-                return self._data_cache.popleft()
+            if len(self._data_cache):
+                return self._data_cache.pop()
             else:
                 return payload
 
     @property
     def received_data(self):
         for _ in range(len(self._data_cache)):
-            yield self._data_cache.popleft()
+            yield self._data_cache.pop()
+
+    @property
+    def cache(self):
+        """
+        :return: The ring buffer of received packets, e.g. to read its counters
+        :rtype: PacketRing
+        """
+
+        return self._data_cache
+
+    def drain(self, handler, count=None):
+        """
+        Hand up to count received packets to handler without allocating, see PacketRing.drain().
+        """
+
+        return self._data_cache.drain(handler, count)
+
+    async def drain_async(self, handler, count=None):
+        """
+        Async counterpart of drain(), see PacketRing.drain_async().
+        """
+
+        return await self._data_cache.drain_async(handler, count)
+
+    def counters(self):
+        """
+        :return: The counters of the received packet cache (see PacketRing.counters()), the number of duplicates suppressed and the channel access counters since boot (airtime in us)
+        :rtype: dict
+        """
+
+        counters = self._data_cache.counters()
+        counters["duplicates"] = self.duplicates
+        counters["airtime"] = self.airtime
+        counters["channel_busy"] = self.channel_busy
+        counters["channel_access_failures"] = self.channel_access_failures
+        counters["collisions"] = self.collisions
+        counters["duty_cycle_blocked"] = self.duty_cycle_blocked
+        return counters
 
     def receive_continuously(self, receive_all=None, acknowledge=None):
         self._set_mode_idle()
@@ -260,40 +613,57 @@ class LoRa(object):
     def sleep(self):
         self._receive_continuously = False
         if self._mode != MODE_SLEEP:
-            self._spi_write(REG_01_OP_MODE, MODE_SLEEP)
-            self._mode = MODE_SLEEP
+            self._busy += 1
+            try:
+                self._spi_write(REG_01_OP_MODE, MODE_SLEEP)
+                self._mode = MODE_SLEEP
+            finally:
+                self._release()
 
     def close(self):
         self._interrupt.irq(trigger=0, handler=None)
-        self._data_cache = deque((), constants.LORA_DATA_CACHE_SIZE)
+        self._data_cache.clear()
         self._spi.deinit()
         self._reset()
 
     # PRIVATE METHODS
 
-    # Mode setting
+    # Mode setting (the registers and self._mode are changed in one step, see _release())
     def _set_mode_tx(self):
         if self._mode != MODE_TX:
-            self._spi_write(REG_01_OP_MODE, MODE_TX)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x40)  # Interrupt on TxDone
-            self._mode = MODE_TX
+            self._busy += 1
+            try:
+                self._spi_write_registers(MODE_TX_REGISTERS)
+                self._mode = MODE_TX
+            finally:
+                self._release()
 
     def _set_mode_rx(self):
         if self._mode != MODE_RXCONTINUOUS:
-            self._spi_write(REG_01_OP_MODE, MODE_RXCONTINUOUS)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x00)  # Interrupt on RxDone
-            self._mode = MODE_RXCONTINUOUS
+            self._busy += 1
+            try:
+                self._spi_write_registers(MODE_RX_REGISTERS)
+                self._mode = MODE_RXCONTINUOUS
+            finally:
+                self._release()
             
     def _set_mode_cad(self):
         if self._mode != MODE_CAD:
-            self._spi_write(REG_01_OP_MODE, MODE_CAD)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x80)  # Interrupt on CadDone
-            self._mode = MODE_CAD
+            self._busy += 1
+            try:
+                self._spi_write_registers(MODE_CAD_REGISTERS)
+                self._mode = MODE_CAD
+            finally:
+                self._release()
 
     def _set_mode_idle(self):
         if self._mode != MODE_STDBY:
-            self._spi_write(REG_01_OP_MODE, MODE_STDBY)
-            self._mode = MODE_STDBY
+            self._busy += 1
+            try:
+                self._spi_write(REG_01_OP_MODE, MODE_STDBY)
+                self._mode = MODE_STDBY
+            finally:
+                self._release()
 
     def _set_continuous_mode(self):
         if self._receive_continuously:
@@ -301,26 +671,82 @@ class LoRa(object):
         else:
             self._set_mode_idle()
 
-    # Writing and reading registers
-    def _spi_write(self, register, payload):
-        if type(payload) == int:
-            payload = [payload]
-        elif type(payload) == bytes:
-            payload = [p for p in payload]
-        elif type(payload) == str:
-            payload = [ord(s) for s in payload]
-        self._cs.value(0)
-        self._spi.write(bytearray([register | 0x80] + payload))
-        self._cs.value(1)
-
-    def _spi_read(self, register, length=1):
-        self._cs.value(0)
-        if length == 1:
-            data = self._spi.read(length + 1, register)[1]
-        else:
-            data = self._spi.read(length + 1, register)[1:]
-        self._cs.value(1)
-        return data
+    # Mutual exclusion of the register accesses
+    # The pin interrupt and the receive callback are soft (scheduled) callbacks, so they may run between any two bytecodes of the code they interrupt.
+    # Every access to the persistent buffers, the SPI bus or self._mode counts self._busy up for its duration (a single bytecode, no callback runs in between).
+    # A callback that finds self._busy set only marks itself as deferred and is run by _release() once the access in progress is done.
+    def _release(self):
+        self._busy -= 1
+        if self._busy:
+            return
+        if self._interrupt_deferred:
+            self._interrupt_deferred = False
+            self._service_interrupt()
+        if self._receive_deferred:
+            self._receive_deferred = False
+            self._receive_if_pending()
+
+    # Writing and reading registers (through persistent buffers, so no allocation)
+    def _spi_write(self, register, value):
+        self._busy += 1
+        try:
+            self._command_buffer[0] = register | 0x80
+            self._command_buffer[1] = value
+            self._cs.value(0)
+            self._spi.write(self._command_buffer)
+            self._cs.value(1)
+        finally:
+            self._release()
+
+    def _spi_write_registers(self, values):
+        # Writes the (register, value) pairs of the flat bytes-like values in order, e.g. all registers of a mode switch
+
+        self._busy += 1
+        try:
+            for index in range(0, len(values), 2):
+                self._spi_write(values[index], values[index + 1])
+        finally:
+            self._release()
+
+    def _spi_write_from(self, register, buffer, more=None):
+        # Writes buffer (and more) in one burst starting at register, e.g. the FIFO
+
+        self._busy += 1
+        try:
+            self._address_buffer[0] = register | 0x80
+            self._cs.value(0)
+            self._spi.write(self._address_buffer)
+            self._spi.write(buffer)
+            if more:
+                self._spi.write(more)
+            self._cs.value(1)
+        finally:
+            self._release()
+
+    def _spi_read(self, register):
+        self._busy += 1
+        try:
+            self._command_buffer[0] = register & 0x7f
+            self._command_buffer[1] = 0
+            self._cs.value(0)
+            self._spi.write_readinto(self._command_buffer, self._response_buffer)
+            self._cs.value(1)
+            return self._response_buffer[1]
+        finally:
+            self._release()
+
+    def _spi_read_into(self, register, buffer):
+        # Reads len(buffer) bytes in one burst starting at register into buffer (e.g. a memoryview of a packet slot)
+
+        self._busy += 1
+        try:
+            self._address_buffer[0] = register & 0x7f
+            self._cs.value(0)
+            self._spi.write(self._address_buffer)
+            self._spi.readinto(buffer, register)
+            self._cs.value(1)
+        finally:
+            self._release()
 
     # Resetting
     def _reset(self):
@@ -330,7 +756,17 @@ class LoRa(object):
         gpio_reset.value(1)
         sleep(0.01)
     
-    # Encrypting and Decrypting
+    # Encoding, Encrypting and Decrypting
+    def _encode(self, data):
+        if type(data) == int:
+            self._data_buffer[0] = data
+            data = self._data_buffer
+        elif type(data) == str:
+            data = data.encode()
+        if self.crypto:
+            data = self._encrypt(bytes(data))
+        return data
+
     def _decrypt(self, message):
         decrypted_msg = self.crypto.decrypt(message)
         msg_length = decrypted_msg[0]
@@ -343,40 +779,159 @@ class LoRa(object):
         encrypted_msg = self.crypto.encrypt(msg_bytes)
         return encrypted_msg
 
+    # Waiting for the radio (the CPU idles until the next interrupt between the checks)
+    def _wait_for_interrupt(self, flag, deadline):
+        while not getattr(self, flag):
+            if ticks_diff(deadline, ticks_ms()) <= 0:
+                return False
+            if self._in_callback:  # Pin interrupts are only serviced after the running callback, read the flags directly
+                if self._spi_read(REG_12_IRQ_FLAGS):
+                    self._service_interrupt()
+            else:
+                idle()
+        return True
+
+    async def _wait_for_interrupt_async(self, flag, deadline):
+        # Async counterpart of _wait_for_interrupt()
+
+        while not getattr(self, flag):
+            if not await self._wait_event_async(deadline):
+                return False
+        return True
+
+    async def _wait_event_async(self, deadline):
+        # Waits for the next interrupt or received packet until deadline (ticks in ms), returns False if the deadline had passed
+
+        remaining = ticks_diff(deadline, ticks_ms())
+        if remaining <= 0:
+            return False
+        try:
+            await asyncio.wait_for_ms(self._radio_event.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+        return True
+
     # Channel activity detection
-    def _is_channel_active(self):
+    def _is_channel_active(self, deadline):
+        self._cad_done = False
         self._set_mode_cad()
-        while self._mode == MODE_CAD:  # wait for _handle_interrupt to switch the mode
-            yield
+        if not self._wait_for_interrupt("_cad_done", deadline):
+            self._set_continuous_mode()
+            return None
         return self._cad
-    
+
     def _wait_cad(self):
-        if not self.cad_timeout:
+        # Listen before talk: Detects channel activity up to self.cad_retries times with an exponential random backoff in between, returns True if the channel is clear
+        # (always if self.cad_retries is 0, which disables listen before talk)
+
+        if not self.cad_retries:
             return True
-        start = time()
-        for status in self._is_channel_active():
-            if time() - start < self.cad_timeout:
-                return False
-            if status is None:
-                sleep(0.1)
-                continue
-            else:
-                return status
+        for attempt in range(self.cad_retries):
+            if self._is_channel_active(ticks_add(ticks_ms(), CAD_TIMEOUT)) == 0:
+                return True
+            self.channel_busy += 1
+            window = min(constants.LORA_BACKOFF_MIN << attempt, constants.LORA_BACKOFF_MAX)
+            sleep_ms((window * getrandbits(16)) >> 16)
+        return False
 
-    # Sending utils
-    def _wait_packet_sent(self):
-        start = time()
-        while time() - start < self.wait_packet_sent_timeout:
-            if self._mode != MODE_TX:  # wait for _handle_interrupt to switch the mode
+    async def _is_channel_active_async(self, deadline):
+        # Async counterpart of _is_channel_active()
+
+        self._cad_done = False
+        self._set_mode_cad()
+        if not await self._wait_for_interrupt_async("_cad_done", deadline):
+            self._set_continuous_mode()
+            return None
+        return self._cad
+
+    async def _wait_cad_async(self):
+        # Async counterpart of _wait_cad(), the other tasks run during the backoff
+
+        if not self.cad_retries:
+            return True
+        for attempt in range(self.cad_retries):
+            if await self._is_channel_active_async(ticks_add(ticks_ms(), CAD_TIMEOUT)) == 0:
                 return True
+            self.channel_busy += 1
+            window = min(constants.LORA_BACKOFF_MIN << attempt, constants.LORA_BACKOFF_MAX)
+            await asyncio.sleep_ms((window * getrandbits(16)) >> 16)
         return False
 
+    # Duty cycle
+    def _use_airtime(self, airtime):
+        # Token bucket: constants.LORA_DUTY_CYCLE of the time elapsed becomes available again, up to the share of constants.LORA_DUTY_CYCLE_WINDOW
+
+        now = ticks_ms()
+        self._airtime_credit = min(
+            self._airtime_credit + ticks_diff(now, self._airtime_credit_updated) * 1000 // constants.LORA_DUTY_CYCLE,
+            constants.LORA_DUTY_CYCLE_WINDOW * 1000 // constants.LORA_DUTY_CYCLE
+            )
+        self._airtime_credit_updated = now
+        if airtime > self._airtime_credit:
+            return False
+        self._airtime_credit -= airtime
+        return True
+
+    # Sending utils
+    def _next_header_id(self):
+        self._last_header_id += 1
+        if self._last_header_id > 0xff:  # RadioHead reliable datagram protocol only supports 8 bit unsigned int as header ID
+            self._last_header_id = 0
+        return self._last_header_id
+
+    async def _send_async(self, data, header_to, header_id, header_flags):
+        # Async counterpart of send()
+
+        self._set_mode_idle()
+        data = self._encode(data)
+        airtime = self.airtime_of(HEADER_LENGTH + len(data))
+        if not self._use_airtime(airtime):
+            self.duty_cycle_blocked += 1
+            self._set_continuous_mode()
+            return False
+        if not header_flags & FLAGS_ACK and not await self._wait_cad_async():
+            self._airtime_credit += airtime
+            self.channel_access_failures += 1
+            self._set_continuous_mode()
+            return False
+        self._start_tx(data, header_to, header_id, header_flags)
+        success = await self._wait_for_interrupt_async("_tx_done", ticks_add(ticks_ms(), self.wait_packet_sent_timeout))
+        self.airtime += airtime
+        self._set_continuous_mode()
+        return success
+
+    def _start_tx(self, data, header_to, header_id, header_flags):
+        # Fills the FIFO and starts sending in one step, so no callback interleaves
+
+        self._busy += 1
+        try:
+            self._set_mode_idle()
+            if self._interrupt_deferred:  # A packet may have come in while switching to idle
+                self._interrupt_deferred = False
+                self._service_interrupt()
+            self._receive_if_pending()  # The FIFO regions for RX and TX overlap, read the packet first
+            self._set_mode_idle()
+            self._header_buffer[0] = header_to
+            self._header_buffer[1] = self.address
+            self._header_buffer[2] = header_id
+            self._header_buffer[3] = header_flags
+            self._spi_write(REG_0D_FIFO_ADDR_PTR, 0)
+            self._spi_write_from(REG_00_FIFO, self._header_buffer, data)
+            self._spi_write(REG_22_PAYLOAD_LENGTH, HEADER_LENGTH + len(data))
+            self._tx_done = False
+            self._set_mode_tx()
+        finally:
+            self._release()
+
+    def _wait_packet_sent(self):
+        return self._wait_for_interrupt("_tx_done", ticks_add(ticks_ms(), self.wait_packet_sent_timeout))
+
     # Receiving utils
     def _receive_timeout(self, receive_acknowledgements):
         payload = None
         self._set_mode_rx()
-        start = time()
-        while time() - start < self.receive_timeout + (self.receive_timeout * (getrandbits(16) / (2**16 - 1))):
+        deadline = ticks_add(ticks_ms(), self.receive_timeout + ((self.receive_timeout * getrandbits(16)) >> 16))
+        while ticks_diff(deadline, ticks_ms()) > 0:
             if self._new_payload:
                 payload = self._last_payload
                 self._new_payload = False
@@ -388,61 +943,138 @@ class LoRa(object):
                 else:  # Continue listening
                     payload = None
                     self._set_mode_rx()
+            else:
+                idle()
         self._set_continuous_mode()
         return payload
 
+    async def _receive_acknowledgement_async(self):
+        # Async counterpart of _receive_timeout(receive_acknowledgements=True), returns True once the acknowledgement of the last packet sent was received
+
+        acknowledged = False
+        self._set_mode_rx()
+        deadline = ticks_add(ticks_ms(), self.receive_timeout + ((self.receive_timeout * getrandbits(16)) >> 16))
+        while True:
+            if self._new_payload:
+                self._new_payload = False
+                if self._is_acknowledgement(self._last_payload):
+                    acknowledged = True
+                    break
+                self._set_mode_rx()  # Continue listening
+            elif not await self._wait_event_async(deadline):
+                break
+        self._set_continuous_mode()
+        return acknowledged
+
     def _is_acknowledgement(self, payload):
-        return payload.header_flags & FLAGS_ACK and payload.header_to == self.address and not payload.header_to == BROADCAST_ADDRESS and payload.header_id == self._last_header_id
+        # Acknowledgements to the broadcast address are only addressed to this radio while it has no address of its own (e.g. probing Hub IDs, see hub._lora_setup())
+        return payload.header_flags & FLAGS_ACK and payload.header_to == self.address and payload.header_id == self._last_header_id
 
     def _is_of_interest(self, payload):
         return not payload.header_flags & FLAGS_ACK and (payload.header_to == self.address or payload.header_to == BROADCAST_ADDRESS or self.receive_all is True)
 
+    def _is_duplicate(self, packet):
+        sender = packet.header_from
+        return (self._received_from[sender >> 3] >> (sender & 7)) & 1 \
+            and self._last_header_ids[sender] == packet.header_id \
+            and ticks_diff(ticks_ms(), self._last_receptions[sender]) < constants.LORA_DUPLICATE_WINDOW
+
+    def _remember(self, packet):
+        sender = packet.header_from
+        self._received_from[sender >> 3] |= 1 << (sender & 7)
+        self._last_header_ids[sender] = packet.header_id
+        self._last_receptions[sender] = ticks_ms()
+
     def _acknowledge(self, payload):
         if self.acknowledge and payload.header_to == self.address and not payload.header_flags & FLAGS_ACK:
             self.send(b'!', payload.header_from, payload.header_id, FLAGS_ACK)
 
     # Interrupt handler
     def _handle_interrupt(self, channel):
-        irq_flags = self._spi_read(REG_12_IRQ_FLAGS)
-        # print("In _handle_interrupt() MODE: {:02x} FLAGS: {:02x}".format(self._mode, irq_flags))
-        if self._mode == MODE_RXCONTINUOUS and (irq_flags & RX_DONE):
-            self._set_mode_idle()
-            schedule(self._prepare_payload_ref, 0)
-        elif self._mode == MODE_TX and (irq_flags & TX_DONE):
-            self._set_continuous_mode()
-        elif self._mode == MODE_CAD and (irq_flags & CAD_DONE):
-            self._cad = irq_flags & CAD_DETECTED
-            self._set_continuous_mode()
-        self._spi_write(REG_12_IRQ_FLAGS, 0xff)  # Clear all IRQ flags
+        if self._busy:
+            self._interrupt_deferred = True  # Serviced by _release() once the register access in progress is done
+            return
+        self._service_interrupt()
+
+    def _service_interrupt(self):
+        self._busy += 1
+        try:
+            irq_flags = self._spi_read(REG_12_IRQ_FLAGS)
+            # print("In _service_interrupt() MODE: {:02x} FLAGS: {:02x}".format(self._mode, irq_flags))
+            if self._mode != MODE_TX and (irq_flags & RX_DONE):  # The mode may have been left since, if the interrupt was deferred
+                self._set_mode_idle()
+                self._receive_pending = True
+                schedule(self._prepare_payload_ref, 0)
+            elif self._mode == MODE_TX and (irq_flags & TX_DONE):
+                self._set_continuous_mode()
+                self._tx_done = True
+                self._radio_event.set()
+            elif self._mode == MODE_CAD and (irq_flags & CAD_DONE):
+                self._cad = irq_flags & CAD_DETECTED
+                self._set_continuous_mode()
+                self._cad_done = True
+                self._radio_event.set()
+            self._spi_write(REG_12_IRQ_FLAGS, irq_flags)  # Clear the IRQ flags handled (not those raised since, e.g. RxDone right after switching to RX)
+        finally:
+            self._release()
         
     def _prepare_payload(self, _):
+        if self._busy:
+            self._receive_deferred = True  # Run by _release() once the register access in progress is done
+            return
+        self._receive_if_pending()
+
+    def _receive_if_pending(self):
+        # Reads the packet received (if any) from the FIFO and acknowledges it, on the receive callback or before the FIFO gets overwritten
+
+        if not self._receive_pending:
+            return
+        self._receive_pending = False
+        in_callback = self._in_callback
+        self._in_callback = True
+        try:
+            self._receive_packet()
+        finally:
+            self._in_callback = in_callback
+
+    def _receive_packet(self):
         packet_len = self._spi_read(REG_13_RX_NB_BYTES)
         self._spi_write(REG_0D_FIFO_ADDR_PTR, self._spi_read(REG_10_FIFO_RX_CURRENT_ADDR))
-        packet = self._spi_read(REG_00_FIFO, packet_len)
-        snr = self._spi_read(REG_19_PKT_SNR_VALUE) / 4
-        rssi = self._spi_read(REG_1A_PKT_RSSI_VALUE)
-        if snr < 0:
-            rssi = snr + rssi
-        else:
-            rssi = rssi * 16 / 15
-        if self._freq >= 779:
-            rssi = round(rssi - 157, 2)
-        else:
-            rssi = round(rssi - 164, 2)
-        if packet_len >= 4:
-            header_to = packet[0]
-            header_from = packet[1]
-            header_id = packet[2]
-            header_flags = packet[3]
-            message = bytes(packet[4:]) if packet_len > 4 else b''
-            if self.crypto and len(message) % 16 == 0:
-                message = self._decrypt(message)
-            self._last_payload = namedtuple(
-                "Payload",
-                ['message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr']
-                )(message, header_to, header_from, header_id, header_flags, rssi, snr)    
+        if packet_len >= HEADER_LENGTH:
+            packet = self._data_cache.reserve()
+            self._spi_read_into(REG_00_FIFO, packet._view[:packet_len])
+            packet.length = packet_len
+            snr = self._spi_read(REG_19_PKT_SNR_VALUE)
+            if snr > 127:  # Two's complement
+                snr -= 256
+            rssi = self._spi_read(REG_1A_PKT_RSSI_VALUE)
+            if snr < 0:
+                rssi = rssi + snr // 4
+            else:
+                rssi = rssi * 16 // 15
+            if self._freq >= 779:
+                rssi -= 157
+            else:
+                rssi -= 164
+            packet.rssi = rssi
+            packet._snr = snr
+            packet.header_to = packet.buffer[0]
+            packet.header_from = packet.buffer[1]
+            packet.header_id = packet.buffer[2]
+            packet.header_flags = packet.buffer[3]
+            if self.crypto and packet_len > HEADER_LENGTH and (packet_len - HEADER_LENGTH) % 16 == 0:
+                message = self._decrypt(bytes(packet.message))
+                packet.buffer[HEADER_LENGTH:HEADER_LENGTH + len(message)] = message
+                packet.length = HEADER_LENGTH + len(message)
+            self._last_payload = packet
             self._new_payload = True
-            if self._receive_continuously and not header_flags & FLAGS_ACK:
-                self._data_cache.append(self._last_payload)
-                self._acknowledge(self._last_payload)
+            self._radio_event.set()
+            if self._receive_continuously and not packet.header_flags & FLAGS_ACK:
+                if self._is_duplicate(packet):  # Our acknowledgement got lost, the sender retransmitted
+                    self.duplicates += 1
+                    self._acknowledge(packet)
+                elif self._data_cache.commit():  # Dropped packets are not acknowledged, so the sender retries
+                    self._remember(packet)
+                    self._acknowledge(packet)
+                    self.packet_received.set()
         self._set_continuous_mode()
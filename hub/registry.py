@@ -0,0 +1,138 @@
+# BLOOM Hub
+# Paired sensor registry
+# Author: Simon Aschenbrenner
+
+from array import array
+import constants
+
+
+class SensorRegistry(object):
+    """
+    In-RAM registry of the sensors paired to this hub, loaded from the NVS once at boot.
+    Pairings are kept in a bitmap and the last-seen timestamps in an array indexed by sensor ID,
+    so the queries for every received packet and every sync cycle don't touch the NVS.
+
+    Pairings and unpairings are written to the NVS right away, last-seen timestamps are written behind:
+    They are only persisted by flush() (called every constants.REGISTRY_FLUSH_INTERVAL and on reset) or if they moved on by more than constants.REGISTRY_FLUSH_THRESHOLD,
+    so after an unclean reboot at most one flush interval of timestamps is lost.
+    The registry takes part in the transactions of the configuration, so a rolled back transaction also rolls back the registry.
+    """
+
+    def __init__(self, configuration):
+        """
+        :param NVS configuration: The NVS the paired sensors are persisted in (one timestamp per sensor, see constants.NVS_KEY_PAIRED_SENSOR_PREFIX)
+        """
+
+        self._configuration = configuration
+        self._paired = 0  # Bit n is set if sensor n is paired
+        self._dirty = 0   # Bit n is set if the last-seen timestamp of sensor n is not yet persisted
+        self._last_seen = array("l", [0] * constants.LORA_MAX_PAIRED_SENSORS)
+        self._persisted = array("l", [0] * constants.LORA_MAX_PAIRED_SENSORS)  # Last-seen timestamps as stored in the NVS
+        self.writes = 0          # NVS writes of timestamps since boot
+        self.writes_avoided = 0  # Timestamp updates since boot that did not need an NVS write (yet)
+        for sensor_id in range(constants.LORA_MAX_PAIRED_SENSORS):
+            timestamp = configuration.read_int(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id))
+            if timestamp is not None:
+                self._paired |= 1 << sensor_id
+                self._last_seen[sensor_id] = timestamp
+                self._persisted[sensor_id] = timestamp
+        configuration.register(self)
+
+    def is_paired(self, sensor_id):
+        """
+        :return: True if the sensor is paired to this hub
+        :rtype: bool
+        """
+
+        return 0 <= sensor_id < constants.LORA_MAX_PAIRED_SENSORS and bool((self._paired >> sensor_id) & 1)
+
+    def paired_ids(self):
+        """
+        :return: The IDs of all paired sensors
+        :rtype: set of ints
+        """
+
+        return set(sensor_id for sensor_id in range(constants.LORA_MAX_PAIRED_SENSORS) if (self._paired >> sensor_id) & 1)
+
+    def silent_ids(self, current_time):
+        """
+        :param int current_time: The current time in seconds
+        :return: The IDs of all paired sensors that have not been heard of for more than constants.LORA_MAX_SILENT_TIME
+        :rtype: set of ints
+        """
+
+        return set(sensor_id for sensor_id in self.paired_ids() if current_time - self._last_seen[sensor_id] > constants.LORA_MAX_SILENT_TIME)
+
+    def last_seen(self, sensor_id):
+        """
+        :return: The time in seconds the sensor was last heard of or None if it is not paired
+        :rtype: int or None
+        """
+
+        if not self.is_paired(sensor_id):
+            return None
+        return self._last_seen[sensor_id]
+
+    def update(self, sensor_id, timestamp):
+        """
+        Pair the sensor (if not already paired) and set the time it was last heard of.
+        A new pairing or a timestamp that moved on by more than constants.REGISTRY_FLUSH_THRESHOLD is persisted right away, otherwise it is left to flush().
+        """
+
+        self._last_seen[sensor_id] = timestamp
+        if self.is_paired(sensor_id) and abs(timestamp - self._persisted[sensor_id]) <= constants.REGISTRY_FLUSH_THRESHOLD:
+            if (self._dirty >> sensor_id) & 1:
+                self.writes_avoided += 1  # Coalesced with the pending write
+            self._dirty |= 1 << sensor_id
+            return
+        self._paired |= 1 << sensor_id
+        self._write(sensor_id)
+
+    def flush(self):
+        """
+        Persist all last-seen timestamps that changed since they were last written to the NVS.
+        """
+
+        sensor_id = 0
+        with self._configuration.transaction():  # Single commit
+            while self._dirty:
+                if self._dirty & 1 << sensor_id:
+                    self._write(sensor_id)
+                sensor_id += 1
+
+    def unpair(self, sensor_id):
+        """
+        Remove the sensor from the registry and the NVS.
+        """
+
+        self._paired &= ~(1 << sensor_id)
+        self._dirty &= ~(1 << sensor_id)
+        self._last_seen[sensor_id] = 0
+        self._persisted[sensor_id] = 0
+        self._configuration.delete(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id))
+
+    def snapshot(self):
+        """
+        :return: The state of the registry, to be given back to restore() (called by the transactions of the configuration, see NVS.register())
+        """
+
+        return self._paired, self._dirty, array("l", self._last_seen), array("l", self._persisted)
+
+    def restore(self, snapshot):
+        self._paired, self._dirty, last_seen, persisted = snapshot
+        self._last_seen[:] = last_seen
+        self._persisted[:] = persisted
+
+    def counters(self):
+        """
+        :return: NVS writes of last-seen timestamps and timestamp updates that did not need an NVS write since boot
+        :rtype: dict
+        """
+
+        return { "writes": self.writes, "writes_avoided": self.writes_avoided, "pending": bin(self._dirty).count("1") }
+
+    def _write(self, sensor_id):
+        self._configuration.write_int(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id), self._last_seen[sensor_id])
+        self._persisted[sensor_id] = self._last_seen[sensor_id]
+        self._dirty &= ~(1 << sensor_id)
+        self.writes += 1
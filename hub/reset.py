@@ -65,32 +65,45 @@ def reset(wlan=False, lora=False):
     stop_water()
     hub.lora.close()
 
-    reboot_counter = hub.configuration.read_int(constants.NVS_KEY_REBOOT_COUNTER)
-    last_reboot = hub.configuration.read_int(constants.NVS_KEY_LAST_REBOOT_TIMESTAMP)
-    if (reboot_counter is None) or (last_reboot is None) or (time() - last_reboot > constants.REBOOT_COUNTER_RESET_TIME):
-        reboot_counter = 1
-    else:
-        reboot_counter += 1
+    with hub.configuration.transaction():  # All changes below are committed at once
+        try:
+            hub.registry.flush()  # Persist the last-seen timestamps of the sensors
+        except Exception as e:
+            print("Sensor registry flush failed:", e)
+        try:
+            hub.journal.sync()  # Persist the acknowledged measurements, so they are not sent again
+        except Exception as e:
+            print("Journal sync failed:", e)
+
+        reboot_counter = hub.configuration.read_int(constants.NVS_KEY_REBOOT_COUNTER)
+        last_reboot = hub.configuration.read_int(constants.NVS_KEY_LAST_REBOOT_TIMESTAMP)
+        if (reboot_counter is None) or (last_reboot is None) or (time() - last_reboot > constants.REBOOT_COUNTER_RESET_TIME):
+            reboot_counter = 1
+        else:
+            reboot_counter += 1
+
+        if wlan:
+            hub.display_message(constants.MESSAGE_RESET_WLAN_DONE)
+            hub.configuration.delete(constants.NVS_KEY_WLAN_ESSID)
+            hub.configuration.delete(constants.NVS_KEY_WLAN_PASSWORD)
+        if lora:
+            hub.display_message(constants.MESSAGE_RESET_LORA_DONE)
+            hub.configuration.delete(constants.NVS_KEY_LORA_HUB_ID)
+            unpair_all_sensors()
+        if wlan and lora:
+            hub.display_message(constants.MESSAGE_RESET_FACTORY_DONE)
+            reboot_counter = 0
+
+        if reboot_counter > constants.MAX_REBOOT_ATTEMPTS:
+            hub.configuration.delete(constants.NVS_KEY_REBOOT_COUNTER)
+        else:
+            hub.configuration.write_int(constants.NVS_KEY_REBOOT_COUNTER, reboot_counter)
+            hub.configuration.write_int(constants.NVS_KEY_LAST_REBOOT_TIMESTAMP, time())
 
-    if wlan:
-        hub.display_message(constants.MESSAGE_RESET_WLAN_DONE)
-        hub.configuration.delete(constants.NVS_KEY_WLAN_ESSID)
-        hub.configuration.delete(constants.NVS_KEY_WLAN_PASSWORD)
-    if lora:
-        hub.display_message(constants.MESSAGE_RESET_LORA_DONE)
-        hub.configuration.delete(constants.NVS_KEY_LORA_HUB_ID)
-        unpair_all_sensors()
-    if wlan and lora:
-        hub.display_message(constants.MESSAGE_RESET_FACTORY_DONE)
-        reboot_counter = 0
-    
     print("Reboot #{}".format(reboot_counter))
     if reboot_counter > constants.MAX_REBOOT_ATTEMPTS:
-        hub.configuration.delete(constants.NVS_KEY_REBOOT_COUNTER)
         print("Too many reboots ({} > {}), entering eternal deepsleep".format(reboot_counter, constants.MAX_REBOOT_ATTEMPTS))
         deepsleep()
     else:
-        hub.configuration.write_int(constants.NVS_KEY_REBOOT_COUNTER, reboot_counter)
-        hub.configuration.write_int(constants.NVS_KEY_LAST_REBOOT_TIMESTAMP, time())
         print("Rebooting")
         reboot()
@@ -0,0 +1,119 @@
+# BLOOM Hub
+# Uplink slot schedule
+# Author: Simon Aschenbrenner
+
+import constants
+import struct
+
+_VERSION = 1
+_FORMAT = "<BBBHH"  # Version, slot (NO_SLOT in beacons), number of slots, period in seconds, position in the period in seconds
+NO_SLOT = 0xff
+_HUB_IDS = constants.LORA_BROADCAST_ADDRESS >> 4  # Hub IDs 0 to 14, see hub._lora_setup()
+
+
+class SlotTable(object):
+    """
+    Time-slotted (TDMA) uplink schedule of the sensors paired to this hub.
+    The period of constants.LORA_SCHEDULE_PERIOD seconds is split into constants.LORA_SCHEDULE_SLOTS slots, aligned to the wall clock,
+    so the schedule survives a reboot. Each sensor gets the least occupied slot at pairing and transmits once per period within it.
+    The schedule is sent in the PAIRING_ACK and resent in periodic beacons, so the sensors can correct their clock drift.
+    If a sensor is heard in another slot than assigned (e.g. after a reboot of the hub), the table follows it.
+    """
+
+    def __init__(self, slots=constants.LORA_SCHEDULE_SLOTS, period=constants.LORA_SCHEDULE_PERIOD):
+        """
+        :param int slots: Number of slots per period, default is constants.LORA_SCHEDULE_SLOTS
+        :param int period: Length of the period in seconds, default is constants.LORA_SCHEDULE_PERIOD
+        """
+
+        self.slots = slots
+        self.period = period
+        self._slot_length = period // slots
+        self._occupancy = bytearray(slots)  # Number of sensors per slot
+        self._assignments = bytearray(b"\xff" * constants.LORA_MAX_PAIRED_SENSORS)  # Slot per sensor ID
+
+    def slot_at(self, timestamp):
+        """
+        :param int timestamp: Time in seconds
+        :return: The slot the timestamp lies in
+        :rtype: int
+        """
+
+        return (timestamp % self.period) // self._slot_length
+
+    def slot_of(self, sensor_id):
+        """
+        :return: The slot assigned to the sensor or NO_SLOT
+        :rtype: int
+        """
+
+        return self._assignments[sensor_id]
+
+    def assign(self, sensor_id, hub_id=0):
+        """
+        Assigns the least occupied slot to the sensor. The search starts at a slot derived from the Hub ID,
+        so the hubs on the channel don't all fill the same slots first (their slots are aligned to the wall clock).
+
+        :param int hub_id: The Hub ID of this hub (upper nibble of its LoRa address), default is 0
+        :return: The slot assigned
+        :rtype: int
+        """
+
+        self.release(sensor_id)
+        first = hub_id * self.slots // _HUB_IDS
+        best = None
+        for offset in range(self.slots):
+            slot = (first + offset) % self.slots
+            if best is None or self._occupancy[slot] < self._occupancy[best]:
+                best = slot
+        self._set(sensor_id, best)
+        return best
+
+    def observe(self, sensor_id, timestamp):
+        """
+        Updates the slot of the sensor to the slot it was heard in.
+
+        :param int timestamp: Time of reception in seconds
+        """
+
+        slot = self.slot_at(timestamp)
+        if self._assignments[sensor_id] != slot:
+            self.release(sensor_id)
+            self._set(sensor_id, slot)
+
+    def release(self, sensor_id):
+        slot = self._assignments[sensor_id]
+        if slot != NO_SLOT:
+            self._occupancy[slot] -= 1
+            self._assignments[sensor_id] = NO_SLOT
+
+    def message(self, timestamp, sensor_id=None, data_rate=None):
+        """
+        :param int timestamp: Current time in seconds
+        :param int sensor_id: The sensor the message is for or None for a beacon to all sensors, default is None
+        :param int data_rate: The data rate (RadioHead modem configuration index) the hub uses from now on, appended as an optional last byte, default is None
+        :return: The schedule message (preamble, space, schedule) for a PAIRING_ACK or a beacon
+        :rtype: bytes
+        """
+
+        slot = NO_SLOT if sensor_id is None else self._assignments[sensor_id]
+        message = constants.LORA_PREAMBLE + b" " + struct.pack(_FORMAT, _VERSION, slot, self.slots, self.period, timestamp % self.period)
+        if data_rate is not None:
+            message += bytes((data_rate,))
+        return message
+
+    def counters(self):
+        """
+        :return: Number of sensors scheduled, slots in use and the maximum number of sensors sharing a slot
+        :rtype: dict
+        """
+
+        return {
+            "scheduled": sum(self._occupancy),
+            "slots_used": sum(1 for count in self._occupancy if count),
+            "max_per_slot": max(self._occupancy)
+            }
+
+    def _set(self, sensor_id, slot):
+        self._assignments[sensor_id] = slot
+        self._occupancy[slot] += 1
@@ -5,86 +5,218 @@
 import backend
 import constants
 import hub
+import watering
 from time import localtime, time
 
 LOG = False
 
-def check():
-    # TODO write docstring
+_MEASUREMENT_VERSION = 1
+_MEASUREMENT_FORMAT = "<BHH"  # Preamble byte, moisture and battery (fixed point)
+_MEASUREMENT_LENGTH = 5
+_FIXED_POINT_SCALE = 10000
+
+_pending_pairings = set()  # IDs of sensors that acknowledged their pairing but are not yet added on the backend
+
+
+async def check_async():
+    """
+    Compares the paired sensors with the sensors activated on the backend, if the backend does not support backend.sync_async():
+    Unpairs the sensors that are not activated anymore and deactivates (deletes) the silent sensors on the backend before unpairing them.
+
+    :raises BackendError: if requesting the activated sensors fails
+    """
 
     print("Checking on sensors")
-    activated_sensor_ids = backend.get_sensor_ids()
-    sensor_ids_to_unpair = paired_sensor_ids() - activated_sensor_ids
-    sensor_ids_to_deactivate = (activated_sensor_ids & silent_sensor_ids()) - sensor_ids_to_unpair
+    activated_sensor_ids = await backend.get_sensor_ids_async()
+    sensor_ids_to_unpair, sensor_ids_to_deactivate = _compare(activated_sensor_ids)
     for sensor_id in sensor_ids_to_deactivate:
         try:
-            backend.delete_sensor(sensor_id)
+            await backend.delete_sensor_async(sensor_id)
         except Exception as e:
             print(e)
         else:  # Only unpair when successfully deactivated (deleted) in the backend
             sensor_ids_to_unpair.add(sensor_id)
+    with hub.configuration.transaction():
+        for sensor_id in sensor_ids_to_unpair:
+            unpair_sensor(sensor_id)
+
+
+def synced(activated_sensor_ids):
+    """
+    Applies the result of backend.sync_async(): Unpairs the paired sensors that are not activated on the backend anymore,
+    including the silent sensors sent to be deactivated (see silent_sensor_ids()).
+
+    :param set activated_sensor_ids: The IDs of the sensors activated on the backend
+    """
+
+    print("Checking on sensors")
+    sensor_ids_to_unpair, _ = _compare(activated_sensor_ids)
+    with hub.configuration.transaction():
+        for sensor_id in sensor_ids_to_unpair:
+            unpair_sensor(sensor_id)
+
+
+def _compare(activated_sensor_ids):
+    """
+    :param set activated_sensor_ids: The IDs of the sensors activated on the backend
+    :return: The IDs of the paired sensors that should be unpaired (as they are not activated anymore) and the IDs of the silent sensors that should be deactivated on the backend first
+    :rtype: (set, set)
+    """
+
+    sensor_ids_to_unpair = paired_sensor_ids() - activated_sensor_ids
+    sensor_ids_to_deactivate = (activated_sensor_ids & silent_sensor_ids()) - sensor_ids_to_unpair
     # print("Activated sensors:", activated_sensor_ids)
     # print("Silent sensors:", silent_sensor_ids())
     # print("Sensors to deactivate:", sensor_ids_to_deactivate)
     # print("Sensors to unpair:", sensor_ids_to_unpair)
-    for sensor_id in sensor_ids_to_unpair:
-        unpair_sensor(sensor_id)
+    return sensor_ids_to_unpair, sensor_ids_to_deactivate
 
 
-def collect():
-    # TODO write docstring
+async def collect_async():
+    """
+    Handles up to constants.LORA_COLLECT_BATCH_SIZE LoRa messages received since the last call. Does not make any requests to the backend, see upload_async() for that.
+    Replies to the sensors (e.g. link commands) are awaited, so the other tasks keep running while the radio sends.
+    """
 
     # print("Collecting sensor data")
-    for payload in hub.lora.received_data:
-        received_preamble = payload.message.split()[0]
-        if received_preamble != constants.LORA_PREAMBLE:
-            log(payload)
-            print("Wrong preamble, message will be ignored ('{}' != '{}')".format(received_preamble, constants.LORA_PREAMBLE))
+    await hub.lora.drain_async(handle_packet_async, constants.LORA_COLLECT_BATCH_SIZE)
+
+
+async def handle_packet_async(payload):
+    """
+    Handles a single LoRa message according to its flags.
+
+    :param radio.Packet payload: The LoRa message received, contains attributes 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
+    """
+
+    if _is_binary(payload) and (payload.header_flags & constants.LORA_BIT_MASK) == constants.LORA_FLAG_MEASUREMENT:
+        await handle_measurement_async(payload)
+    elif not payload.message_starts_with(constants.LORA_PREAMBLE):
+        log(payload)
+        print("Wrong preamble, message will be ignored ('{}' expected)".format(constants.LORA_PREAMBLE))
+    else:
+        if (payload.header_flags & constants.LORA_BIT_MASK) == constants.LORA_FLAG_MEASUREMENT:
+            await handle_measurement_async(payload)
+        elif (payload.header_flags & constants.LORA_BIT_MASK) == constants.LORA_FLAG_PAIRING_REQ:
+            await handle_pairing_async(payload)
+        elif (payload.header_flags & constants.LORA_BIT_MASK) == constants.LORA_FLAG_SCHEDULE_BEACON:
+            pass  # Beacon of another hub
         else:
-            if (payload.header_flags & constants.LORA_BIT_MASK) == constants.LORA_FLAG_MEASUREMENT:
-                handle_measurement(payload)
-            elif (payload.header_flags & constants.LORA_BIT_MASK) == constants.LORA_FLAG_PAIRING_REQ:
-                handle_pairing(payload)
-            else:
-                log(payload)
-                print("Wrong flags, message will be ignored")
-    hub.display_block = False
+            log(payload)
+            print("Wrong flags, message will be ignored")
+
 
+async def upload_async():
+    """
+    Backend counterpart of collect_async(), called by the upload task of the main loop:
+    Adds the sensors paired since the last call to the backend and flushes the journaled measurements in the order they were received.
+    Measurements are sent in batches of up to constants.UPLOAD_BATCH_SIZE, as soon as the oldest one has waited for constants.UPLOAD_BATCH_WINDOW seconds.
+    A measurement stays in the journal until the backend accepted it (or it gets dropped when the journal is full).
+
+    :return: True if sensors were added to the backend
+    :rtype: bool
+    :raises BackendError: if sending a measurement fails
+    """
 
-def handle_measurement(payload):
+    added = False
+    for sensor_id in list(_pending_pairings):
+        try:
+            await backend.add_sensor_async(sensor_id)
+        except Exception as e:
+            # Log the exception but otherwise treat sensor as if not paired (will receive shutdown order on next transmit)
+            print(e)
+        else:
+            hub.display_message(constants.MESSAGE_PAIRING_SUCCESS.format(sensor_id))
+            hub.hold_display()
+            _update_sensor_timestamp(sensor_id)
+            added = True
+        _pending_pairings.discard(sensor_id)
+
+    while len(hub.journal):
+        batch = hub.journal.peek(constants.UPLOAD_BATCH_SIZE)
+        if not batch:
+            break
+        if len(batch) < constants.UPLOAD_BATCH_SIZE and time() - batch[0][4] < constants.UPLOAD_BATCH_WINDOW:
+            break  # Wait for more measurements to send them at once
+        records = [record for record in batch if hub.registry.is_paired(record[1])]  # Sensors may have been unpaired in the meantime
+        if records and await backend.update_sensors_async([_measurement(record) for record in records]):
+            for record in records:
+                _update_sensor_timestamp(record[1], record[4])
+        else:  # Backend does not support batches
+            for record in records:
+                await backend.update_sensor_async(_measurement(record))
+                _update_sensor_timestamp(record[1], record[4])
+                hub.journal.acknowledge(record[0])
+        hub.journal.acknowledge(batch[-1][0])
+    return added
+
+
+def _measurement(record):
+    return { "sensor_id": record[1], "moisture": record[2], "battery": record[3] }
+
+
+async def handle_measurement_async(payload):
     """
-    Handles a received measurement and appends it to the data cache.
+    Handles a received measurement and appends it to the journal, which gets flushed to the backend by upload_async().
+    Measurements come as binary frames (preamble byte with version, moisture and battery as little endian uint16 in 1/10000)
+    or as text ("BLOOM <moisture>; <battery>;") from sensors with earlier firmware.
 
-    :param namedtuple payload: The LoRa message received, contains keys 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
+    :param radio.Packet payload: The LoRa message received, contains attributes 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
     """
 
     log(payload, message_type="Measurement")
     if (payload.header_from & ~constants.LORA_BIT_MASK) == (hub.lora.address & ~constants.LORA_BIT_MASK):  # sensor address matches hub address
         is_paired, sensor_id = is_paired_sensor(payload)
-        if is_paired:
-            message = payload.message.split()
+        if is_paired or sensor_id in _pending_pairings:
             try:
-                moisture = max(min(float(message[1][:-1].decode("utf-8")), 1.0), 0.0)
-                battery = max(min(float(message[2][:-1].decode("utf-8")), 1.0), 0.0)
-                backend.update_sensor({ "sensor_id": sensor_id, "moisture": moisture, "battery": battery })
+                moisture, battery = _parse_measurement(payload)
             except Exception as e:
                 # Log the exception but otherwise treat measurement as if not received
                 print(e)
             else:
-                _update_sensor_timestamp(sensor_id)
+                hub.journal.append(sensor_id, moisture, battery, time())
+                hub.schedule.observe(sensor_id, time())
+                hub.adr.observe(sensor_id, payload, time())
+                watering.control(sensor_id, moisture, time())
+                await send_link_command_async(sensor_id, payload.header_from)
         else:
             print("Sensor #{} not paired, sending shutdown order".format(sensor_id))
-            send_shutdown_order(payload.header_from)
+            await send_shutdown_order_async(payload.header_from)
     else:
         print("Sensor address {:08b} does not match hub address {:08b}, sending shutdown order".format(payload.header_from, hub.lora.address))
-        send_shutdown_order(payload.header_from)
+        await send_shutdown_order_async(payload.header_from)
 
 
-def handle_pairing(payload):
+def _is_binary(payload):
+    return payload.message_length > 0 and (payload.byte_at(0) & 0xf0) == constants.LORA_BINARY_PREAMBLE
+
+
+def _parse_measurement(payload):
+    """
+    :param radio.Packet payload: The measurement received, binary or text
+    :return: Moisture and battery between 0.0 and 1.0
+    :rtype: (float, float)
+    :raises ValueError or IndexError: if the measurement is malformed or of an unknown version
+    """
+
+    if _is_binary(payload):
+        if payload.message_length != _MEASUREMENT_LENGTH:
+            raise ValueError("Unsupported binary measurement")
+        preamble, moisture, battery = payload.unpack_from(_MEASUREMENT_FORMAT)  # Read in place, no copy of the message
+        if preamble != constants.LORA_BINARY_PREAMBLE | _MEASUREMENT_VERSION:
+            raise ValueError("Unsupported binary measurement")
+        return min(moisture, _FIXED_POINT_SCALE) / _FIXED_POINT_SCALE, min(battery, _FIXED_POINT_SCALE) / _FIXED_POINT_SCALE
+    message = bytes(payload.message).split()
+    moisture = max(min(float(message[1][:-1].decode("utf-8")), 1.0), 0.0)
+    battery = max(min(float(message[2][:-1].decode("utf-8")), 1.0), 0.0)
+    return moisture, battery
+
+
+async def handle_pairing_async(payload):
     """
     Handles a received pairing request by a sensor.
 
-    :param namedtuple payload: The LoRa message received, contains keys 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
+    :param radio.Packet payload: The LoRa message received, contains attributes 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
     """
 
     log(payload, message_type="Pairing Request")
@@ -93,17 +225,14 @@ def handle_pairing(payload):
             print("Trying to pair sensor with address {:08b} to this hub, as the RSSI was high enough ({} > {})".format(payload.header_from, payload.rssi, constants.LORA_RSSI_PAIRING_THRESHOLD))
             hub.display_message(constants.MESSAGE_PAIRING_IN_PROGRESS.format(payload.header_from & constants.LORA_BIT_MASK))
             is_paired, sensor_id = is_paired_sensor(payload)
-            if not is_paired:
-                if hub.lora.send_reliably(constants.LORA_PREAMBLE, payload.header_from, constants.LORA_FLAG_PAIRING_ACK):
-                    try:
-                        backend.add_sensor(sensor_id)
-                    except Exception as e:
-                        # Log the exception but otherwise treat sensor as if not paired (will receive shutdown order on next transmit)
-                        print(e)
-                    else:
-                        hub.display_message(constants.MESSAGE_PAIRING_SUCCESS.format(sensor_id))
-                        _update_sensor_timestamp(sensor_id)
+            if not is_paired and sensor_id not in _pending_pairings:
+                slot = hub.schedule.assign(sensor_id, hub.lora.address >> 4)
+                if await hub.lora.send_reliably_async(hub.schedule.message(time(), sensor_id, hub.adr.announced()), payload.header_from, constants.LORA_FLAG_PAIRING_ACK):
+                    _pending_pairings.add(sensor_id)  # Will be added on the backend by upload_async()
+                    hub.adr.forget(sensor_id)
+                    print("Sensor #{} transmits in slot {}".format(sensor_id, slot))
                 else:
+                    hub.schedule.release(sensor_id)
                     hub.display_message(constants.MESSAGE_PAIRING_FAIL.format(sensor_id))
                     print("Sensor #{} did not acknowledge the hubs PAIRING_ACK message".format(sensor_id))
             else:
@@ -113,27 +242,56 @@ def handle_pairing(payload):
             print("Sensor with address {:08b} won't be paired to this hub, because the RSSI was too low ({} <= {})".format(payload.header_from, payload.rssi, constants.LORA_RSSI_PAIRING_THRESHOLD))
     else:
         print("Sensor with address {:08b} won't be paired to this hub, because its PAIRING_REQ was invalid".format(payload.header_from))
-    hub.display_block = True
+    hub.hold_display()
 
 
-def send_shutdown_order(address):
+async def send_shutdown_order_async(address):
     """
     Send a message to instruct a sensor to turn itself off. 
 
     :param int address: The address of the sensor that should receive this order.
     """
 
-    if hub.lora.send_reliably(constants.LORA_PREAMBLE, address, constants.LORA_FLAG_SHUTDOWN_ORDER):
+    if await hub.lora.send_reliably_async(constants.LORA_PREAMBLE, address, constants.LORA_FLAG_SHUTDOWN_ORDER):
         print("Shutdown order acknowledged by sensor")
     else:
         print("Shutdown order not acknowledged by sensor")
 
 
+async def send_link_command_async(sensor_id, address):
+    """
+    Send the data rate and TX power chosen by the adaptive data rate to a sensor, if they changed.
+
+    :param int sensor_id: The ID of the sensor
+    :param int address: The address of the sensor
+    """
+
+    command = hub.adr.command(sensor_id)
+    if command is None:
+        return
+    if await hub.lora.send_reliably_async(command, address, constants.LORA_FLAG_LINK_COMMAND):
+        hub.adr.acknowledged(sensor_id, command)
+    else:
+        print("Link command not acknowledged by sensor #{}".format(sensor_id))
+
+
+async def send_beacon_async():
+    """
+    Broadcast the uplink schedule, so the paired sensors can correct their clock drift,
+    and the data rate, so they follow the hub when it switches right after (see adr.AdaptiveDataRate).
+    """
+
+    if not await hub.lora.send_reliably_async(hub.schedule.message(time(), data_rate=hub.adr.announced()), constants.LORA_BROADCAST_ADDRESS, constants.LORA_FLAG_SCHEDULE_BEACON):
+        print("Schedule beacon could not be sent")
+    async with hub.lora.send_lock:  # Not while another task sends
+        hub.adr.switch(time())
+
+
 def log(payload, message_type=None):
     """
     Log the received LoRa message to the console, including metadata.
     
-    :param namedtuple payload: The LoRa message received, contains keys 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
+    :param radio.Packet payload: The LoRa message received, contains attributes 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
     :param str message_type: Optional string to define the type of message received, default is None
     """
 
@@ -145,9 +303,9 @@ def log(payload, message_type=None):
     else:
         message_type = "(" + message_type + ") "
     try:
-        message = payload.message.decode("utf-8")
+        message = bytes(payload.message).decode("utf-8")
     except:
-        message = payload.message
+        message = bytes(payload.message)
     current_time = localtime()
     time_string = "{:4d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(current_time[0], current_time[1], current_time[2], current_time[3], current_time[4], current_time[5])
     string = '{}[{}] {:08b} -> {:08b} #{} [{:04b} {:04b}] (RSSI {}, SNR {}): "{}"'.format(
@@ -169,58 +327,46 @@ def is_paired_sensor(payload):
     """
     Checks if a sensor is already paired to this hub.
 
-    :param namedtuple payload: The LoRa message received, contains keys 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
+    :param radio.Packet payload: The LoRa message received, contains attributes 'message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi' and 'snr'
     :return: Tuple containing a boolean indicating whether a sensor with the same ID is already paired to the hub and the sensor ID
     :rtype: (bool, int)
     """
 
     sensor_id = payload.header_from & constants.LORA_BIT_MASK
-    is_paired = sensor_id in paired_sensor_ids()
+    is_paired = hub.registry.is_paired(sensor_id)
     return is_paired, sensor_id
 
 
 def paired_sensor_ids():
     # TODO write docstring
 
-    return set(_paired_sensors().keys())
+    return hub.registry.paired_ids()
 
 
 def silent_sensor_ids():
     # TODO write docstring
 
-    silent_sensor_ids = set()
-    current_time = time()
-    for sensor_id, timestamp in _paired_sensors().items():
-        if current_time - timestamp > constants.LORA_MAX_SILENT_TIME:
-            silent_sensor_ids.add(sensor_id)  
-    return silent_sensor_ids
+    return hub.registry.silent_ids(time())
 
 
 def unpair_all_sensors():
     # TODO write docstring
 
-    for sensor_id in paired_sensor_ids():
-        unpair_sensor(sensor_id)
+    with hub.configuration.transaction():
+        for sensor_id in paired_sensor_ids():
+            unpair_sensor(sensor_id)
 
 
 def unpair_sensor(sensor_id):
     # TODO write docstring
 
-    hub.configuration.delete(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id))
+    hub.registry.unpair(sensor_id)
+    hub.schedule.release(sensor_id)
+    hub.adr.forget(sensor_id)
     print("Unpaired sensor #{}".format(sensor_id))
 
 
-def _paired_sensors():
-    # TODO write docstring
-
-    paired_sensors = {}
-    for sensor_id in range(constants.LORA_MAX_PAIRED_SENSORS):
-        timestamp = hub.configuration.read_int(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id))
-        if timestamp is not None:
-            paired_sensors[sensor_id] = timestamp
-    return paired_sensors
-
-
-def _update_sensor_timestamp(sensor_id):
-    current_time = time()
-    hub.configuration.write_int(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id), current_time)
+def _update_sensor_timestamp(sensor_id, timestamp=None):
+    if timestamp is None:
+        timestamp = time()
+    hub.registry.update(sensor_id, timestamp)
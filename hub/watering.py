@@ -2,84 +2,249 @@
 # Watering routines
 # Author: Simon Aschenbrenner
 
-from time import ticks_diff, ticks_ms
+from time import time
 import backend
 import constants
 import hub
+import uasyncio as asyncio
 
 _bucket_was_empty = False
+_remote_zones = set()  # IDs of the zones pending on the backend, watered along with those of the irrigation controller
+_zone_states = {}  # Mirror of the is_watering status the backend acknowledged, by zone ID
+_zones_synced = False  # False while the outlets have not been pushed to the backend (after boot, a failed request or while the bucket was empty)
 
-def water(update=True):
+async def water_async(update=True):
     """
-    Outside facing watering routine: Checks if the bucket is full, requests the pending zones from the backend and calls water().
+    Outside facing watering routine for the backend task of the main loop, if the backend does not support backend.sync_async():
+    Checks if the bucket is full, requests the pending zones from the backend and waters them along with the zones of the irrigation controller.
+    Messages are posted to the display task instead of being shown directly.
 
     :raises BackendError: if any HTTP request fails
     """
 
-    global _bucket_was_empty
+    global _bucket_was_empty, _remote_zones
 
     if hub.bucket_is_empty():
         # print("Water Sensor: Bucket is empty, waiting {}s to debounce".format(constants.EMPTY_DELAY))
-        start = ticks_ms()
-        while ticks_diff(ticks_ms(), start) > constants.EMPTY_DELAY:
-            pass
-        hub.display_message(constants.MESSAGE_WATERING_TANK_EMPTY)
-        stop_water()
-        backend.update_hub(is_empty=True)
-        _bucket_was_empty = True
+        await asyncio.sleep(constants.EMPTY_DELAY)
+        if hub.bucket_is_empty():
+            hub.post_message(constants.MESSAGE_WATERING_TANK_EMPTY)
+            stop_water()
+            await backend.update_hub_async(is_empty=True)
+            _bucket_was_empty = True
 
     elif _bucket_was_empty:
         # print("Water Sensor: Bucket is full, waiting {}s to debounce".format(constants.EMPTY_DELAY))
-        start = ticks_ms()
-        while ticks_diff(ticks_ms(), start) > constants.EMPTY_DELAY:
-            pass
-        hub.display_message(constants.MESSAGE_WATERING_TANK_FULL)
-        backend.update_hub(is_empty=False)
-        _bucket_was_empty = False
+        await asyncio.sleep(constants.EMPTY_DELAY)
+        if not hub.bucket_is_empty():
+            hub.post_message(constants.MESSAGE_WATERING_TANK_FULL)
+            await backend.update_hub_async(is_empty=False)
+            _bucket_was_empty = False
 
     else:
-        pending_zones = backend.get_pending_zone_ids()
-        # print("Pending zone IDs:", pending_zones)
-        _water(pending_zones, update)
+        _remote_zones = await backend.get_pending_zone_ids_async()
+        # print("Pending zone IDs:", _remote_zones)
+        _set_outlets(_remote_zones | hub.controller.active_zones())
+        if not _zones_synced and update:
+            await _update_zones_async()
+        if update:
+            _post_watering_message()
+
+
+async def check_bucket_async():
+    """
+    Counterpart of the bucket handling of water_async() for backend.sync_async(): Debounces a change of the bucket since the backend last acknowledged it,
+    stops watering if the bucket ran empty and posts the message.
+
+    :return: Whether the bucket is empty if this changed (to be sent to the backend), None if not
+    :rtype: bool or None
+    """
+
+    if hub.bucket_is_empty() == _bucket_was_empty:
+        return None
+    # print("Water Sensor: Bucket changed, waiting {}s to debounce".format(constants.EMPTY_DELAY))
+    await asyncio.sleep(constants.EMPTY_DELAY)
+    is_empty = hub.bucket_is_empty()
+    if is_empty == _bucket_was_empty:
+        return None
+    if is_empty:
+        hub.post_message(constants.MESSAGE_WATERING_TANK_EMPTY)
+        stop_water()
+    else:
+        hub.post_message(constants.MESSAGE_WATERING_TANK_FULL)
+    return is_empty
+
+
+def zone_changes():
+    """
+    Counterpart of _update_zones_async() for backend.sync_async(), does not make any requests.
+
+    :return: The is_watering status of the zones that changed since the backend last acknowledged them (of all outlets if the zone IDs are not cached)
+    :rtype: dict
+    """
+
+    zone_ids = backend.cached_zone_ids()
+    return _zone_changes(zone_ids if zone_ids is not None else set(range(len(hub.outlets_mask))))
+
+
+def synced(is_empty, zone_states, pending_zone_ids):
+    """
+    Applies the result of backend.sync_async(): Remembers what the backend acknowledged and waters the pending zones (unless the bucket is empty).
+    The outlets switched here are pushed by the next synchronization.
+
+    :param is_empty: As returned by check_bucket_async() and sent to the backend
+    :param dict zone_states: As returned by zone_changes() and sent to the backend
+    :param set pending_zone_ids: The IDs of the zones pending on the backend
+    """
 
+    global _bucket_was_empty, _remote_zones
 
-def stop_water(update=False):
-    # TODO write docstring: Call water() without any pending zones, thus closing all outlets and stopping the pump
+    if is_empty is not None:
+        _bucket_was_empty = is_empty
+    _zone_states.update(zone_states)
+    _remote_zones = pending_zone_ids
+    # print("Pending zone IDs:", _remote_zones)
+    if hub.bucket_is_empty() or _bucket_was_empty:
+        return
+    _set_outlets(_remote_zones | hub.controller.active_zones())
+    _post_watering_message()
 
-    _water([], update)
 
+def is_active():
+    """
+    Tells the poll scheduler of the backend task whether to call the backend fast, does not make any requests.
+
+    :return: True if zones are pending on the backend or the outlets changed since the backend last acknowledged them, False if not or while the bucket is empty
+    :rtype: bool
+    """
 
-def _water(pending_zones, update):
+    if _bucket_was_empty:
+        return False  # Nothing gets watered until the bucket is refilled
+    return bool(_remote_zones) or bool(zone_changes())
+
+
+def check_bucket():
     """
-    Internal watering routine (Do not call this function directly, use water() instead): Starts the pump if zones are pending and opens the corresponding outlets.
-    # TODO rewrite docstring with params
+    Called periodically by the watering task of the main loop: Stops the pump right away if the bucket runs empty while watering,
+    instead of waiting for the next backend call. The backend gets informed by the next call of water_async().
     """
 
+    if any(hub.outlets_mask) and hub.bucket_is_empty():
+        # print("Bucket ran empty while watering, stopping")  # The message is posted once the empty bucket is debounced, see water_async()
+        stop_water()
+
+
+def control(zone_id, moisture, timestamp):
+    """
+    Called for every measurement received: Lets the irrigation controller decide on the zone and switches the outlets right away if it did (unless the bucket is empty).
+    The backend gets informed by the next call of water_async().
+
+    :param int zone_id: ID of the zone (and its sensor)
+    :param float moisture: Moisture between 0.0 and 1.0
+    :param int timestamp: Time of the measurement in seconds
+    """
+
+    if hub.controller.observe(zone_id, moisture, timestamp):
+        _apply_controller()
+
+
+def check_controller():
+    """
+    Called periodically by the watering task of the main loop: Stops the zones that reached their maximum run-time.
+    """
+
+    if hub.controller.update(time()):
+        _apply_controller()
+
+
+def stop_remote_water():
+    """
+    Called if the backend can not be reached: Closes the outlets of the zones pending on the backend, while the irrigation controller keeps watering its zones.
+    """
+
+    global _remote_zones
+
+    _remote_zones = set()
+    _apply_controller()
+
+
+async def sync_controller_async():
+    """
+    Fetches the irrigation policy if the backend advertised a new version and reports the decisions of the irrigation controller.
+
+    :raises BackendError: if any HTTP request fails
+    """
+
+    version = backend.policy_version()
+    if version is not None and version != hub.controller.version:
+        try:
+            hub.controller.set_policy(await backend.get_policy_async(), time())
+        except ValueError as e:
+            print(e)
+        _apply_controller()
+    decisions = list(hub.controller.decisions())
+    if decisions:
+        await backend.add_decisions_async(decisions)  # Dropped if the backend does not support them
+        hub.controller.acknowledge(decisions)
+
+
+def _apply_controller():
+    if hub.bucket_is_empty() or _bucket_was_empty:
+        return
+    if _set_outlets(_remote_zones | hub.controller.active_zones()):
+        _post_watering_message()
+
+
+def stop_water():
+    """
+    Closes all outlets and stops the pump. The backend gets informed by the next synchronization.
+    """
+
+    _set_outlets([])
+
+
+def _set_outlets(pending_zones):
+    """
+    Starts the pump if zones are pending, opens the corresponding outlets and closes all others.
+    Changes are pushed to the backend by the next synchronization (see zone_changes() and _update_zones_async()).
+
+    :param pending_zones: The IDs of the zones that should be watered
+    :return: True if the outlets changed
+    :rtype: bool
+    """
+
+    global _zones_synced
+
     new_outlets_mask = [False] * len(hub.outlets)
-    watered_zones = []
 
     if len(pending_zones) > 0:
         for index in pending_zones:
             if index > -1 and index < len(new_outlets_mask):
                 new_outlets_mask[index] = True
 
-    if hub.outlets_mask != new_outlets_mask:
-        hub.outlets_mask = new_outlets_mask
-        _run_pump(any(hub.outlets_mask))
-        for index, bool in enumerate(hub.outlets_mask):
-            if bool:
-                watered_zones.append(backend._transform_id_to_backend(index))
-                _open_outlet(index)
-            else:
-                _close_outlet(index)
-        if update:
-            _update_zones()
-
-    if update:
-        if len(watered_zones) > 0:
-            hub.display_message(constants.MESSAGE_WATERING_ZONES.format(str(watered_zones)[1:-1]))
+    if hub.outlets_mask == new_outlets_mask:
+        return False
+    hub.outlets_mask = new_outlets_mask
+    _zones_synced = False
+    _run_pump(any(hub.outlets_mask))
+    for index, bool in enumerate(hub.outlets_mask):
+        if bool:
+            _open_outlet(index)
         else:
-            hub.display_message(constants.MESSAGE_WATERING_NONE)
+            _close_outlet(index)
+    return True
+
+
+def _watered_zones():
+    return [backend._transform_id_to_backend(index) for index, bool in enumerate(hub.outlets_mask) if bool]
+
+
+def _post_watering_message():
+    watered_zones = _watered_zones()
+    if len(watered_zones) > 0:
+        hub.post_message(constants.MESSAGE_WATERING_ZONES.format(str(watered_zones)[1:-1]))
+    else:
+        hub.post_message(constants.MESSAGE_WATERING_NONE)
 
 
 def _open_outlet(index):
@@ -101,10 +266,44 @@ def _run_pump(bool):
         hub.pump.off()
 
 
-def _update_zones():
-    # TODO write docstring
+async def _update_zones_async():
+    """
+    Pushes the is_watering status of the zones that changed since the backend last acknowledged them,
+    in a single request if the backend supports it (otherwise one request per changed zone).
+    The zone IDs are cached by the backend module until the backend signals a change.
+
+    :raises BackendError: if any HTTP request fails (the zones are pushed again on the next call of water_async())
+    """
+
+    global _zones_synced
+
+    _zones_synced = False
+    changes = _zone_changes(await backend.get_zone_ids_async(cached=True))
+    if changes:
+        if await backend.update_zones_async(changes):
+            _zone_states.update(changes)
+        else:  # Concurrently over the connection pool, each zone is remembered as soon as the backend acknowledged it
+            await asyncio.gather(*[_update_zone_async(zone_id, is_watering) for zone_id, is_watering in changes.items()])
+    _zones_synced = True
+
+
+async def _update_zone_async(zone_id, is_watering):
+    await backend.update_zone_async(zone_id, is_watering)
+    _zone_states[zone_id] = is_watering
+
+
+def _zone_changes(zone_ids):
+    """
+    :param set zone_ids: The activated zone IDs of this hub
+    :return: The is_watering status of the zones that differ from the status last acknowledged by the backend (or were never acknowledged)
+    :rtype: dict
+    """
 
-    zone_ids = backend.get_zone_ids()
+    for zone_id in list(_zone_states):
+        if zone_id not in zone_ids:
+            del _zone_states[zone_id]  # Deactivated
+    changes = {}
     for zone_id in zone_ids:
-        is_watering = hub.outlets_mask[zone_id]
-        backend.update_zone(zone_id, is_watering)
\ No newline at end of file
+        if 0 <= zone_id < len(hub.outlets_mask) and _zone_states.get(zone_id) != hub.outlets_mask[zone_id]:
+            changes[zone_id] = hub.outlets_mask[zone_id]
+    return changes
@@ -42,11 +42,21 @@
 #define SENSOR_0_ADDRESS 240
 #define BROADCAST_ADDRESS 255
 #define PREAMBLE "BLOOM"
+#define BINARY_PREAMBLE 0xb0 // First byte of binary messages, the lower nibble holds the version
+#define MEASUREMENT_VERSION 1
+#define FIXED_POINT_SCALE 10000
 #define FLAG_MEASUREMENT 0b0000
 #define FLAG_PAIRING_REQ 0b0001
 #define FLAG_PAIRING_ACK 0b0010
 #define FLAG_ADDRESS_AVL 0b0100
 #define FLAG_SHUTDOWN_ORDER 0b1000
+#define FLAG_SCHEDULE_BEACON 0b0011
+#define FLAG_LINK_COMMAND 0b0101
+#define SCHEDULE_VERSION 1
+#define LINK_COMMAND_VERSION 1
+#define DATA_RATE_COUNT 5    // RH_RF95::ModemConfigChoice
+#define DEFAULT_DATA_RATE 0  // RH_RF95::Bw125Cr45Sf128
+#define NO_SLOT 255
 #define BIT_MASK 0b00001111
 
 // Times
@@ -54,6 +64,7 @@
 #define PAIRING_TIMEOUT 10000 // 10 seconds
 #define ANSWER_TIMEOUT 1000   //  1 second
 #define SLEEP_DELAY 2000      //  2 seconds TODO change
+const uint16_t ACK_TIMEOUTS[DATA_RATE_COUNT] = {200, 200, 1200, 1900, 900}; // Twice the time on air of an ACK per data rate (at least RadioHead's default)
 
 // Globals
 RH_RF95 driver(RF95_CS, RF95_INT);
@@ -62,6 +73,12 @@ uint8_t sensorAddress = SENSOR_0_ADDRESS;
 uint8_t hubAddress = BROADCAST_ADDRESS;
 uint8_t buf[RH_RF95_MAX_MESSAGE_LEN];
 uint8_t unacknowledgedMessageCounter = 0;
+uint8_t slot = NO_SLOT;         // Uplink slot assigned by the hub
+uint8_t slotCount = 0;          // Number of slots per period
+uint16_t period = 0;            // Transmit period in seconds
+unsigned long periodStart = 0;  // millis() at the start of the hub's current period
+uint8_t dataRate = DEFAULT_DATA_RATE;         // Modem configuration in use
+uint8_t pendingDataRate = DEFAULT_DATA_RATE;  // Modem configuration commanded by the hub, used once the hub announces the switch
 
 
 void setup() {
@@ -185,14 +202,17 @@ void setup() {
 
     long deadline = millis() + PAIRING_TIMEOUT;
     while(!isPaired && millis() < deadline) {
+        // The hub may use any data rate, so try them all in turn (starting with the default one)
+        setDataRate((DEFAULT_DATA_RATE + pairingRequestCounter) % DATA_RATE_COUNT);
         pairingRequestCounter++;
         #ifdef DEBUG
-        Serial.print("Pairing request #"); Serial.println(pairingRequestCounter, DEC);
+        Serial.print("Pairing request #"); Serial.print(pairingRequestCounter, DEC);
+        Serial.print(" (data rate "); Serial.print(dataRate, DEC); Serial.println(")");
         #endif
         manager.sendtoWait(data, sizeof(data)-1, BROADCAST_ADDRESS);  // Don't wait for ack on broadcast
         uint8_t len = sizeof(buf);
         uint8_t from, to, id, flags;
-        if (manager.recvfromAckTimeout(buf, &len, ANSWER_TIMEOUT, &from, &to, &id, &flags)) {
+        if (manager.recvfromAckTimeout(buf, &len, ANSWER_TIMEOUT + 2 * ACK_TIMEOUTS[dataRate], &from, &to, &id, &flags)) {
             // TODO full log
             // Serial.print("Received reply from node with address: "); Serial.println(from, BIN);
             if ((flags & BIT_MASK) == FLAG_PAIRING_ACK) { // TODO check preamble
@@ -211,6 +231,13 @@ void setup() {
                 Serial.println("Setting LoRa address");
                 #endif
                 manager.setThisAddress(sensorAddress);
+                if (readSchedule(buf, len)) {
+                    #ifdef DEBUG
+                    Serial.print("Assigned uplink slot: "); Serial.print(slot, DEC);
+                    Serial.print(" of "); Serial.print(slotCount, DEC);
+                    Serial.print(" per "); Serial.print(period, DEC); Serial.println(" seconds");
+                    #endif
+                }
                 #ifdef DEBUG
                 Serial.println("Sensor successfully paired to hub");
                 #endif
@@ -268,21 +295,22 @@ void loop() {
 
 
     // TRANSMIT AND RECEIVE
-    String message = String(PREAMBLE) + " " + transformedMoisture + " " + transformedBattery;
-    char data[16];
-    message.toCharArray(data, 16);
+    // Binary measurement: Preamble byte with version, moisture and battery as fixed point (little endian)
+    uint16_t moisture = transformedMoisture * FIXED_POINT_SCALE + 0.5;
+    uint16_t battery = transformedBattery * FIXED_POINT_SCALE + 0.5;
+    uint8_t data[] = { BINARY_PREAMBLE | MEASUREMENT_VERSION, (uint8_t) moisture, (uint8_t) (moisture >> 8), (uint8_t) battery, (uint8_t) (battery >> 8) };
     manager.setHeaderFlags(FLAG_MEASUREMENT, BIT_MASK);
     #ifdef DEBUG
-    Serial.print("Sending measurement data: "); Serial.print("'"); Serial.print(data); Serial.println("'");
+    Serial.print("Sending measurement data: "); Serial.print(moisture, DEC); Serial.print(" "); Serial.println(battery, DEC);
     #endif
-    if (manager.sendtoWait(data, sizeof(data)-1, hubAddress)) {
+    if (manager.sendtoWait(data, sizeof(data), hubAddress)) {
         #ifdef DEBUG
         Serial.println("Hub acknowledged message, listening for reply");
         #endif
         unacknowledgedMessageCounter = 0;
         uint8_t len = sizeof(buf);
         uint8_t from, to, id, flags;
-        if (manager.recvfromAckTimeout(buf, &len, ANSWER_TIMEOUT, &from, &to, &id, &flags)) {
+        if (manager.recvfromAckTimeout(buf, &len, ANSWER_TIMEOUT + 2 * ACK_TIMEOUTS[dataRate], &from, &to, &id, &flags)) {
             // TODO full log
             // Serial.print("Received reply from node with address: "); Serial.println(from, BIN);
             if ((flags & BIT_MASK) == FLAG_SHUTDOWN_ORDER) { // TODO check preamble and hubAddress
@@ -291,6 +319,11 @@ void loop() {
                 Serial.println("Entering eternal deepsleep");
                 #endif
                 while(true); // TODO eternal deepsleep
+            } else if ((flags & BIT_MASK) == FLAG_LINK_COMMAND && from == hubAddress && readLinkCommand(buf, len)) {
+                #ifdef DEBUG
+                Serial.print("Received LINK_COMMAND: data rate "); Serial.print(pendingDataRate, DEC);
+                Serial.println(" after the next beacon");
+                #endif
             } else {
                 #ifdef DEBUG
                 Serial.println("Invalid SHUTDOWN_ORDER, will be ignored");
@@ -306,6 +339,14 @@ void loop() {
         #ifdef DEBUG
         Serial.print("Sending data failed: Unacknowledged message #"); Serial.println(unacknowledgedMessageCounter, DEC);
         #endif
+        // The hub may have switched without us (missed beacon) or fallen back on the default data rate
+        if (pendingDataRate != dataRate) {
+            setDataRate(pendingDataRate);
+        } else if (dataRate != DEFAULT_DATA_RATE) {
+            setDataRate(DEFAULT_DATA_RATE);
+            pendingDataRate = DEFAULT_DATA_RATE;
+            driver.setTxPower(RF95_POW, false);
+        }
     }
 
 
@@ -319,5 +360,81 @@ void loop() {
     }
 
     // ENTER DEEPSLEEP
-    delay(SLEEP_DELAY); // TODO deepsleep
+    if (slot == NO_SLOT || period == 0 || slotCount == 0) {
+        delay(SLEEP_DELAY); // TODO deepsleep
+    } else {
+        waitForSlot();
+    }
+}
+
+
+// Reads the uplink schedule sent by the hub in its PAIRING_ACK or beacons:
+// Preamble, space, version, slot (NO_SLOT in beacons), number of slots, period and position in the period in seconds (both little endian)
+// and optionally the data rate the hub uses from now on
+bool readSchedule(uint8_t* message, uint8_t len) {
+    uint8_t offset = sizeof(PREAMBLE); // Preamble and space
+    if (len < offset + 7 || memcmp(message, PREAMBLE, sizeof(PREAMBLE) - 1) != 0 || message[offset] != SCHEDULE_VERSION) {
+        return false;
+    }
+    if (message[offset + 1] != NO_SLOT) {
+        slot = message[offset + 1];
+    }
+    slotCount = message[offset + 2];
+    period = message[offset + 3] | (message[offset + 4] << 8);
+    uint16_t position = message[offset + 5] | (message[offset + 6] << 8);
+    periodStart = millis() - (unsigned long) position * 1000;
+    if (len >= offset + 8 && message[offset + 7] < DATA_RATE_COUNT && message[offset + 7] != dataRate) {
+        pendingDataRate = message[offset + 7];
+        setDataRate(pendingDataRate);
+    }
+    return true;
+}
+
+
+// Reads a link command sent by the hub after a measurement: Preamble, space, version, data rate (RH_RF95::ModemConfigChoice) and TX power in dBm
+// The TX power applies right away, the data rate once the hub announces it in a beacon
+bool readLinkCommand(uint8_t* message, uint8_t len) {
+    uint8_t offset = sizeof(PREAMBLE); // Preamble and space
+    if (len < offset + 3 || memcmp(message, PREAMBLE, sizeof(PREAMBLE) - 1) != 0 || message[offset] != LINK_COMMAND_VERSION || message[offset + 1] >= DATA_RATE_COUNT) {
+        return false;
+    }
+    pendingDataRate = message[offset + 1];
+    driver.setTxPower(constrain(message[offset + 2], 5, RF95_POW), false);
+    return true;
+}
+
+
+void setDataRate(uint8_t config) {
+    if (config != dataRate) {
+        driver.setModemConfig((RH_RF95::ModemConfigChoice) config);
+        manager.setTimeout(ACK_TIMEOUTS[config]);
+        dataRate = config;
+    }
+}
+
+
+// Waits for the next occurrence of the assigned slot (at a random offset within its first half) and resynchronizes on the hub's beacons meanwhile
+void waitForSlot() {
+    unsigned long periodLength = (unsigned long) period * 1000;
+    unsigned long slotLength = periodLength / slotCount;
+    unsigned long slotOffset = slot * slotLength + random(slotLength / 2);
+    unsigned long elapsed = (millis() - periodStart) % periodLength;
+    unsigned long deadline = millis() + (slotOffset + periodLength - elapsed) % periodLength;
+    #ifdef DEBUG
+    Serial.print("Waiting for slot "); Serial.print(slot, DEC); Serial.print(" in "); Serial.print(deadline - millis(), DEC); Serial.println(" ms");
+    #endif
+    while ((long) (deadline - millis()) > 0) {
+        uint8_t len = sizeof(buf);
+        uint8_t from, to, id, flags;
+        uint16_t timeout = min(deadline - millis(), 60000UL);
+        if (manager.recvfromAckTimeout(buf, &len, timeout, &from, &to, &id, &flags)) {
+            if ((flags & BIT_MASK) == FLAG_SCHEDULE_BEACON && from == hubAddress && readSchedule(buf, len)) {
+                elapsed = (millis() - periodStart) % periodLength;
+                deadline = millis() + (slotOffset + periodLength - elapsed) % periodLength;
+                #ifdef DEBUG
+                Serial.println("Resynchronized on schedule beacon");
+                #endif
+            }
+        }
+    }
 }
@@ -0,0 +1,178 @@
+# BLOOM Hub
+# In-process mock of the backend behind fake non-blocking sockets, so http.py (and everything above it) runs unchanged on the host
+# Author: Simon Aschenbrenner
+
+import json
+import time
+
+
+class Request(object):
+
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path  # Without the leading '/'
+        self.headers = headers  # Lower case names
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+class MockBackend(object):
+    """
+    Routes map a method and a path prefix to a handler, which gets a Request and returns the status code, the data to send as JSON (or None)
+    and optionally a dictionary of additional headers. Unrouted requests are answered with 404.
+    A handler may return None to hold the request (long polling): it is called again whenever the hub reads from the connection, until it answers.
+
+    Every request is recorded in self.requests, the bytes sent and received and the socket writes are counted. Responses become readable rtt seconds after the request was complete,
+    a new connection takes another handshake seconds before its first response (e.g. 3 * rtt for TCP and a TLS 1.2 handshake).
+    stale(mode) lets the server close all kept alive connections, the next request on one of them fails:
+      'reset': the first write fails (nothing was sent)
+      'eof': the request is written, but the server closes the connection without reading it
+      'drop': the request is processed, but the connection closes before the response is sent
+    """
+
+    def __init__(self, rtt=0, handshake=0):
+        self.rtt = rtt
+        self.handshake = handshake
+        self.routes = []
+        self.requests = []
+        self.bytes_sent = 0      # By the hub
+        self.bytes_received = 0  # By the hub
+        self.writes = 0          # Socket writes by the hub (TLS records on a real connection)
+        self.connections = 0
+        self._sockets = []
+        self._saved = None
+
+    def route(self, method, path, handler):
+        self.routes.append((method, path, handler))
+
+    def stale(self, mode):
+        for sckt in self._sockets:
+            sckt.stale = mode
+
+    def install(self, http):
+        """
+        Connects the hub's http module to this backend (instead of resolving and wrapping real sockets) and closes its pooled connections.
+        """
+
+        import credentials
+        self._saved = (http.socket, credentials.address, credentials.wrap_socket, http._Connection.put)
+        backend = self
+
+        class _Socket(object):
+            def socket(self, *args):
+                return backend._connect()
+
+        put = http._Connection.put
+
+        def put_encoded(connection, data):  # The memoryview of the send buffer does not take str on CPython
+            put(connection, data.encode() if isinstance(data, str) else data)
+
+        http.socket = _Socket()
+        credentials.address = lambda: (2, 1, 0, "", ("127.0.0.1", 443))
+        credentials.wrap_socket = lambda sckt, do_handshake=True: sckt
+        http._Connection.put = put_encoded
+        http.close()
+        return self
+
+    def uninstall(self, http):
+        import credentials
+        http.close()
+        http.socket, credentials.address, credentials.wrap_socket, http._Connection.put = self._saved
+
+    def _connect(self):
+        self.connections += 1
+        sckt = _FakeSocket(self)
+        self._sockets.append(sckt)
+        return sckt
+
+    def _handle(self, request):
+        for method, path, handler in self.routes:
+            if method == request.method and request.path.startswith(path):
+                result = handler(request)
+                if result is None:
+                    return None
+                status, data = result[0], result[1]
+                headers = result[2] if len(result) > 2 else {}
+                break
+        else:
+            status, data, headers = 404, None, {}
+        body = b"" if data is None or status == 304 else json.dumps(data).encode()
+        head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n".format(status, "OK" if status < 300 else "Status", len(body))
+        for name, value in headers.items():
+            head += "{}: {}\r\n".format(name, value)
+        return (head + "\r\n").encode() + body
+
+
+class _FakeSocket(object):
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._in = b""
+        self._out = b""
+        self._ready = 0
+        self._established = time.monotonic() + backend.handshake
+        self._closed = False
+        self._held = None  # Request held by its handler
+        self.stale = None
+
+    def setblocking(self, flag):
+        pass
+
+    def connect(self, address):
+        pass
+
+    def close(self):
+        self._closed = True
+
+    def write(self, data):
+        if self.stale == "reset":
+            raise OSError(104)  # ECONNRESET
+        self._backend.bytes_sent += len(data)
+        self._backend.writes += 1
+        self._in += data
+        while True:
+            head, separator, rest = self._in.partition(b"\r\n\r\n")
+            if not separator:
+                return len(data)
+            lines = head.decode().split("\r\n")
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if len(rest) < length:
+                return len(data)
+            self._in = rest[length:]
+            if self.stale == "eof":
+                self._closed = True
+                continue
+            method, path, _ = lines[0].split(" ")
+            request = Request(method, path[1:], headers, rest[:length])
+            self._backend.requests.append(request)
+            self._respond(request)
+
+    def _respond(self, request):
+        response = self._backend._handle(request)
+        self._held = request if response is None else None
+        if response is None:
+            return
+        if self.stale == "drop":
+            self._closed = True
+            return
+        self._out += response
+        self._ready = max(time.monotonic(), self._established) + self._backend.rtt
+
+    def readinto(self, view):
+        if self._held is not None:
+            self._respond(self._held)
+        if not self._out:
+            return 0 if self._closed else None
+        if time.monotonic() < self._ready:
+            return None
+        count = min(len(view), len(self._out))
+        view[:count] = self._out[:count]
+        self._out = self._out[count:]
+        self._backend.bytes_received += count
+        return count
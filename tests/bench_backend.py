@@ -0,0 +1,206 @@
+# BLOOM Hub
+# Measures the backend calls of a polling cycle against the mock backend (see backend_mock.py):
+# the bytes received and the CPU time per cycle with conditional requests (ETag, see http.request_handler_async()) and without them, as before the response cache,
+# and the requests, bytes and time per cycle of the backend task with the combined endpoint (see backend.sync_async()) and with the single endpoints, as before
+# Usage: python tests/bench_backend.py [cycles, default is 200] [round-trip time in milliseconds, default is 80]
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
+
+import asyncio
+import contextlib
+import io
+import sys
+import tempfile
+import time
+import backend
+import constants
+import esp32
+import http
+import hub_mock
+from backend_mock import MockBackend
+
+CHANGE_INTERVAL = 20  # Cycles between two changes of the pending zones (e.g. the user tapped "water now")
+SENSORS = 15
+HUB = { "hub_id": constants.HUB_ID, "user": 1, "bucket_empty": False, "outlet_count": 3, "features": [constants.FEATURE_BULK_SENSOR_UPDATE, constants.FEATURE_BULK_ZONE_UPDATE],
+        "zones_version": 4, "policy_version": 2, "name": "Garden", "created_at": "2026-05-01T08:00:00Z" }
+
+
+class _Resources(object):
+    # The documents the cycle reads, each with a version that is sent as ETag if the backend supports conditional requests
+
+    def __init__(self):
+        self.pending_zones = []
+        self.versions = { "hub": 1, "zone": 1, "sensor": 1 }
+
+    def change(self, cycle):
+        self.pending_zones = [cycle // CHANGE_INTERVAL % 3 + 1] if cycle // CHANGE_INTERVAL % 2 else []
+        self.versions["zone"] += 1
+
+    def route(self, mock, conditional):
+        sensors = [{ "sensor_id": sensor_id, "zone_id": sensor_id, "moisture": 0.53, "battery": 0.87, "last_seen": "2026-10-17T06:00:00Z" } for sensor_id in range(1, SENSORS + 1)]
+        for endpoint, kind, data in ((constants.ENDPOINT_GET_HUB, "hub", lambda: HUB),
+                                     (constants.ENDPOINT_GET_ALL_PENDING_ZONES, "zone", lambda: self.pending_zones),
+                                     (constants.ENDPOINT_GET_ALL_SENSORS, "sensor", lambda: sensors)):
+            mock.route(endpoint[0], endpoint[1], self._handler(kind, data, conditional))
+
+    def _handler(self, kind, data, conditional):
+        def handle(request):
+            if not conditional:
+                return 200, data()
+            etag = '"{}"'.format(self.versions[kind])
+            if request.headers.get("if-none-match") == etag:
+                return 304, None
+            return 200, data(), { "ETag": etag }
+        return handle
+
+
+async def _cycle():
+    await backend.get_hub_async()
+    await backend.get_pending_zone_ids_async()
+    await backend.get_sensor_ids_async()
+
+
+def conditional(cycles):
+    print("{} cycles of GET hub, pending zones and {} sensors, the pending zones change every {} cycles".format(cycles, SENSORS, CHANGE_INTERVAL))
+    for name, supported in (("unconditional (before)", False), ("If-None-Match", True)):
+        http._cache.clear()
+        counters = http.counters()
+        resources = _Resources()
+        mock = MockBackend().install(http)
+        resources.route(mock, supported)
+
+        async def run():
+            for cycle in range(cycles):
+                if cycle and not cycle % CHANGE_INTERVAL:
+                    resources.change(cycle)
+                await _cycle()
+
+        start = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):  # backend.get_hub() prints the hub
+            asyncio.run(run())
+        elapsed = time.process_time() - start
+        mock.uninstall(http)
+        hits = http.counters()["hits"] - counters["hits"]
+        misses = http.counters()["misses"] - counters["misses"]
+        print("  {:<24} {:>6.0f} bytes received {:>5.2f} ms CPU per cycle, {:>4} hits {:>3} misses ({:.0%} hit rate)".format(
+            name, mock.bytes_received / cycles, elapsed * 1000 / cycles, hits, misses, hits / max(1, hits + misses)))
+
+
+class _Server(object):
+    # State of the hub on the backend, served by the combined endpoint (if supported) and the single endpoints
+
+    def __init__(self, mock, sync):
+        self.pending_zones = []
+        self.zones = { 1: False, 2: False, 3: False }
+        self.sensors = [1, 2]
+        routes = [("GET", "hub/getHub", lambda request: (200, self._hub())),
+                  ("PUT", "hub/updateHub", lambda request: (200, self._hub())),
+                  ("GET", "zone/getAllPendingZones", lambda request: (200, self.pending_zones)),
+                  ("GET", "zone/getAllZonesByHubId", lambda request: (200, self._zones())),
+                  ("PUT", "zone/updateZones", self._update_zones),
+                  ("GET", "sensor/getAllSensorsByHubId", lambda request: (200, self._sensors())),
+                  ("DELETE", "sensor/", self._delete_sensor)]
+        if sync:
+            routes.append(("POST", "hub/sync", self._sync))
+        for method, path, handler in routes:
+            mock.route(method, path, handler)
+
+    def _hub(self):
+        return dict(HUB, zones_version=1, policy_version=None)
+
+    def _zones(self):
+        return [{ "zone_id": zone_id } for zone_id in self.zones]
+
+    def _sensors(self):
+        return [{ "zone_id": sensor_id } for sensor_id in self.sensors]
+
+    def _update_zones(self, request):
+        for zone_id, is_watering in request.json()["zones"]:
+            self.zones[zone_id] = is_watering
+        return 200, None
+
+    def _delete_sensor(self, request):
+        self.sensors.remove(int(request.path.split("zone_id=")[1].split("&")[0]))
+        return 200, None
+
+    def _sync(self, request):
+        state = request.json()
+        for zone_id, is_watering in state.get("zones", []):
+            self.zones[zone_id] = is_watering
+        for sensor_id in state.get("deleted_sensors", []):
+            self.sensors.remove(sensor_id)
+        return 200, { "hub": self._hub(), "pending_zones": self.pending_zones, "zones": self._zones(), "sensors": self._sensors() }
+
+
+def _install_hub():
+    from adr import AdaptiveDataRate
+    from nvs import NVS
+    from registry import SensorRegistry
+    from schedule import SlotTable
+
+    esp32.reset()
+    hub = hub_mock.install(tempfile.mkdtemp())
+    hub.configuration = NVS()
+    hub.registry = SensorRegistry(hub.configuration)
+    hub.schedule = SlotTable()
+    hub.adr = AdaptiveDataRate(None, hub.registry)
+    for sensor_id in (0, 1):
+        hub.registry.update(sensor_id, int(time.time()))
+
+    async def has_user_async():
+        return hub.has_user_in(await backend.get_hub_async())
+
+    hub.has_user_async = has_user_async
+    return hub
+
+
+# Idle, the user taps "water now" for zone 2, it stays pending, watering is done, sensor 1 falls silent, idle
+SCRIPT = (([], False), ([], False), ([1], False), ([1], False), ([], False), ([], True), ([], False), ([], False))
+
+
+def combined(rtt):
+    print("Backend task cycles with {} ms round-trip time: {}".format(int(rtt * 1000), "idle, water zone 2 for 2 cycles, idle, a sensor falls silent, idle"))
+    for name, sync in (("single endpoints (before)", False), ("hub/sync", True)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            hub = _install_hub()
+        import main
+        import sensors
+        import watering
+        mock = MockBackend(rtt).install(http)
+        server = _Server(mock, sync)
+        backend._sync_supported = True
+        backend._bulk_zone_update = backend._bulk_sensor_update = None
+        http._cache.clear()
+
+        async def run():
+            cycles = []
+            await backend.get_hub_async()  # Advertises the features
+            if not sync:
+                await backend.sync_async()  # The combined endpoint is probed once (404)
+            for pending_zones, silent in SCRIPT:
+                server.pending_zones = pending_zones
+                if silent:
+                    hub.registry.update(0, int(time.time()) - 2 * constants.LORA_MAX_SILENT_TIME)
+                requests, sent, received, start = len(mock.requests), mock.bytes_sent, mock.bytes_received, time.monotonic()
+                if await main._sync_async() is None:  # As in main._backend_task()
+                    if await hub.has_user_async():
+                        await watering.water_async()
+                        await sensors.check_async()
+                cycles.append((len(mock.requests) - requests, mock.bytes_sent - sent, mock.bytes_received - received, time.monotonic() - start))
+            return cycles
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            cycles = asyncio.run(run())
+        mock.uninstall(http)
+        count = len(cycles)
+        print("  {:<26} {:>5.2f} requests {:>5.0f} bytes sent {:>5.0f} bytes received {:>5.0f} ms per cycle, zones {} sensors {}".format(
+            name, sum(cycle[0] for cycle in cycles) / count, sum(cycle[1] for cycle in cycles) / count, sum(cycle[2] for cycle in cycles) / count,
+            sum(cycle[3] for cycle in cycles) * 1000 / count, server.zones, server.sensors))
+
+
+if __name__ == "__main__":
+    conditional(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
+    combined(int(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.08)
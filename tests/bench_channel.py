@@ -0,0 +1,126 @@
+# BLOOM Hub
+# Simulates the hub sending reliably on a channel shared with the sensors of other hubs, on the fake SX1276 (see fakes/machine.py) with a simulated clock (see simulation.py)
+# Compares sending blindly (cad_retries 0, as before) with listen before talk, and shows the duty cycle accounting on a burst of frames
+# Usage: python tests/bench_channel.py [frames sent by the hub per configuration, default is 200]
+# Author: Simon Aschenbrenner
+
+import simulation
+
+import random
+import sys
+import constants
+import machine
+from machine import chip
+from radio import LoRa, HEADER_LENGTH
+
+HUB_ADDRESS = 0x10
+SENSOR_ADDRESS = 0x11
+MESSAGE = b"\x80\x01\x02"  # A link command
+SEND_INTERVAL = 1000  # ms between the frames of the hub
+TURNAROUND = 10  # ms from the end of a frame to the start of its acknowledgement
+
+
+class Channel(object):
+    """
+    ALOHA traffic of the other nodes (sensors send without listening before): frames of frame_time ms start at exponentially distributed intervals.
+    The CAD detects a frame on air. A frame of the hub, or its acknowledgement, that overlaps one of them is lost, and so is the frame of the other node.
+    """
+
+    def __init__(self, frames_per_second, frame_time, ack_time):
+        self.frame_time = frame_time
+        self.ack_time = ack_time
+        self.lost = 0  # Frames of the other nodes the hub collided with
+        self._rate = frames_per_second / 1000  # Per ms
+        self._frames = []  # (start, end) in ms of the frames of the other nodes, generated ahead of time
+        self._next = simulation.ticks_ms()
+        self._generate()
+        chip.channel_active = self.active
+        chip.auto_acknowledge = self.delivered
+
+    def _generate(self):
+        # Up to the end of an acknowledgement to a frame of the hub that ends now
+
+        while self._rate and self._next <= simulation.ticks_ms() + chip.ack_delay:
+            self._next += int(random.expovariate(self._rate)) + 1
+            self._frames.append((self._next, self._next + self.frame_time))
+
+    def tick(self):
+        self._generate()
+        while self._frames and self._frames[0][1] < simulation.ticks_ms() - 2 * chip.tx_delay:
+            self._frames.pop(0)
+
+    def active(self):
+        now = simulation.ticks_ms()
+        return any(start <= now < end for start, end in self._frames)
+
+    def _collisions(self, start, end):
+        return sum(1 for frame_start, frame_end in self._frames if frame_start < end and start < frame_end)
+
+    def delivered(self, packet):
+        # The hub's frame ends now (TxDone): the sensor acknowledges it unless it collided, the acknowledgement gets through unless it collides
+
+        now = simulation.ticks_ms()
+        collisions = self._collisions(now - chip.tx_delay, now)
+        self.lost += collisions
+        return not collisions and not self._collisions(now + chip.ack_delay - self.ack_time, now + chip.ack_delay)
+
+
+def run(frames, frames_per_second, cad_retries, interval=SEND_INTERVAL):
+    """
+    :return: Counters of the hub's radio, frames acknowledged, frames of the other nodes lost by the hub's frames, mean ms per frame acknowledged, simulated ms
+    :rtype: (dict, int, int, float, int)
+    """
+
+    chip.reset()
+    machine._timers.clear()
+    lora = LoRa(address=HUB_ADDRESS)
+    lora.receive_continuously()
+    lora.cad_retries = cad_retries
+    chip.tx_delay = lora.airtime_of(HEADER_LENGTH + len(MESSAGE)) // 1000
+    ack_time = lora.airtime_of(HEADER_LENGTH + 1) // 1000
+    chip.ack_delay = TURNAROUND + ack_time
+    chip.cad_delay = 2 * lora.airtime_of(0) // 1000 // 8  # About 2 symbols (of 8 preamble symbols)
+    channel = Channel(frames_per_second, lora.airtime_of(HEADER_LENGTH + 5) // 1000, ack_time)
+    simulation.hooks.append(channel.tick)
+    acknowledged = latency = 0
+    start = simulation.ticks_ms()
+    for _ in range(frames):
+        sent = simulation.ticks_ms()
+        if lora.send_reliably(MESSAGE, SENSOR_ADDRESS):
+            acknowledged += 1
+            latency += simulation.ticks_ms() - sent
+        simulation.sleep_ms(max(0, interval - (simulation.ticks_ms() - sent)))
+    simulation.hooks.remove(channel.tick)
+    return lora.counters(), acknowledged, channel.lost, latency / max(1, acknowledged), simulation.ticks_ms() - start
+
+
+def contention(frames):
+    print("{} frames sent reliably by the hub, one per {} s, the other nodes send {} ms frames without listening before".format(
+        frames, SEND_INTERVAL // 1000, LoRa().airtime_of(HEADER_LENGTH + 5) // 1000))
+    print("{:>13} | {:^43} | {:^43}".format("other nodes", "sending blindly", "listen before talk ({} CADs)".format(constants.LORA_CAD_RETRIES)))
+    header = "{:>6} {:>7} {:>9} {:>8} {:>5} {:>6}".format("acked", "on air", "busy", "failed", "lost", "ms")
+    print("{:>13} | {} | {}".format("frames/s", header, header))
+    for frames_per_second in (0.5, 2, 5, 10):
+        row = "{:>13} |".format(frames_per_second)
+        for cad_retries in (0, constants.LORA_CAD_RETRIES):
+            random.seed(int(frames_per_second * 10))  # The same traffic for both
+            counters, acknowledged, lost, latency, _ = run(frames, frames_per_second, cad_retries)
+            row += " {:>5.0%} {:>7} {:>9} {:>8} {:>5} {:>6.0f} |".format(
+                acknowledged / frames, len(chip.sent), counters["channel_busy"],
+                counters["channel_access_failures"], lost, latency)
+        print(row)
+    print("  acked: frames acknowledged, on air: frames sent including retries, busy: CADs that detected activity,")
+    print("  failed: sends given up after the CADs, lost: frames of the other nodes destroyed by the hub's, ms: mean time to the acknowledgement")
+
+
+def duty_cycle(frames):
+    counters, acknowledged, _, _, elapsed = run(frames, 0, constants.LORA_CAD_RETRIES, interval=0)
+    print("Burst of {} frames on a free channel within {:.0f} s".format(frames, elapsed / 1000))
+    print("  {} acknowledged, {} sends (retries included) blocked by the duty cycle, {:.1f} s on air (budget {:.0f} s per {:.0f} min, refilled at {:.0%})".format(
+        acknowledged, counters["duty_cycle_blocked"], counters["airtime"] / 1000000,
+        constants.LORA_DUTY_CYCLE_WINDOW / constants.LORA_DUTY_CYCLE / 1000, constants.LORA_DUTY_CYCLE_WINDOW / 60000, 1 / constants.LORA_DUTY_CYCLE))
+
+
+if __name__ == "__main__":
+    contention(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
+    duty_cycle(1500)
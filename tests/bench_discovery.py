@@ -0,0 +1,117 @@
+# BLOOM Hub
+# Simulates the Hub ID discovery of a fresh hub (hub._lora_setup()) on a channel with N hubs in use, on the fake SX1276 (see fakes/machine.py) with a simulated clock
+# Compares probing every Hub ID in turn with the default retries and timeout (as before) with hub._discover_address(), which probes with short waits and overhears the channel
+# Usage: python tests/bench_discovery.py [trials per configuration, default is 100] [shares of lost acknowledgements, default is 0.1,0.6]
+# Author: Simon Aschenbrenner
+
+import simulation
+
+import contextlib
+import io
+import random
+import sys
+import constants
+import esp32
+import machine
+import radio
+import hub
+from machine import chip
+from nvs import NVS
+from radio import LoRa
+
+HUB_IDS = 15  # Addresses 0x0f to 0xef, 0xff is the broadcast address
+SENSORS_PER_HUB = 5
+TX_DELAY = 60  # ms on air per packet
+ACK_DELAY = 40  # ms from the end of a probe to the end of its acknowledgement (31 ms on air)
+
+
+class Channel(object):
+    """
+    Traffic of the hubs in use: each of their sensors sends a packet to its hub now and then (exponentially distributed), which the hub acknowledges.
+    A hub in use acknowledges the probes to its address, unless the acknowledgement gets lost (with ack_loss).
+    """
+
+    def __init__(self, occupied, packets_per_minute, ack_loss):
+        self.occupied = occupied
+        self.ack_loss = ack_loss
+        self._rate = packets_per_minute / 60000  # Per ms and hub
+        self._next = { hub_id: simulation.ticks_ms() + self._delay() for hub_id in occupied }
+        chip.auto_acknowledge = lambda packet: packet[0] >> 4 in occupied and random.random() >= ack_loss
+
+    def _delay(self):
+        return int(random.expovariate(self._rate)) + 1 if self._rate else 1 << 62
+
+    def tick(self):
+        for hub_id, due in self._next.items():
+            if due <= simulation.ticks_ms():
+                address = (hub_id << 4) | 0x0f
+                sensor = (hub_id << 4) | random.randrange(SENSORS_PER_HUB)
+                header_id = random.getrandbits(8)
+                chip.receive(bytes((address, sensor, header_id, constants.LORA_FLAG_MEASUREMENT)) + b"\xb1\x88\x13\x28\x23")
+                chip.receive(bytes((sensor, address, header_id, radio.FLAGS_ACK)) + b"!")
+                self._next[hub_id] = simulation.ticks_ms() + self._delay()
+
+
+def _probe_in_turn():
+    # hub._lora_setup() before the discovery, without a persisted Hub ID
+
+    address = 0b1111
+    while address < constants.LORA_BROADCAST_ADDRESS:
+        if not hub.lora.send_reliably(constants.LORA_PREAMBLE, address, constants.LORA_FLAG_ADDRESS_AVL):
+            hub.lora.address = address
+            return
+        address += 0b10000
+    raise hub.LoRaAddressUnavailableError("No Hub ID/address is available on the channel")
+
+
+def discover(occupied, packets_per_minute, ack_loss, setup):
+    """
+    :return: Simulated time in seconds, number of probes and the Hub ID chosen (None if none was available)
+    :rtype: (float, int, int)
+    """
+
+    esp32.reset()
+    chip.reset()
+    chip.tx_delay, chip.ack_delay, chip.cad_delay = TX_DELAY, ACK_DELAY, 5
+    machine._timers.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        hub.configuration = NVS()
+    hub.lora = LoRa()
+    channel = Channel(occupied, packets_per_minute, ack_loss)
+    simulation.hooks.append(channel.tick)
+    start = simulation.ticks_ms()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            setup()
+        hub_id = hub.lora.address >> 4
+    except hub.LoRaAddressUnavailableError:
+        hub_id = None
+    simulation.hooks.remove(channel.tick)
+    probes = sum(1 for packet in chip.sent if packet[3] == constants.LORA_FLAG_ADDRESS_AVL)
+    return (simulation.ticks_ms() - start) / 1000, probes, hub_id
+
+
+def compare(trials, ack_loss):
+    print("{} trials each, {} sensors per hub, {:.0f} % of the acknowledgements lost, times simulated".format(trials, SENSORS_PER_HUB, ack_loss * 100))
+    print("{:>6} {:>11} | {:^28} | {:^28}".format("hubs", "packets/min", "probing in turn (before)", "probing and overhearing"))
+    print("{:>6} {:>11} | {:>8} {:>7} {:>11} | {:>8} {:>7} {:>11}".format("in use", "per hub", "time", "probes", "conflicts", "time", "probes", "conflicts"))
+    for count in (2, 7, 12):
+        for packets_per_minute in (0.1, 1, 10):
+            row = "{:>6} {:>11} |".format(count, packets_per_minute)
+            for setup in (_probe_in_turn, hub._lora_setup):
+                random.seed(count * 1000 + int(packets_per_minute * 10))  # The same channels for both
+                elapsed = probes = conflicts = 0
+                for _ in range(trials):
+                    occupied = set(random.sample(range(HUB_IDS), count))
+                    result = discover(occupied, packets_per_minute, ack_loss, setup)
+                    elapsed += result[0]
+                    probes += result[1]
+                    conflicts += result[2] in occupied
+                row += " {:>6.1f} s {:>7.1f} {:>5} of {:<2} |".format(elapsed / trials, probes / trials, conflicts, trials)
+            print(row)
+
+
+if __name__ == "__main__":
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    for ack_loss in (sys.argv[2] if len(sys.argv) > 2 else "0.1,0.6").split(","):
+        compare(trials, float(ack_loss))
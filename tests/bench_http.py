@@ -0,0 +1,161 @@
+# BLOOM Hub
+# Measures the requests per second of the HTTP client against the mock backend (see backend_mock.py), with and without reusing the connection,
+# and the socket writes and peak heap of serializing a request and parsing its response, compared to the line by line implementation before
+# Usage: python tests/bench_http.py [round-trip time in milliseconds, default is 80]
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
+
+import asyncio
+import io
+import sys
+import time
+import tracemalloc
+import http
+from backend_mock import MockBackend
+
+REQUESTS = 20
+TOKEN = "0123456789abcdef" * 4
+HEADERS = { "Authorization": "Bearer " + TOKEN }
+BODY = { "hub_id": 1, "sensors": [[zone_id, 0.53, 0.87] for zone_id in range(5)] }
+RESPONSE = (b"HTTP/1.1 200 OK\r\nServer: nginx\r\nDate: Sat, 17 Oct 2026 00:00:00 GMT\r\nContent-Type: application/json\r\n"
+            b"Content-Length: 31\r\nConnection: keep-alive\r\nAuthorization: Bearer " + TOKEN.encode() + b"\r\n\r\n" + b'{"hub_id": 1, "bucket": false}\n')
+
+
+async def requests(backend, keep_alive):
+    for _ in range(REQUESTS):
+        if not keep_alive:
+            http.close()  # A new connection (TCP and TLS handshake) per request, as before the connection pool
+        await http.request_handler_async(("GET", "hub/getHub"))
+
+
+def keep_alive(rtt):
+    print("GET hub/getHub, {} ms round-trip time, handshake of 3 round-trips".format(int(rtt * 1000)))
+    for name, reuse in (("new connection per request", False), ("kept alive connection", True)):
+        backend = MockBackend(rtt, handshake=3 * rtt).install(http)
+        backend.route("GET", "hub/getHub", lambda request: (200, { "hub_id": 1, "user": 1 }))
+        start = time.monotonic()
+        asyncio.run(requests(backend, reuse))
+        elapsed = time.monotonic() - start
+        backend.uninstall(http)
+        print("  {:<30} {:>5.1f} requests/s, {:>2} connection(s) opened".format(name, REQUESTS / elapsed, backend.connections))
+
+
+class _Stream(object):
+    # Stream of a connection that answers every request with RESPONSE at once and counts the writes
+
+    def __init__(self):
+        self.writes = 0
+        self._response = memoryview(RESPONSE)
+        self._position = len(RESPONSE)
+
+    def write(self, data):
+        self.writes += 1
+        self._position = 0
+
+    async def drain(self):
+        pass
+
+    async def readinto(self, view):
+        count = min(len(view), len(RESPONSE) - self._position)
+        view[:count] = self._response[self._position:self._position + count]
+        self._position += count
+        return count
+
+
+def _run(coroutine):
+    # Runs a coroutine that never suspends (see _Stream) without an event loop, so only the allocations of the client are traced
+
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("Coroutine suspended")
+
+
+def _current(stream, connection):
+    http._send(connection, "POST", "sensor/updateSensors", BODY, HEADERS)
+    _run(connection.flush())
+    return _run(http._receive(connection)).token()
+
+
+class _Socket(object):
+    # Socket of the implementation before the connection pool, counts the writes and reads the response line by line
+
+    def __init__(self):
+        self.writes = 0
+        self._response = io.BytesIO(RESPONSE)
+
+    def write(self, data):
+        self.writes += 1
+
+    def readline(self):
+        return self._response.readline()
+
+
+def _legacy(sckt):
+    # Request and response handling of http.request() before the connection pool (HTTP/1.0, one request per connection)
+
+    method, path, headers, json = b"POST", b"sensor/updateSensors", HEADERS, BODY
+    sckt.write(b"%s /%s HTTP/1.0\r\n" % (method, path))
+    sckt.write(b"Host: %s\r\n" % http.constants.BACKEND_HOST.encode())
+    for k in headers:
+        sckt.write(k.encode())
+        sckt.write(b": ")
+        sckt.write(headers[k].encode())
+        sckt.write(b"\r\n")
+    body = http.ujson.dumps(json).encode()
+    sckt.write(b"Content-Type: application/json\r\n")
+    sckt.write(b"Content-Length: %d\r\n" % len(body))
+    sckt.write(b"\r\n")
+    sckt.write(body)
+    line = sckt.readline()
+    status = line.split(None, 2)
+    status_code = int(status[1])
+    reason = status[2].rstrip() if len(status) > 2 else ""
+    session_token = ""
+    while True:
+        line = sckt.readline()
+        if not line or line == b"\r\n":
+            break
+        header = line.split(None, 2)
+        if len(header) == 3 and header[0] == b"Authorization:":
+            session_token = header[2].rstrip()
+    return session_token, sckt._response.read()
+
+
+def _peak(function, *args):
+    # Peak of the CPython heap, which includes the frames of the coroutines of the current implementation (not comparable to MicroPython's)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+
+def serialization():
+    print("POST sensor/updateSensors (JSON body, bearer token), response with 6 headers")
+    sckt = _Socket()
+    _legacy(sckt)
+    print("  {:<30} {:>3} writes, {:>6} bytes peak heap".format("line by line (before)", sckt.writes, _peak(_legacy, _Socket())))
+    backend = MockBackend().install(http)  # Only for the conversion of str to bytes in _Connection.put() on CPython
+    connection = http._Connection()
+    connection.open()  # Allocates the buffers
+    stream = connection.stream = _Stream()
+    _current(stream, connection)  # Warm up
+    writes = stream.writes
+    _current(stream, connection)
+    print("  {:<30} {:>3} writes, {:>6} bytes peak heap".format("reusable buffers", stream.writes - writes, _peak(_current, stream, connection)))
+    print("  buffers of {} bytes per connection once used, before the lazy allocation {} bytes for each of the {} connections of the pool at import".format(
+        len(connection.send_buffer) + len(connection.receive_buffer), 2 * 1024, http.constants.HTTP_POOL_SIZE))
+    backend.uninstall(http)
+
+
+if __name__ == "__main__":
+    keep_alive(int(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.08)
+    serialization()
@@ -0,0 +1,73 @@
+# BLOOM Hub
+# Measures the parse time and heap per received measurement and its airtime, for the text format parsed as before, the text format today
+# and the binary format (see sensors._parse_measurement())
+# Usage: python tests/bench_measurement.py
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
+
+import contextlib
+import io
+import struct
+import tempfile
+import time
+import tracemalloc
+import constants
+import hub_mock
+from radio import LoRa, Packet, HEADER_LENGTH
+
+with contextlib.redirect_stdout(io.StringIO()):  # No irrigation policy
+    hub_mock.install(tempfile.gettempdir())
+
+import sensors
+
+TEXT = b"BLOOM 0.53; 0.87;"
+BINARY = struct.pack("<BHH", constants.LORA_BINARY_PREAMBLE | 1, 5300, 8700)
+REPEAT = 100000
+RUNS = 5  # The fastest run counts
+
+
+def _packet(message):
+    packet = Packet()
+    packet.buffer[HEADER_LENGTH:HEADER_LENGTH + len(message)] = message
+    packet.length = HEADER_LENGTH + len(message)
+    return packet
+
+
+def _legacy(message):
+    # sensors.handle_measurement() before the binary format, on the message of the Payload namedtuple (bytes)
+
+    message = message.split()
+    moisture = max(min(float(message[1][:-1].decode("utf-8")), 1.0), 0.0)
+    battery = max(min(float(message[2][:-1].decode("utf-8")), 1.0), 0.0)
+    return moisture, battery
+
+
+def _peak(function, argument):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    function(argument)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+
+def measure(name, function, argument, length):
+    assert function(argument) == (0.53, 0.87)
+    elapsed = float("inf")
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            function(argument)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    airtime = LoRa().airtime_of(HEADER_LENGTH + length) / 1000
+    print("  {:<28} {:>9.0f} /s {:>6} bytes peak heap {:>4} bytes {:>5.1f} ms on air".format(name, REPEAT / elapsed, _peak(function, argument), length, airtime))
+
+
+if __name__ == "__main__":
+    print("Measurements parsed per second, peak heap of one parse, message length and airtime at the default modem config")
+    measure("text, split (before)", _legacy, TEXT, len(TEXT))
+    measure("text, in the packet pool", sensors._parse_measurement, _packet(TEXT), len(TEXT))
+    measure("binary, unpacked in place", sensors._parse_measurement, _packet(BINARY), len(BINARY))
@@ -0,0 +1,226 @@
+# BLOOM Hub
+# Simulates a day of backend polling by a fleet of hubs in simulated time, each polling every 2 seconds (BACKEND_CALL_DELAY, as before),
+# as its poller.PollScheduler decides, or as it decides with the idle synchronizations held by the backend (long polling, see main._backend_task()),
+# and counts the requests the backend gets and how long "water now" takes to reach the hubs.
+# Then runs the backend task of one hub against the mock backend (see backend_mock.py) at a smaller time scale and measures the same latency through the HTTP stack.
+# Usage: python tests/bench_polling.py [hubs, default is 100] [taps through the mock backend, default is 10]
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
+
+import asyncio
+import contextlib
+import heapq
+import io
+import random
+import sys
+import time
+import backend
+import constants
+import http
+from backend_mock import MockBackend
+from bench_backend import HUB, _Server, _install_hub
+from poller import PollScheduler
+
+DAY = 86400  # Seconds
+FIXED_DELAY = 2  # Seconds, BACKEND_CALL_DELAY before the poll scheduler
+RTT = 0.1  # Seconds per request, the backend reads the state of the hub halfway
+WATERING_TIME = 300  # Seconds a zone stays pending after the user tapped "water now"
+TAPS = 3  # "water now" per hub and day, between 7:00 and 21:00
+WAKEUP_SHARE = 0.1  # Hubs whose PRG button is pressed (or that pair a sensor) once a day
+BOOT_TIME = 60  # Seconds at the start when all hubs poll fast after booting at once, not counted in the peak
+SCALE = 50  # Times of the run against the mock backend are shorter by this factor, to take seconds instead of minutes
+
+FIXED, ADAPTIVE, HELD = "every 2 s (before)", "adaptive", "adaptive, held"
+
+
+class _Backend(object):
+    # Counts the requests per second of the day and answers whether a zone of the hub is pending, holds a request while none is if asked to
+
+    def __init__(self):
+        self.requests = 0
+        self.per_second = {}
+
+    def poll(self, hub, sent, hold):
+        """
+        :return: Time the answer reaches the hub and whether a zone is pending
+        :rtype: (float, bool)
+        """
+
+        arrival = sent + RTT / 2
+        self.requests += 1
+        self.per_second[int(arrival)] = self.per_second.get(int(arrival), 0) + 1
+        answered = arrival
+        if hold and not hub.is_pending(arrival):
+            answered = min([tap for tap in hub.taps if arrival < tap <= arrival + hold] + [arrival + hold])
+        return answered + RTT / 2, hub.is_pending(answered)
+
+
+class _Hub(object):
+
+    def __init__(self, mode):
+        self.taps = sorted(random.uniform(7 * 3600, 21 * 3600) for _ in range(TAPS))
+        self.wakeups = [random.uniform(0, DAY)] if random.random() < WAKEUP_SHARE else []
+        self.mode = mode
+        self.poller = None if mode == FIXED else PollScheduler()
+        self.next_poll = random.uniform(0, FIXED_DELAY)
+        self.received = 0  # Time the last answer reached the hub
+        self.hold = 0  # Seconds the backend may hold the next request
+        self.was_pending = False
+        self.started = set()  # Taps the hub has seen pending
+        self.stopped = set()  # Taps the hub has seen done
+        self.start_latencies = []
+        self.stop_latencies = []
+
+    def is_pending(self, now):
+        return any(tap <= now < tap + WATERING_TIME for tap in self.taps)
+
+    def polled(self, now, is_pending):
+        # Returns the delay until the next request
+
+        for tap in self.taps:
+            if is_pending and tap <= now < tap + WATERING_TIME + RTT and tap not in self.started:
+                self.started.add(tap)
+                self.start_latencies.append(now - tap)
+            if tap + WATERING_TIME <= now - RTT / 2 and not is_pending and tap not in self.stopped:
+                self.stopped.add(tap)
+                self.stop_latencies.append(now - tap - WATERING_TIME)
+        is_active = is_pending or is_pending != self.was_pending  # As watering.is_active()
+        self.was_pending = is_pending
+        self.received = now
+        self.hold = 0
+        if self.poller is None:
+            return FIXED_DELAY
+        self.poller.update(is_active)
+        if self.mode == HELD and not is_active:  # As main._backend_task()
+            self.hold = self.poller.delay() / 1000
+            return 0
+        return self.poller.delay() / 1000
+
+
+def _percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run(hubs, mode):
+    random.seed(1)  # The same fleet for all
+    server = _Backend()
+    fleet = [_Hub(mode) for _ in range(hubs)]
+    events = []  # (time, hub index, wakeup)
+    for index, hub in enumerate(fleet):
+        heapq.heappush(events, (hub.next_poll, index, False))
+        for wakeup in hub.wakeups:
+            heapq.heappush(events, (wakeup, index, True))
+    while events:
+        now, index, wakeup = heapq.heappop(events)
+        if now > DAY:
+            break
+        hub = fleet[index]
+        if wakeup:
+            if hub.poller is not None and hub.next_poll > now and hub.received <= now:  # The backend task is called right away, a held request is not cut short
+                hub.poller.wake()
+                hub.next_poll = now
+                heapq.heappush(events, (now, index, False))
+            continue
+        if now != hub.next_poll:  # Superseded by a wakeup
+            continue
+        received, is_pending = server.poll(hub, now, hub.hold)
+        hub.next_poll = received + hub.polled(received, is_pending)
+        heapq.heappush(events, (hub.next_poll, index, False))
+    start = sorted(latency for hub in fleet for latency in hub.start_latencies)
+    stop = sorted(latency for hub in fleet for latency in hub.stop_latencies)
+    peak = max(count for second, count in server.per_second.items() if second >= BOOT_TIME)
+    night = sum(count for second, count in server.per_second.items() if second < 6 * 3600) / (6 * 3600)
+    print("  {:<18} {:>7.1f} {:>8.1f} {:>6.1f} {:>5} | {:>6.1f} s {:>6.1f} s {:>6.1f} s | {:>6.1f} s".format(
+        mode, server.requests / hubs / 24, server.requests / DAY, night, peak,
+        _percentile(start, 0.5), _percentile(start, 0.95), start[-1], _percentile(stop, 0.95)))
+
+
+def fleet(hubs):
+    print("{} hubs for a day, {} taps on \"water now\" per hub (zone pending for {} s), {:.0%} of the hubs woken up once, {:.0f} ms round-trip time".format(
+        hubs, TAPS, WATERING_TIME, WAKEUP_SHARE, RTT * 1000))
+    print("  {:<18} {:>7} {:>8} {:>6} {:>5} | {:^26} | {:>8}".format("", "per hub", "fleet", "night", "peak", "latency of the start", "stop"))
+    print("  {:<18} {:>7} {:>8} {:>6} {:>5} | {:>8} {:>8} {:>8} | {:>8}".format("polling", "req/h", "req/s", "req/s", "req/s", "median", "p95", "max", "p95"))
+    for mode in (FIXED, ADAPTIVE, HELD):
+        run(hubs, mode)
+
+
+class _HoldingServer(_Server):
+    # Holds the synchronization while no zone is pending, for as long as the hub allows, if it advertises constants.FEATURE_SYNC_HOLD
+    # A pending zone is answered once and then taken back, as if watering was done
+
+    def __init__(self, mock, hold):
+        _Server.__init__(self, mock, sync=True)
+        self.hold = hold
+        self.rtt = mock.rtt
+        self.tapped = None
+        self.latencies = []
+        self._arrivals = {}
+
+    def _hub(self):
+        features = HUB["features"] + [constants.FEATURE_SYNC_HOLD] if self.hold else HUB["features"]
+        return dict(HUB, features=features, zones_version=1, policy_version=None)
+
+    def tap(self):
+        self.pending_zones = [2]
+        self.tapped = time.monotonic()
+
+    def _sync(self, request):
+        arrival = self._arrivals.setdefault(id(request), time.monotonic())
+        if not self.pending_zones and time.monotonic() < arrival + request.json().get("hold", 0) / 1000:
+            return None
+        self._arrivals.pop(id(request))
+        response = _Server._sync(self, request)
+        if self.pending_zones:
+            self.latencies.append(time.monotonic() + self.rtt - self.tapped)
+            self.pending_zones = []
+        return response
+
+
+async def _latencies(taps, mode):
+    # Taps "water now" whenever the hub has been idle for a random part of the poll ceiling, returns the latencies scaled back and the number of requests
+
+    random.seed(1)
+    _install_hub()
+    import main
+    main._poller = PollScheduler(constants.BACKEND_POLL_MIN_DELAY // SCALE, constants.BACKEND_POLL_MAX_DELAY // SCALE)
+    mock = MockBackend(RTT / SCALE).install(http)
+    server = _HoldingServer(mock, mode == HELD)
+    backend._sync_supported = True
+    backend._sync_hold = None
+    http._cache.clear()
+    task = asyncio.create_task(main._backend_task())
+    for _ in range(taps):
+        while main._poller.interval < main._poller.max_delay or main.watering.is_active():  # Idle
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(random.uniform(0, main._poller.max_delay / 1000))
+        server.tap()
+        while server.pending_zones:
+            await asyncio.sleep(0.001)
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    mock.uninstall(http)
+    return sorted(latency * SCALE for latency in server.latencies), len(mock.requests)
+
+
+def through_mock(taps):
+    print("{} taps on \"water now\" at a random time of an idle hub, the backend task against the mock backend with times shorter by {}".format(taps, SCALE))
+    print("  {:<18} {:>8} | {:^26}".format("", "", "latency of the start"))
+    print("  {:<18} {:>8} | {:>8} {:>8} {:>8}".format("polling", "requests", "median", "p95", "max"))
+
+    async def run():  # One event loop for all, the events of the hub's modules are bound to it
+        for mode in (ADAPTIVE, HELD):
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies, requests = await _latencies(taps, mode)
+            print("  {:<18} {:>8} | {:>6.1f} s {:>6.1f} s {:>6.1f} s".format(
+                mode, requests, _percentile(latencies, 0.5), _percentile(latencies, 0.95), latencies[-1]))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    fleet(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
+    through_mock(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,143 @@
+# BLOOM Hub
+# Counts the SPI transactions (chip select cycles) of the radio driver on the fake SX1276 (see fakes/machine.py)
+# and measures the heap and time per received packet over the same fake SPI and interrupt path, compared to building a Payload namedtuple per packet as before the packet pool,
+# the latency and CPU time of send_reliably() and send_reliably_async() with a simulated airtime, and the accuracy of the acknowledgement timeout
+# Usage: python tests/bench_radio.py
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
+
+import asyncio
+import struct
+import time
+import tracemalloc
+from collections import namedtuple
+import machine
+from machine import chip
+import radio
+from radio import LoRa, BROADCAST_ADDRESS
+
+HUB_ADDRESS = 1
+SENSOR_ADDRESS = 7
+
+
+def count(name, function, repeat=10):
+    function()  # Warm up (mode switches)
+    machine.idle()
+    transactions = chip.transactions
+    for _ in range(repeat):
+        function()
+        machine.idle()
+    print("{:<40} {:>5.1f} transactions".format(name, (chip.transactions - transactions) / repeat))
+
+
+def receive(lora, header_id=[0]):
+    header_id[0] = (header_id[0] + 1) & 0xff
+    chip.receive(bytes((HUB_ADDRESS, SENSOR_ADDRESS, header_id[0], 0)) + b"measurement")
+    machine.idle()
+    lora.drain(lambda packet: None)
+
+
+class _LegacyLoRa(LoRa):
+    # LoRa._prepare_payload() before the packet pool: reads the FIFO into a new buffer, builds a Payload namedtuple class and a copy of the message per packet
+    # and caches it in a list, over the same fake SPI and interrupt path as the pool
+
+    def __init__(self, *args, **kwargs):
+        LoRa.__init__(self, *args, **kwargs)
+        self.payloads = []
+
+    def _receive_packet(self):
+        packet_len = self._spi_read(radio.REG_13_RX_NB_BYTES)
+        self._spi_write(radio.REG_0D_FIFO_ADDR_PTR, self._spi_read(radio.REG_10_FIFO_RX_CURRENT_ADDR))
+        packet = bytearray(packet_len)
+        self._spi_read_into(radio.REG_00_FIFO, packet)
+        packet = bytes(packet)
+        snr = self._spi_read(radio.REG_19_PKT_SNR_VALUE) / 4
+        rssi = self._spi_read(radio.REG_1A_PKT_RSSI_VALUE)
+        if snr < 0:
+            rssi = snr + rssi
+        else:
+            rssi = rssi * 16 / 15
+        if self._freq >= 779:
+            rssi = round(rssi - 157, 2)
+        else:
+            rssi = round(rssi - 164, 2)
+        if packet_len >= 4:
+            message = bytes(packet[4:]) if packet_len > 4 else b''
+            self._last_payload = namedtuple(
+                "Payload",
+                ['message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr']
+                )(message, packet[0], packet[1], packet[2], packet[3], rssi, snr)
+            self._new_payload = True
+            if self._receive_continuously and not packet[3] & radio.FLAGS_ACK:
+                self.payloads.append(self._last_payload)
+        self._set_continuous_mode()
+
+    def drain(self, handler, count=None):
+        while self.payloads:
+            handler(self.payloads.pop(0))
+
+
+def _receive_broadcast(lora, packet, handled):
+    chip.receive(packet)  # Broadcasts are not acknowledged, so only the receive path is measured
+    machine.idle()
+    lora.drain(handled)
+
+
+def per_packet(name, function, repeat=1000):
+    function()  # Warm up
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    function()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    for _ in range(repeat):
+        function()
+    retained = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    elapsed = (time.perf_counter() - start) / repeat
+    print("{:<40} {:>5} bytes peak, {:>6} bytes retained after {} packets, {:>7.0f} packets/s".format(name, peak, retained, repeat + 1, 1 / elapsed))
+
+
+def wait(name, function, repeat=10):
+    wall = cpu = 0
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        result = function()
+        wall += time.perf_counter() - start
+        cpu += time.process_time() - start_cpu
+    print("{:<40} {:>6.1f} ms, {:>5.1f} ms CPU ({:>3.0f} %), result {}".format(name, wall / repeat * 1000, cpu / repeat * 1000, cpu / wall * 100, result))
+
+
+if __name__ == "__main__":
+    chip.auto_acknowledge = True
+    lora = LoRa(address=HUB_ADDRESS)
+    lora.receive_continuously()
+    cad_retries = lora.cad_retries
+    lora.cad_retries = 0
+    count("send (broadcast, no CAD)", lambda: lora.send(b"beacon", BROADCAST_ADDRESS))
+    lora.cad_retries = cad_retries
+    count("send (broadcast, CAD)", lambda: lora.send(b"beacon", BROADCAST_ADDRESS))
+    count("send_reliably (CAD, ACK received)", lambda: lora.send_reliably(b"command", SENSOR_ADDRESS))
+    count("receive and acknowledge", lambda: receive(lora))
+    packet = bytes((BROADCAST_ADDRESS, SENSOR_ADDRESS, 1, 0)) + bytes((0xb1, 0x88, 0x13, 0x28, 0x23))
+    legacy = _LegacyLoRa(address=HUB_ADDRESS)  # Takes over the interrupt pin
+    legacy.receive_continuously()
+    per_packet("Payload namedtuple per packet (before)", lambda: _receive_broadcast(legacy, packet, lambda payload: struct.unpack_from("<HH", payload.message, 1)))
+    lora = LoRa(address=HUB_ADDRESS)
+    lora.receive_continuously()
+    per_packet("receive into the packet pool", lambda: _receive_broadcast(lora, packet, lambda packet: packet.unpack_from("<HH", 1)))
+    chip.tx_delay, chip.ack_delay, chip.cad_delay = 60, 40, 5  # ms
+    print("TX {} ms, ACK after {} ms, CAD {} ms".format(chip.tx_delay, chip.ack_delay, chip.cad_delay))
+    wait("send_reliably (polls in idle())", lambda: lora.send_reliably(b"command", SENSOR_ADDRESS))
+    loop = asyncio.new_event_loop()  # The radio's flags are bound to the loop that awaits them first
+    wait("send_reliably_async (awaits interrupts)", lambda: loop.run_until_complete(lora.send_reliably_async(b"command", SENSOR_ADDRESS)))
+    chip.auto_acknowledge = False
+    radio.getrandbits = lambda bits: 0  # No random extension of the timeout
+    lora.send_retries = 1
+    print("No ACK, receive_timeout {} ms".format(lora.receive_timeout))
+    wait("send_reliably_async (TX and timeout)", lambda: loop.run_until_complete(lora.send_reliably_async(b"command", SENSOR_ADDRESS)))
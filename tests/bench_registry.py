@@ -0,0 +1,75 @@
+# BLOOM Hub
+# Compares the per-packet cost of the pairing check and the per-cycle cost of the silent sensor query, reading the NVS as before the sensor registry and with it
+# Usage: python tests/bench_registry.py
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
+
+import time
+import constants
+import esp32
+from nvs import NVS
+from registry import SensorRegistry
+
+PAIRED_SENSOR_IDS = (1, 2, 3, 5, 8)
+REPEAT = 2000
+
+
+class _CountingNVS(esp32.NVS):
+
+    reads = 0
+
+    def get_i32(self, key):
+        _CountingNVS.reads += 1
+        return super().get_i32(key)
+
+
+def _paired_sensors(nvs_instance):
+    # sensors._paired_sensors() before the registry: one NVS lookup per possible sensor ID (see nvs.NVS.read_int() of that time)
+
+    paired_sensors = {}
+    for sensor_id in range(constants.LORA_MAX_PAIRED_SENSORS):
+        try:
+            timestamp = nvs_instance.get_i32(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id))
+        except OSError:
+            timestamp = None
+        if timestamp is not None:
+            paired_sensors[sensor_id] = timestamp
+    return paired_sensors
+
+
+def _legacy_is_paired(nvs_instance, sensor_id):
+    return sensor_id in set(_paired_sensors(nvs_instance).keys())
+
+
+def _legacy_silent_ids(nvs_instance, current_time):
+    return set(sensor_id for sensor_id, timestamp in _paired_sensors(nvs_instance).items() if current_time - timestamp > constants.LORA_MAX_SILENT_TIME)
+
+
+def measure(name, function):
+    reads = _CountingNVS.reads
+    start = time.perf_counter()
+    for index in range(REPEAT):
+        function(index)
+    elapsed = time.perf_counter() - start
+    print("  {:<30} {:>6.2f} us, {:>4.1f} NVS reads".format(name, elapsed / REPEAT * 1000000, (_CountingNVS.reads - reads) / REPEAT))
+
+
+if __name__ == "__main__":
+    esp32.reset()
+    legacy = _CountingNVS(constants.NVS_NAMESPACE)
+    for sensor_id in PAIRED_SENSOR_IDS:
+        legacy.set_i32(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + str(sensor_id), 1000)
+    legacy.commit()
+    esp32.NVS = _CountingNVS  # Migrated from the per-key layout above
+    registry = SensorRegistry(NVS())
+    current_time = 1000 + constants.LORA_MAX_SILENT_TIME + 1
+    print("{} of {} sensors paired".format(len(PAIRED_SENSOR_IDS), constants.LORA_MAX_PAIRED_SENSORS))
+    print("Pairing check per received packet")
+    measure("NVS per key (before)", lambda index: _legacy_is_paired(legacy, index % constants.LORA_MAX_PAIRED_SENSORS))
+    measure("SensorRegistry", lambda index: registry.is_paired(index % constants.LORA_MAX_PAIRED_SENSORS))
+    print("Silent sensors per backend cycle")
+    measure("NVS per key (before)", lambda index: _legacy_silent_ids(legacy, current_time))
+    measure("SensorRegistry", lambda index: registry.silent_ids(current_time))
@@ -0,0 +1,84 @@
+# BLOOM Hub
+# Simulates the uplinks of the sensors of all hubs on one channel and counts the collisions, with the sensors sending whenever they like (as before)
+# and with the slots assigned by each hub's schedule.SlotTable
+# Usage: python tests/bench_schedule.py [periods simulated per configuration, default is 200]
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
+
+import random
+import sys
+import constants
+from radio import LoRa, HEADER_LENGTH
+from schedule import SlotTable
+
+HUB_IDS = constants.LORA_BROADCAST_ADDRESS >> 4  # Hub IDs 0 to 14, see hub._lora_setup()
+FRAME_TIME = LoRa().airtime_of(HEADER_LENGTH + 5) / 1000000  # Seconds on air per binary measurement
+
+
+def _unslotted(sensors, period):
+    # Every sensor sends once per period at a time of its own
+
+    return [random.uniform(0, period) for _ in sensors]
+
+
+def _slotted(tables, sensors, period):
+    # Every sensor sends once per period at a random time within its slot
+
+    slot_length = period / constants.LORA_SCHEDULE_SLOTS
+    return [tables[hub_id].slot_of(sensor_id) * slot_length + random.uniform(0, slot_length - FRAME_TIME) for hub_id, sensor_id in sensors]
+
+
+def _delivered(starts):
+    # Frames that overlap no other frame (no capture effect)
+
+    starts = sorted(starts)
+    delivered = 0
+    for index, start in enumerate(starts):
+        before = index > 0 and start - starts[index - 1] < FRAME_TIME
+        after = index + 1 < len(starts) and starts[index + 1] - start < FRAME_TIME
+        delivered += not before and not after
+    return delivered
+
+
+def simulate(hubs, sensors_per_hub, period, periods, spread):
+    """
+    :param bool spread: Whether the hubs start their slot search at a slot derived from their Hub ID (else all start at slot 0)
+    :return: Share of the frames that collided and frames delivered per hour for the unslotted and the slotted uplinks
+    :rtype: ((float, float), (float, float))
+    """
+
+    hub_ids = random.sample(range(HUB_IDS), hubs)
+    tables = {}
+    sensors = []
+    for hub_id in hub_ids:
+        tables[hub_id] = SlotTable(period=period)
+        for sensor_id in range(sensors_per_hub):
+            tables[hub_id].assign(sensor_id, hub_id if spread else 0)
+            sensors.append((hub_id, sensor_id))
+    results = []
+    for starts in (lambda: _unslotted(sensors, period), lambda: _slotted(tables, sensors, period)):
+        delivered = sum(_delivered(starts()) for _ in range(periods))
+        results.append((1 - delivered / (periods * len(sensors)), delivered * 3600 / (periods * period)))
+    return results
+
+
+def compare(periods):
+    print("{} periods each, {} slots per period, {:.0f} ms per frame".format(periods, constants.LORA_SCHEDULE_SLOTS, FRAME_TIME * 1000))
+    print("{:>4} {:>7} {:>6} | {:^22} | {:^22} | {:^22}".format("", "sensors", "period", "unslotted (before)", "slots from slot 0", "slots from the Hub ID"))
+    print("{:>4} {:>7} {:>6} |{}".format("hubs", "per hub", "s", " {:>10} {:>11} |".format("collided", "delivered/h") * 3))
+    for hubs, sensors_per_hub, period in ((1, 15, 3600), (1, 15, 60), (15, 15, 3600), (15, 15, 600), (15, 15, 60)):
+        row = "{:>4} {:>7} {:>6} |".format(hubs, sensors_per_hub, period)
+        random.seed(hubs * period)
+        unslotted, slotted = simulate(hubs, sensors_per_hub, period, periods, spread=False)
+        random.seed(hubs * period)
+        spread = simulate(hubs, sensors_per_hub, period, periods, spread=True)[1]
+        for collided, delivered in (unslotted, slotted, spread):
+            row += " {:>9.2%} {:>11.0f} |".format(collided, delivered)
+        print(row)
+
+
+if __name__ == "__main__":
+    compare(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
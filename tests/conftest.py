@@ -0,0 +1,7 @@
+# BLOOM Hub
+# Host test setup: runs the hub modules on CPython against the fakes in tests/fakes
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
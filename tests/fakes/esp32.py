@@ -0,0 +1,46 @@
+# Fake of MicroPython's esp32.NVS, in memory
+# Writes go to a pending copy of the namespace, commit() makes them persistent (i.e. visible to new NVS objects). reset() forgets everything.
+
+_namespaces = {}
+
+
+def reset():
+    _namespaces.clear()
+
+
+class NVS(object):
+
+    commits = 0  # commit() calls since reset(), over all namespaces
+
+    def __init__(self, namespace):
+        self._namespace = namespace
+        self._pending = dict(_namespaces.get(namespace, {}))
+
+    def _get(self, key, kind):
+        value = self._pending.get(key)
+        if not isinstance(value, kind):
+            raise OSError(-4354)  # ESP_ERR_NVS_NOT_FOUND
+        return value
+
+    def get_i32(self, key):
+        return self._get(key, int)
+
+    def set_i32(self, key, value):
+        self._pending[key] = int(value)
+
+    def get_blob(self, key, buffer):
+        value = self._get(key, bytes)
+        buffer[:len(value)] = value
+        return len(value)
+
+    def set_blob(self, key, value):
+        self._pending[key] = value.encode() if isinstance(value, str) else bytes(value)
+
+    def erase_key(self, key):
+        if key not in self._pending:
+            raise OSError(-4354)
+        del self._pending[key]
+
+    def commit(self):
+        _namespaces[self._namespace] = dict(self._pending)
+        NVS.commits += 1
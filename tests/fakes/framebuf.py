@@ -0,0 +1,21 @@
+# Fake of MicroPython's framebuf module, draws nothing (the hub module only needs ssd1306 to be importable)
+
+MONO_VLSB = 0
+
+
+class FrameBuffer(object):
+
+    def __init__(self, buffer, width, height, format, *args):
+        self.buffer = buffer
+
+    def fill(self, color):
+        pass
+
+    def text(self, string, x, y, color=1):
+        pass
+
+    def pixel(self, x, y, color=None):
+        pass
+
+    def blit(self, buffer, x, y, *args):
+        pass
@@ -0,0 +1,265 @@
+# Fake of MicroPython's machine module with an SX1276 LoRa transceiver on the SPI bus
+# The chip (machine.chip) counts SPI transactions, records the packets sent and raises its interrupt pin like the real one.
+# Pin interrupts are soft: the handler is scheduled (see micropython.schedule()), so it runs between two statements of the code it interrupts.
+
+import asyncio
+import time
+import micropython
+
+IRQ_PIN = 26
+CS_PIN = 18
+
+REG_FIFO = 0x00
+REG_OP_MODE = 0x01
+REG_FIFO_ADDR_PTR = 0x0d
+REG_FIFO_RX_CURRENT_ADDR = 0x10
+REG_IRQ_FLAGS = 0x12
+REG_RX_NB_BYTES = 0x13
+REG_PKT_SNR_VALUE = 0x19
+REG_PKT_RSSI_VALUE = 0x1a
+REG_PAYLOAD_LENGTH = 0x22
+
+MODE_TX = 0x03
+MODE_RXCONTINUOUS = 0x05
+MODE_CAD = 0x07
+RX_DONE = 0x40
+TX_DONE = 0x08
+CAD_DONE = 0x04
+CAD_DETECTED = 0x01
+FLAGS_ACK = 0x80
+
+_timers = []  # (deadline in ms, function) of the chip's delayed events outside of an event loop
+
+
+def _after(delay, function):
+    if not delay:
+        function()
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _timers.append((time.ticks_ms() + delay, function))
+    else:
+        loop.call_later(delay / 1000, function)
+
+
+def idle():
+    now = time.ticks_ms()
+    for timer in [timer for timer in _timers if timer[0] <= now]:
+        _timers.remove(timer)
+        timer[1]()
+    micropython.run_scheduled()
+    time.sleep(0.0001)
+
+
+def deepsleep(*args):
+    raise SystemExit
+
+
+def reset():
+    raise SystemExit
+
+
+class Pin(object):
+
+    IN = 1
+    OUT = 3
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    _pins = {}
+
+    def __init__(self, id, mode=-1, value=None, **kwargs):
+        self.id = id
+        self._value = value or 0
+        self._handler = None
+        Pin._pins[id] = self
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+        if self.id == CS_PIN:
+            chip.select(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, trigger=0, handler=None, hard=False):
+        self._handler = handler
+
+    def trigger(self):
+        # Rising edge: the handler is scheduled as soft interrupt
+
+        if self._handler:
+            micropython.schedule(self._handler, self)
+
+
+class SPI(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def write(self, buffer):
+        for byte in bytes(buffer):
+            chip.transfer(byte)
+
+    def readinto(self, buffer, write=0):
+        for index in range(len(buffer)):
+            buffer[index] = chip.transfer(write)
+
+    def write_readinto(self, out, into):
+        for index, byte in enumerate(bytes(out)):
+            into[index] = chip.transfer(byte)
+
+    def deinit(self):
+        pass
+
+
+class SoftI2C(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def writeto(self, address, buffer):
+        pass
+
+    def writevto(self, address, vector):
+        pass
+
+
+class SX1276(object):
+    """
+    Register level model of the parts of the SX1276 the hub uses: the FIFO, the operating modes, the IRQ flags and packet reception.
+
+    Sending completes after tx_delay ms (TxDone), a CAD after cad_delay ms (CadDone, with CadDetected while busy_cads > 0,
+    or while channel_active() returns True if set).
+    Packets given to receive() are received once the chip is in continuous RX mode. If auto_acknowledge is set, every reliable
+    packet sent (not to the broadcast address, ACK flag clear) is answered with an ACK after ack_delay ms.
+    auto_acknowledge may also be a function of the packet sent, to answer only some of them (e.g. the addresses in use).
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.registers = bytearray(0x80)
+        self.fifo = bytearray(256)
+        self.transactions = 0   # CS low edges
+        self.sent = []          # Packets sent, header included
+        self.inbox = []         # Packets waiting to be received
+        self.cads = 0
+        self.busy_cads = 0
+        self.channel_active = None  # Function telling whether another node is on air, decides the CADs instead of busy_cads (e.g. a simulated channel)
+        self.tx_delay = 0       # ms
+        self.cad_delay = 0      # ms
+        self.ack_delay = 0      # ms
+        self.auto_acknowledge = False
+        self.on_select = None   # Called once at the next CS low edge, e.g. to raise an interrupt in the middle of a register access
+        self._address = None
+        self._selected = False
+
+    @property
+    def mode(self):
+        return self.registers[REG_OP_MODE] & 0x07
+
+    def select(self, value):
+        if value == 0 and not self._selected:
+            self._selected = True
+            self.transactions += 1
+            self._address = None
+            if self.on_select:
+                on_select, self.on_select = self.on_select, None
+                on_select()
+        elif value:
+            self._selected = False
+
+    def transfer(self, out):
+        assert self._selected, "SPI transfer without chip select"
+        if self._address is None:
+            self._address = out
+            return 0
+        register = self._address & 0x7f
+        if self._address & 0x80:
+            if register == REG_FIFO:
+                self.fifo[self.registers[REG_FIFO_ADDR_PTR]] = out
+                self.registers[REG_FIFO_ADDR_PTR] = (self.registers[REG_FIFO_ADDR_PTR] + 1) & 0xff
+                return 0
+            self._address += 1
+            if register == REG_IRQ_FLAGS:
+                self.registers[REG_IRQ_FLAGS] &= ~out & 0xff
+            elif register == REG_OP_MODE:
+                self.registers[REG_OP_MODE] = out
+                self._set_mode(out & 0x07)
+            else:
+                self.registers[register] = out
+            return 0
+        if register == REG_FIFO:
+            value = self.fifo[self.registers[REG_FIFO_ADDR_PTR]]
+            self.registers[REG_FIFO_ADDR_PTR] = (self.registers[REG_FIFO_ADDR_PTR] + 1) & 0xff
+            return value
+        self._address += 1
+        return self.registers[register]
+
+    def raise_interrupt(self, flags):
+        self.registers[REG_IRQ_FLAGS] |= flags
+        Pin._pins[IRQ_PIN].trigger()
+
+    def receive(self, packet, rssi=100, snr=40):
+        """
+        :param bytes packet: Header (to, from, id, flags) and message
+        """
+
+        self.inbox.append((bytes(packet), rssi, snr))
+        self._deliver()
+
+    def receive_now(self, packet, rssi=100, snr=40):
+        """
+        Receives packet right away and runs the interrupt handler at once instead of scheduling it, as if the VM ran the scheduled handler just now
+        (e.g. from on_select, between filling a buffer and the transfer).
+        """
+
+        self.fifo[:len(packet)] = packet
+        self.registers[REG_RX_NB_BYTES] = len(packet)
+        self.registers[REG_FIFO_RX_CURRENT_ADDR] = 0
+        self.registers[REG_PKT_SNR_VALUE] = snr & 0xff
+        self.registers[REG_PKT_RSSI_VALUE] = rssi
+        self.registers[REG_IRQ_FLAGS] |= RX_DONE
+        pin = Pin._pins[IRQ_PIN]
+        pin._handler(pin)
+
+    def _deliver(self):
+        if self.mode != MODE_RXCONTINUOUS or not self.inbox or self.registers[REG_IRQ_FLAGS] & RX_DONE:
+            return
+        packet, rssi, snr = self.inbox.pop(0)
+        self.fifo[:len(packet)] = packet
+        self.registers[REG_RX_NB_BYTES] = len(packet)
+        self.registers[REG_FIFO_RX_CURRENT_ADDR] = 0
+        self.registers[REG_PKT_SNR_VALUE] = snr & 0xff
+        self.registers[REG_PKT_RSSI_VALUE] = rssi
+        self.raise_interrupt(RX_DONE)
+
+    def _set_mode(self, mode):
+        if mode == MODE_TX:
+            packet = bytes(self.fifo[:self.registers[REG_PAYLOAD_LENGTH]])
+            self.sent.append(packet)
+            _after(self.tx_delay, lambda: self._tx_done(packet))
+        elif mode == MODE_CAD:
+            self.cads += 1
+            detected = CAD_DETECTED if (self.channel_active() if self.channel_active else self.busy_cads > 0) else 0
+            self.busy_cads -= 1
+            _after(self.cad_delay, lambda: self.raise_interrupt(CAD_DONE | detected))
+        elif mode == MODE_RXCONTINUOUS:
+            self._deliver()
+
+    def _tx_done(self, packet):
+        self.raise_interrupt(TX_DONE)
+        if packet[0] != 0xff and not packet[3] & FLAGS_ACK and (self.auto_acknowledge(packet) if callable(self.auto_acknowledge) else self.auto_acknowledge):
+            acknowledgement = bytes((packet[1], packet[0], packet[2], FLAGS_ACK)) + b"!"
+            _after(self.ack_delay, lambda: self.receive(acknowledgement))
+
+
+chip = SX1276()
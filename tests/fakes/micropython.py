@@ -0,0 +1,25 @@
+# Fake of MicroPython's micropython module
+# schedule() runs the callback soon on the running event loop, or queues it until machine.idle() (or run_scheduled()) outside of one, like soft interrupts.
+
+import asyncio
+
+_scheduled = []
+
+
+def const(value):
+    return value
+
+
+def schedule(function, argument):
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _scheduled.append((function, argument))
+    else:
+        loop.call_soon(function, argument)
+
+
+def run_scheduled():
+    while _scheduled:
+        function, argument = _scheduled.pop(0)
+        function(argument)
@@ -0,0 +1,24 @@
+# Fake of MicroPython's network module, a station that never connects (the hub module only needs it to be importable)
+
+STA_IF = 0
+AP_IF = 1
+
+
+class WLAN(object):
+
+    def __init__(self, interface=STA_IF):
+        self._active = False
+
+    def active(self, value=None):
+        if value is not None:
+            self._active = value
+        return self._active
+
+    def isconnected(self):
+        return False
+
+    def connect(self, *args, **kwargs):
+        pass
+
+    def disconnect(self):
+        pass
@@ -0,0 +1,5 @@
+# Fake of MicroPython's ntptime module, the host clock is already set
+
+
+def settime():
+    pass
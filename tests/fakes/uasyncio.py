@@ -0,0 +1,61 @@
+# Fake of MicroPython's uasyncio module on top of asyncio
+from asyncio import *
+import asyncio as _asyncio
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(awaitable, timeout):
+    return await _asyncio.wait_for(awaitable, timeout / 1000)
+
+
+class ThreadSafeFlag(object):
+
+    def __init__(self):
+        self._event = _asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+class StreamReader(object):
+    # Stream over a non-blocking socket like object: read/readinto return None while no data is available
+
+    def __init__(self, socket, *args):
+        self._socket = socket
+        self._out = bytearray()
+
+    def write(self, data):
+        self._out += data
+
+    async def drain(self):
+        self._socket.write(bytes(self._out))
+        self._out = bytearray()
+        await _asyncio.sleep(0)
+
+    async def readinto(self, buffer):
+        while True:
+            count = self._socket.readinto(buffer)
+            if count is not None:
+                return count
+            await _asyncio.sleep(0.001)
+
+    async def read(self, count=-1):
+        buffer = bytearray(count if count > 0 else 4096)
+        count = await self.readinto(buffer)
+        return bytes(buffer[:count])
+
+    async def wait_closed(self):
+        pass
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,2 @@
+# Fake of MicroPython's ujson module
+from json import *
@@ -0,0 +1,61 @@
+# BLOOM Hub
+# Stand-in for the hub module (which sets up the real hardware), with the attributes the other modules use
+# Author: Simon Aschenbrenner
+
+import contextlib
+import sys
+import types
+from controller import IrrigationController
+
+
+class Outlet(object):
+    # Pin of an outlet or the pump, outlets are open while off
+
+    def __init__(self):
+        self.is_on = True
+
+    def on(self):
+        self.is_on = True
+
+    def off(self):
+        self.is_on = False
+
+
+class Configuration(object):
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+
+def install(path, outlet_count=3):
+    """
+    Registers a fresh stand-in as the hub module. The module object is reused, so modules that imported hub in an earlier test see the new attributes.
+
+    :param str path: Directory for the files of the hub (e.g. the irrigation policy)
+    :return: The stand-in
+    :rtype: module
+    """
+
+    hub = sys.modules.get("hub")
+    if getattr(hub, "is_stand_in", False):
+        name = hub.__name__
+        hub.__dict__.clear()
+        hub.__name__ = name
+    else:
+        hub = types.ModuleType("hub")
+    hub.is_stand_in = True
+    hub.outlets = [Outlet() for _ in range(outlet_count)]
+    hub.outlets_mask = [False] * outlet_count
+    hub.pump = Outlet()
+    hub.pump.is_on = False
+    hub.empty = False
+    hub.bucket_is_empty = lambda: hub.empty
+    hub.messages = []
+    hub.post_message = hub.messages.append
+    hub.display_message = hub.messages.append
+    hub.hold_display = lambda: None
+    hub.controller = IrrigationController(outlet_count, path=str(path) + "/policy")
+    hub.configuration = Configuration()
+    hub.has_user_in = lambda document: document.get("user") is not None
+    sys.modules["hub"] = hub
+    return hub
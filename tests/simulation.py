@@ -0,0 +1,44 @@
+# BLOOM Hub
+# Simulated clock for the benchmarks that run the radio on the fake SX1276 (see fakes/machine.py) outside of an event loop:
+# time only advances while the radio idles, 1 ms per call of radio.idle(), so minutes on the channel take seconds to simulate.
+# Import it before the hub modules, they bind the clock functions of time at import.
+# Author: Simon Aschenbrenner
+
+import support
+
+support.setup()
+
+import time
+import machine
+import micropython
+
+_now = [0]  # Simulated ticks in ms
+hooks = []  # Functions called on every tick before the chip's timers, e.g. to put the traffic of other nodes on the channel
+
+
+def ticks_ms():
+    return _now[0]
+
+
+def sleep_ms(ms):
+    for _ in range(max(1, int(ms))):
+        tick()
+
+
+def tick():
+    _now[0] += 1
+    for hook in hooks:
+        hook()
+    for timer in [timer for timer in machine._timers if timer[0] <= _now[0]]:
+        machine._timers.remove(timer)
+        timer[1]()
+    micropython.run_scheduled()
+
+
+time.ticks_ms = ticks_ms
+time.sleep_ms = sleep_ms
+time.sleep = lambda seconds: sleep_ms(seconds * 1000)
+
+import radio
+
+radio.idle = tick  # The radio idles until the next interrupt
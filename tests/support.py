@@ -0,0 +1,33 @@
+# BLOOM Hub
+# Host test support: puts the fakes and the hub modules on the path and adds the MicroPython extensions of the time module
+# Author: Simon Aschenbrenner
+
+import builtins
+import os
+import sys
+import time
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+FAKES = os.path.join(TESTS, "fakes")
+HUB = os.path.join(os.path.dirname(TESTS), "hub")
+
+
+def setup():
+    """
+    Idempotent, call before importing any hub module (done by conftest.py for pytest, by the bench_*.py scripts themselves).
+    """
+
+    for path in (HUB, FAKES):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    sys.modules.pop("http", None)  # The hub's http module shadows the standard library's
+    if not hasattr(time, "time_float"):
+        time.time_float = time.time
+        time.time = lambda: int(time.time_float())  # Whole seconds like on the ESP32
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_us = lambda: int(time.monotonic() * 1000000)
+    time.ticks_add = lambda ticks, delta: ticks + delta
+    time.ticks_diff = lambda ticks, other: ticks - other
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    builtins.const = lambda value: value
@@ -0,0 +1,179 @@
+# BLOOM Hub
+# Tests of the adaptive data rate with the radio on the fake SX1276 (see fakes/machine.py) and a stand-in hub module (see hub_mock.py)
+# Author: Simon Aschenbrenner
+
+import asyncio
+import pytest
+import adr
+import constants
+import esp32
+import hub_mock
+import machine
+import micropython
+from adr import AdaptiveDataRate, DATA_RATES, DEFAULT_DATA_RATE, MAX_TX_POWER, MIN_TX_POWER
+from machine import chip
+from radio import airtime, ModemConfig, Packet, HEADER_LENGTH
+
+HUB_ADDRESS = 0x10
+SENSOR_IDS = (1, 2)
+MESSAGE_LENGTH = HEADER_LENGTH + 5  # Binary measurement
+
+
+@pytest.fixture
+def hub(tmp_path):
+    from nvs import NVS
+    from radio import LoRa
+    from registry import SensorRegistry
+
+    chip.reset()
+    chip.auto_acknowledge = True
+    micropython._scheduled.clear()
+    machine._timers.clear()
+    esp32.reset()
+    hub = hub_mock.install(tmp_path)
+    hub.lora = LoRa(address=HUB_ADDRESS)
+    hub.lora.receive_continuously()
+    hub.registry = SensorRegistry(NVS())
+    hub.adr = AdaptiveDataRate(hub.lora, hub.registry)
+    for sensor_id in SENSOR_IDS:
+        hub.registry.update(sensor_id, 0)  # Pairing
+    yield hub
+    micropython.run_scheduled()
+
+
+def packet(snr):
+    packet = Packet()
+    packet.length = MESSAGE_LENGTH
+    packet._snr = snr * 4
+    return packet
+
+
+def observe(hub, sensor_id, snr, timestamp=0):
+    for _ in range(constants.LORA_ADR_WINDOW):
+        hub.adr.observe(sensor_id, packet(snr), timestamp)
+
+
+def send_commands(hub, sensor_ids=SENSOR_IDS):
+    import sensors
+
+    async def send():
+        for sensor_id in sensor_ids:
+            await sensors.send_link_command_async(sensor_id, HUB_ADDRESS | sensor_id)
+
+    asyncio.run(send())
+
+
+def test_command_is_sent_and_marked_acknowledged(hub):
+    observe(hub, 1, 10)
+    observe(hub, 2, 10)
+    command = hub.adr.command(1)
+    assert command is not None
+    send_commands(hub, (1,))
+    assert chip.sent[-1][1:] == bytes((HUB_ADDRESS, chip.sent[-1][2], constants.LORA_FLAG_LINK_COMMAND)) + command
+    assert hub.adr.counters()["commands"] == 1
+    assert hub.adr.command(1) is None  # Up to date, the samples of the new TX power are still missing
+
+
+def test_unacknowledged_command_is_sent_again(hub):
+    chip.auto_acknowledge = False
+    observe(hub, 1, 10)
+    observe(hub, 2, 10)
+    send_commands(hub, (1,))
+    assert hub.adr.counters()["commands"] == 0
+    assert hub.adr.command(1) is not None
+
+
+def test_switch_waits_for_all_paired_sensors(hub):
+    observe(hub, 1, 10)
+    assert hub.adr.counters()["target"] == DEFAULT_DATA_RATE  # Sensor 2 has no samples yet
+    observe(hub, 2, 10)
+    assert hub.adr.counters()["target"] == 0
+    send_commands(hub, (1,))
+    assert not hub.adr._ready()
+    assert hub.adr.announced() == DATA_RATES[DEFAULT_DATA_RATE][1]
+    hub.adr.switch(100)
+    assert hub.adr.counters()["data_rate"] == DEFAULT_DATA_RATE
+    send_commands(hub, (2,))
+    assert hub.adr._ready()
+    assert hub.adr.announced() == DATA_RATES[0][1]
+    hub.adr.switch(100)
+    assert hub.adr.counters()["data_rate"] == 0
+    assert hub.adr.counters()["switches"] == 1
+    assert hub.lora.modem_config == DATA_RATES[0][0]
+
+
+def test_weakest_sensor_decides_the_data_rate(hub):
+    observe(hub, 1, 10)  # Bw500Cr45Sf128 with the margin
+    observe(hub, 2, 0)   # Bw125Cr45Sf2048
+    assert hub.adr.counters()["target"] == 2
+
+
+def test_falls_back_to_default_data_rate_without_reception(hub):
+    observe(hub, 1, 10)
+    observe(hub, 2, 10)
+    send_commands(hub)
+    hub.adr.switch(1000)
+    hub.adr.observe(1, packet(10), 1000 + constants.LORA_ADR_FALLBACK_TIME)  # Sensor 2 stays silent
+    hub.adr.switch(1000 + constants.LORA_ADR_FALLBACK_TIME)
+    assert hub.adr.counters()["data_rate"] == 0
+    hub.adr.switch(1001 + constants.LORA_ADR_FALLBACK_TIME)
+    assert hub.adr.counters()["data_rate"] == DEFAULT_DATA_RATE
+    assert hub.adr.counters()["switches"] == 2
+    assert hub.lora.modem_config == DATA_RATES[DEFAULT_DATA_RATE][0]
+    for sensor_id in SENSOR_IDS:  # As the sensors after losing the hub
+        assert hub.adr._data_rate[sensor_id] == DEFAULT_DATA_RATE
+        assert hub.adr._tx_power[sensor_id] == MAX_TX_POWER
+
+
+def test_snr_is_normalized_to_125_khz():
+    assert adr._normalize(ModemConfig.Bw125Cr45Sf128) == 0
+    assert adr._normalize(ModemConfig.Bw500Cr45Sf128) == 24  # 6 dB more noise in 4 times the bandwidth
+    assert adr._normalize(ModemConfig.Bw31_25Cr48Sf512) == -24
+
+
+def test_margin_is_kept_on_normalized_snr(hub):
+    # 8.5 dB is the least SNR at 125 kHz for SF7 at 500 kHz (-1.5 dB normalized) with the margin of 10 dB
+    observe(hub, 1, 8.5)
+    observe(hub, 2, 8.5)
+    assert hub.adr.counters()["target"] == 0
+    observe(hub, 2, 8.25)
+    assert hub.adr.counters()["target"] == DEFAULT_DATA_RATE
+
+
+def test_samples_at_500_khz_are_normalized(hub):
+    observe(hub, 1, 10)
+    observe(hub, 2, 10)
+    send_commands(hub)
+    hub.adr.switch(0)
+    observe(hub, 1, 4)  # 10 dB at 125 kHz
+    assert hub.adr._min_snr(1) == 4 * 4 + 24
+    observe(hub, 2, 1)  # Below the margin at 500 kHz
+    assert hub.adr.counters()["target"] == 1
+
+
+def test_tx_power_is_set_per_sensor(hub):
+    observe(hub, 1, 20)  # 11 dB above the margin
+    observe(hub, 2, 10)  # 1 dB above the margin
+    assert hub.adr._tx_power_for(1) == MAX_TX_POWER - 9  # Steps of 3 dB
+    assert hub.adr._tx_power_for(2) == MAX_TX_POWER
+    send_commands(hub)
+    assert chip.sent[-2][-1] == MAX_TX_POWER - 9
+    assert chip.sent[-1][-1] == MAX_TX_POWER
+    assert hub.adr._tx_power_for(1) is None  # New samples needed at the new TX power
+
+
+def test_tx_power_is_not_lowered_below_the_minimum(hub):
+    observe(hub, 1, 40)
+    observe(hub, 2, 10)
+    assert hub.adr._tx_power_for(1) == MIN_TX_POWER
+
+
+def test_airtime_saved_is_counted_after_the_switch(hub):
+    observe(hub, 1, 10)
+    observe(hub, 2, 10)
+    assert hub.adr.airtime_saved == 0  # Received at the default data rate
+    send_commands(hub)
+    hub.adr.switch(0)
+    hub.adr.observe(1, packet(4), 0)
+    assert hub.adr.airtime_saved == airtime(DATA_RATES[DEFAULT_DATA_RATE][0], MESSAGE_LENGTH) - airtime(DATA_RATES[0][0], MESSAGE_LENGTH)
+    assert hub.adr.airtime_saved > 0
@@ -0,0 +1,101 @@
+# BLOOM Hub
+# Tests of the closed-loop irrigation controller on synthetic moisture curves
+# Author: Simon Aschenbrenner
+
+import pytest
+import constants
+import controller
+from controller import IrrigationController
+
+ZONE = 1  # Zone ID on the hub, zone 2 on the backend
+ON_BELOW = 0.3
+OFF_ABOVE = 0.5
+MAX_RUN = 600
+COOL_DOWN = 1800
+START = 2 * COOL_DOWN  # Seconds since boot, the cool-down counts from boot as if all zones stopped then
+INTERVAL = 60  # Seconds between two measurements
+
+
+@pytest.fixture
+def irrigation(tmp_path):
+    irrigation = IrrigationController(3, str(tmp_path / "policy"))
+    irrigation.set_policy(policy(ZONE + 1), 0)
+    return irrigation
+
+
+def policy(*zone_ids):
+    return { "version": 1, "zones": [{ "zone_id": zone_id, "on_below": ON_BELOW, "off_above": OFF_ABOVE, "max_run": MAX_RUN, "cool_down": COOL_DOWN } for zone_id in zone_ids] }
+
+
+def feed(irrigation, curve, start=START):
+    # Observes one measurement per interval, returns the times at which the zone started or stopped
+    changes = []
+    for index, moisture in enumerate(curve):
+        timestamp = start + index * INTERVAL
+        if irrigation.observe(ZONE, moisture, timestamp):
+            changes.append(timestamp)
+    return changes
+
+
+def test_zone_starts_below_threshold_and_stops_above_hysteresis_band(irrigation):
+    assert feed(irrigation, [0.4, 0.35, 0.31, 0.29]) == [START + 3 * INTERVAL]
+    assert irrigation.active_zones() == {ZONE}
+    assert feed(irrigation, [0.31, 0.4, 0.49], START + 4 * INTERVAL) == []  # Within the band
+    assert irrigation.active_zones() == {ZONE}
+    assert feed(irrigation, [0.5], START + 7 * INTERVAL) == [START + 7 * INTERVAL]
+    assert irrigation.active_zones() == set()
+    assert [decision[4] for decision in irrigation.decisions()] == [controller.REASON_DRY, controller.REASON_WET]
+
+
+def test_zone_stops_after_max_run(irrigation):
+    feed(irrigation, [0.2])
+    assert not irrigation.update(START + MAX_RUN - 1)
+    assert irrigation.update(START + MAX_RUN)
+    assert irrigation.active_zones() == set()
+    assert irrigation.decisions()[-1][4] == controller.REASON_MAX_RUN
+
+
+def test_zone_does_not_restart_during_cool_down(irrigation):
+    stopped = START + INTERVAL
+    assert feed(irrigation, [0.2, 0.6]) == [START, stopped]
+    assert feed(irrigation, [0.2] * (COOL_DOWN // INTERVAL - 1), stopped + INTERVAL) == []  # Dry all along the cool-down
+    assert feed(irrigation, [0.2], stopped + COOL_DOWN) == [stopped + COOL_DOWN]
+
+
+def test_zone_removed_from_policy_stops(irrigation):
+    feed(irrigation, [0.2])
+    irrigation.set_policy(policy(1), START + INTERVAL)
+    assert irrigation.active_zones() == set()
+    assert irrigation.decisions()[-1] == [START + INTERVAL, ZONE, False, 0.2, controller.REASON_POLICY]
+    assert feed(irrigation, [0.1], START + INTERVAL + COOL_DOWN) == []  # No rules for the zone anymore
+
+
+def test_policy_survives_a_reboot_and_waters_offline(irrigation):
+    # No backend is involved: the policy is loaded from its file and the decisions wait in the queue
+    rebooted = IrrigationController(3, irrigation.path)
+    assert rebooted.version == 1
+    assert feed(rebooted, [0.2, 0.25, 0.6]) == [START, START + 2 * INTERVAL]
+    assert not rebooted.update(START + 10 * MAX_RUN)
+    assert [decision[2] for decision in rebooted.decisions()] == [True, False]
+
+
+def test_decision_queue_drops_oldest_on_overflow(irrigation):
+    cycles = constants.CONTROLLER_MAX_DECISIONS // 2 + 1  # A start and a stop each
+    for cycle in range(cycles):
+        feed(irrigation, [0.2, 0.6], START + cycle * 2 * COOL_DOWN)
+    decisions = irrigation.decisions()
+    assert len(decisions) == constants.CONTROLLER_MAX_DECISIONS
+    assert irrigation.dropped == 2
+    assert decisions[0][0] == START + 2 * COOL_DOWN  # The first cycle is gone
+    assert decisions[-1][0] == START + (cycles - 1) * 2 * COOL_DOWN + INTERVAL
+    assert irrigation.counters()["dropped"] == 2
+
+
+def test_acknowledge_removes_exactly_the_reported_decisions(irrigation):
+    feed(irrigation, [0.2, 0.6])
+    reported = list(irrigation.decisions())
+    restarted = START + INTERVAL + COOL_DOWN
+    feed(irrigation, [0.2], restarted)  # Queued while the report was on its way
+    irrigation.acknowledge(reported)
+    assert irrigation.decisions() == [[restarted, ZONE, True, 0.2, controller.REASON_DRY]]
+    assert irrigation.counters()["pending"] == 1
@@ -0,0 +1,264 @@
+# BLOOM Hub
+# Tests of the HTTP client against the mock backend (see backend_mock.py)
+# Author: Simon Aschenbrenner
+
+import asyncio
+import pytest
+import constants
+import credentials
+import http
+from backend_mock import MockBackend
+
+
+@pytest.fixture
+def backend():
+    backend = MockBackend().install(http)
+    backend.route("GET", "hub/getHub", lambda request: (200, { "hub_id": 1 }))
+    backend.route("POST", "sensor/updateSensors", lambda request: (200, None))
+    yield backend
+    backend.uninstall(http)
+
+
+def call(endpoint, **kwargs):
+    return asyncio.run(http.request_handler_async(endpoint, **kwargs))
+
+
+def test_connection_is_kept_alive(backend):
+    assert call(("GET", "hub/getHub")) == { "hub_id": 1 }
+    assert call(("GET", "hub/getHub")) == { "hub_id": 1 }
+    assert backend.connections == 1
+
+
+@pytest.mark.parametrize("mode", ["reset", "eof"])
+def test_get_is_retried_on_stale_connection(backend, mode):
+    call(("GET", "hub/getHub"))
+    backend.stale(mode)
+    assert call(("GET", "hub/getHub")) == { "hub_id": 1 }
+    assert backend.connections == 2
+
+
+def test_post_is_retried_if_nothing_was_written(backend):
+    call(("GET", "hub/getHub"))
+    backend.stale("reset")
+    call(("POST", "sensor/updateSensors"), json_dict={ "sensors": [] })
+    assert [request.method for request in backend.requests] == ["GET", "POST"]
+
+
+@pytest.mark.parametrize("mode", ["eof", "drop"])
+def test_post_is_not_retried_once_written(backend, mode):
+    call(("GET", "hub/getHub"))
+    backend.stale(mode)
+    with pytest.raises(http.BackendError):
+        call(("POST", "sensor/updateSensors"), json_dict={ "sensors": [] })
+    posts = [request for request in backend.requests if request.method == "POST"]
+    assert len(posts) == (1 if mode == "drop" else 0)  # Never twice
+    call(("POST", "sensor/updateSensors"), json_dict={ "sensors": [] })  # The next request opens a new connection
+    assert backend.connections == 2
+
+
+def test_request_larger_than_the_send_buffer_is_written_in_parts(backend):
+    sensors = [[zone_id, 0.53, 0.87] for zone_id in range(constants.HTTP_SEND_BUFFER_SIZE // 8)]
+    writes = backend.writes
+    call(("POST", "sensor/updateSensors"), json_dict={ "sensors": sensors })
+    assert backend.requests[-1].json() == { "sensors": sensors }
+    assert backend.writes - writes == 1  # Handed to the stream in parts, written at once
+
+
+def test_buffers_are_allocated_on_first_use(backend):
+    connection = http._Connection()
+    assert connection.send_buffer is None and connection.receive_buffer is None
+    connection.open()
+    assert len(connection.send_buffer) == constants.HTTP_SEND_BUFFER_SIZE
+    assert len(connection.receive_buffer) == constants.HTTP_RECEIVE_BUFFER_SIZE
+    connection.close()
+
+
+def test_request_handler_outside_of_a_task(backend):
+    assert http.request_handler(("GET", "hub/getHub")) == { "hub_id": 1 }
+
+
+def test_request_handler_refuses_to_run_in_a_task(backend):
+    async def task():
+        return http.request_handler(("GET", "hub/getHub"))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(task())
+    assert backend.requests == []
+
+
+def test_blocking_backend_functions_run_their_async_counterparts(backend):
+    import backend as hub_backend
+
+    backend.route("GET", "sensor/getAllSensorsByHubId", lambda request: (200, [{ "zone_id": 1 }, { "zone_id": 3 }]))
+    assert hub_backend.get_sensor_ids() == { 0, 2 }
+
+    async def task():
+        return hub_backend.get_sensor_ids()
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(task())
+    assert len(backend.requests) == 1
+
+
+@pytest.fixture
+def versioned(backend):
+    # hub/getZones answers with an ETag of the version and 304 if the hub has it already, hub/getRaw without ETag
+
+    http._cache.clear()
+    backend.version = 1
+    backend.route("GET", "hub/getZones", lambda request: (304, None) if request.headers.get("if-none-match") == str(backend.version) else (200, { "zones": [1, 2] }, { "ETag": backend.version }))
+    backend.route("GET", "hub/getRaw", lambda request: (200, { "raw": True }))
+    backend.route("POST", "hubRegistration", lambda request: (200, None, { "Authorization": "Bearer " + request.json()["user"] }))
+    return backend
+
+
+def test_not_modified_returns_an_unshared_copy(versioned):
+    counters = http.counters()
+    first = call(("GET", "hub/getZones"))
+    first["zones"].append(3)
+    second = call(("GET", "hub/getZones"))
+    assert second == { "zones": [1, 2] }
+    second["zones"].clear()
+    assert call(("GET", "hub/getZones")) == { "zones": [1, 2] }
+    assert http.counters()["hits"] - counters["hits"] == 2
+    assert http.counters()["misses"] - counters["misses"] == 1
+
+
+def test_responses_without_etag_are_no_misses(versioned):
+    counters = http.counters()
+    call(("GET", "hub/getRaw"))
+    call(("GET", "hub/getRaw"))
+    assert http.counters()["misses"] == counters["misses"]
+
+
+def test_new_session_clears_the_cache(versioned):
+    call(("POST", "hubRegistration/postHubRegistration"), json_dict={ "user": "a" }, auth_header={ "Authorization": "Basic a" })
+    call(("GET", "hub/getZones"))
+    call(("POST", "hubRegistration/postHubRegistration"), json_dict={ "user": "b" }, auth_header={ "Authorization": "Basic b" })
+    versioned.requests.clear()
+    call(("GET", "hub/getZones"))
+    assert "if-none-match" not in versioned.requests[0].headers
+    assert versioned.requests[0].headers["authorization"] == "Bearer b"
+
+
+def test_requests_with_own_credentials_are_not_cached(versioned):
+    call(("GET", "hub/getZones"), auth_header={ "Authorization": "Basic a" })
+    versioned.requests.clear()
+    call(("GET", "hub/getZones"), auth_header={ "Authorization": "Basic a" })
+    assert "if-none-match" not in versioned.requests[0].headers
+
+
+@pytest.fixture
+def invalidations(backend, monkeypatch):
+    calls = []
+    monkeypatch.setattr(credentials, "invalidate_address", lambda: calls.append(1))
+    return calls
+
+
+def refuse(backend, monkeypatch):
+    def connect():
+        raise OSError(113)  # EHOSTUNREACH
+
+    monkeypatch.setattr(backend, "_connect", connect)
+
+
+def test_address_is_invalidated_after_a_failed_connect(backend, invalidations, monkeypatch):
+    refuse(backend, monkeypatch)
+    with pytest.raises(http.BackendError):
+        call(("GET", "hub/getHub"))
+    assert invalidations == [1]
+
+
+def test_address_is_invalidated_if_the_retry_after_a_stale_connection_fails(backend, invalidations, monkeypatch):
+    call(("GET", "hub/getHub"))
+    backend.stale("reset")
+    refuse(backend, monkeypatch)
+    with pytest.raises(http.BackendError):
+        call(("GET", "hub/getHub"))
+    assert invalidations == [1]
+
+
+def test_address_is_kept_after_a_stale_connection_or_an_invalid_response(backend, invalidations, monkeypatch):
+    call(("GET", "hub/getHub"))
+    backend.stale("reset")
+    call(("GET", "hub/getHub"))  # Sent again on a new connection
+    monkeypatch.setattr(backend, "_handle", lambda request: b"garbage\r\n\r\n")
+    http.close()
+    with pytest.raises(http.BackendError):
+        call(("GET", "hub/getHub"))  # ValueError on a new connection
+    assert invalidations == []
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    # Counts the lookups of the backend host, the clock of credentials.address() is set by the test
+
+    lookups = []
+    now = [0]
+    monkeypatch.setattr(credentials, "_address", None)
+    monkeypatch.setattr(credentials, "_counters", dict.fromkeys(credentials._counters, 0))
+    monkeypatch.setattr(credentials.socket, "getaddrinfo", lambda *args: lookups.append(args) or [(2, 1, 0, "", ("10.0.0.{}".format(len(lookups)), 443))])
+    monkeypatch.setattr(credentials, "ticks_ms", lambda: now[0])
+    return lookups, now
+
+
+def test_address_is_resolved_again_after_its_ttl(resolver):
+    lookups, now = resolver
+    first = credentials.address()
+    now[0] = constants.BACKEND_ADDRESS_TTL - 1
+    assert credentials.address() is first
+    now[0] = constants.BACKEND_ADDRESS_TTL
+    assert credentials.address()[-1] == ("10.0.0.2", 443)
+    assert len(lookups) == 2
+    counters = credentials.counters()
+    assert (counters["address_hits"], counters["address_misses"]) == (1, 2)
+
+
+def test_invalidated_address_is_resolved_again(resolver):
+    lookups, _ = resolver
+    credentials.address()
+    credentials.invalidate_address()
+    credentials.address()
+    credentials.address()
+    assert len(lookups) == 2
+    counters = credentials.counters()
+    assert (counters["address_hits"], counters["address_misses"]) == (1, 2)
+
+
+def test_credentials_and_ssl_context_are_read_once(tmp_path, monkeypatch):
+    class Context(object):
+        created = []
+
+        def __init__(self, protocol):
+            Context.created.append(self)
+            self.wrapped = []
+
+        def load_cert_chain(self, cert, key):
+            self.chain = (cert, key)
+
+        def wrap_socket(self, sckt, server_hostname, do_handshake_on_connect):
+            self.wrapped.append((sckt, do_handshake_on_connect))
+            return sckt
+
+    class SSL(object):
+        PROTOCOL_TLS_CLIENT = 16
+        CERT_NONE = 0
+        SSLContext = Context
+
+    (tmp_path / "key").write_bytes(b"KEY")
+    (tmp_path / "cert").write_bytes(b"CERT")
+    monkeypatch.setattr(constants, "SSL_KEY", str(tmp_path / "key"))
+    monkeypatch.setattr(constants, "SSL_CERT", str(tmp_path / "cert"))
+    monkeypatch.setattr(credentials, "ssl", SSL)
+    for name in ("_key", "_cert", "_context"):
+        monkeypatch.setattr(credentials, name, None)
+    monkeypatch.setattr(credentials, "_counters", dict.fromkeys(credentials._counters, 0))
+    assert credentials.wrap_socket("first", do_handshake=False) == "first"
+    (tmp_path / "key").unlink()  # Not read again
+    assert credentials.wrap_socket("second") == "second"
+    assert len(Context.created) == 1
+    assert Context.created[0].chain == (b"CERT", b"KEY")
+    assert Context.created[0].verify_mode == SSL.CERT_NONE
+    assert Context.created[0].wrapped == [("first", False), ("second", True)]
+    counters = credentials.counters()
+    assert (counters["credentials_hits"], counters["credentials_misses"]) == (1, 1)
@@ -0,0 +1,73 @@
+# BLOOM Hub
+# Tests of the measurement journal on a temporary file
+# Author: Simon Aschenbrenner
+
+import pytest
+import constants
+import journal
+from journal import Journal
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal")
+
+
+def fill(journal, count):
+    for index in range(count):
+        journal.append(index % constants.LORA_MAX_PAIRED_SENSORS, 0.5, 0.25, 1000 + index)
+
+
+def corrupt(path, sequence_number, capacity, offsets=(6,)):
+    with open(path, "r+b") as file:
+        for offset in offsets:
+            file.seek(journal._HEADER_SIZE + (sequence_number % capacity) * journal._RECORD_SIZE + offset)
+            byte = file.read(1)[0]
+            file.seek(-1, 1)
+            file.write(bytes((byte ^ 0x01,)))
+
+
+def test_records_survive_reopening(path):
+    fill(Journal(path, 8), 3)
+    records = Journal(path, 8).peek(8)
+    assert [record[0] for record in records] == [0, 1, 2]
+    assert records[1][1:] == (1, 0.5, 0.25, 1001)
+
+
+def test_corrupted_records_are_counted_as_dropped(path):
+    fill(Journal(path, 8), 4)
+    corrupt(path, 0, 8)
+    corrupt(path, 2, 8)
+    recovered = Journal(path, 8)
+    records = recovered.peek(8)
+    assert [record[0] for record in records] == [1, 3]
+    recovered.peek(8)  # Peeking again does not count twice
+    recovered.acknowledge(records[-1][0])
+    assert recovered.counters() == { "queued": 0, "flushed": 2, "dropped": 2, "pending": 0 }
+
+
+def test_checksum_detects_the_same_bit_flipped_twice(path):
+    # The former 8 bit XOR checksum missed errors that cancel out
+    fill(Journal(path, 8), 1)
+    corrupt(path, 0, 8, offsets=(5, 6))
+    assert Journal(path, 8).peek() == []
+
+
+def test_header_is_written_every_interval_and_on_sync(path):
+    journal = Journal(path, 64)
+    fill(journal, constants.JOURNAL_HEADER_INTERVAL + 1)
+    for sequence_number in range(constants.JOURNAL_HEADER_INTERVAL - 1):
+        journal.acknowledge(sequence_number)
+    assert len(Journal(path, 64)) == constants.JOURNAL_HEADER_INTERVAL + 1  # Acknowledgements not yet written, would be sent again
+    journal.acknowledge(constants.JOURNAL_HEADER_INTERVAL - 1)
+    assert len(Journal(path, 64)) == 1
+    journal.acknowledge(constants.JOURNAL_HEADER_INTERVAL)
+    journal.sync()
+    assert len(Journal(path, 64)) == 0
+
+
+def test_full_journal_drops_the_oldest(path):
+    journal = Journal(path, 4)
+    fill(journal, 6)
+    assert [record[0] for record in journal.peek(4)] == [2, 3, 4, 5]
+    assert journal.dropped == 2
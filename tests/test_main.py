@@ -0,0 +1,135 @@
+# BLOOM Hub
+# Tests of the tasks of the main loop with the radio on the fake SX1276 (see fakes/machine.py), a slow mock backend (see backend_mock.py) and a stand-in hub module (see hub_mock.py)
+# Author: Simon Aschenbrenner
+
+import asyncio
+import struct
+import time
+import pytest
+import constants
+import esp32
+import hub_mock
+import http
+import machine
+import micropython
+from backend_mock import MockBackend
+from machine import chip
+
+HUB_ADDRESS = 0x10
+SENSOR_IDS = (1, 2, 3, 4)
+PACKETS = 2 * constants.UPLOAD_BATCH_SIZE
+PACKET_INTERVAL = 0.05  # Seconds, about what the channel carries (41 ms on air per measurement at the default modem config)
+BACKEND_RTT = 1         # Seconds per request, a blocking request would overflow the receive cache twice
+
+
+@pytest.fixture
+def hub(tmp_path):
+    from adr import AdaptiveDataRate
+    from journal import Journal
+    from nvs import NVS
+    from radio import LoRa
+    from registry import SensorRegistry
+    from schedule import SlotTable
+
+    chip.reset()
+    chip.auto_acknowledge = True  # Link commands of the adaptive data rate
+    micropython._scheduled.clear()
+    machine._timers.clear()
+    esp32.reset()
+    hub = hub_mock.install(tmp_path)
+    hub.lora = LoRa(address=HUB_ADDRESS)
+    hub.lora.receive_continuously()
+    hub.configuration = NVS()
+    hub.registry = SensorRegistry(hub.configuration)
+    hub.journal = Journal(str(tmp_path / "journal"))
+    hub.schedule = SlotTable()
+    hub.adr = AdaptiveDataRate(hub.lora, hub.registry)
+    for sensor_id in SENSOR_IDS:
+        hub.registry.update(sensor_id, 0)
+    yield hub
+    micropython.run_scheduled()
+
+
+@pytest.fixture
+def backend():
+    import backend as hub_backend
+    backend = MockBackend(BACKEND_RTT).install(http)
+    backend.measurements = []
+    backend.route("PUT", "sensor/updateSensors", lambda request: (backend.measurements.extend(request.json()["sensors"]), (200, None))[1])
+    hub_backend._bulk_sensor_update = True
+    yield backend
+    backend.uninstall(http)
+
+
+async def _transmit():
+    # The sensors transmit in turn, faster than the backend answers a single request
+
+    for index in range(PACKETS):
+        sensor_id = SENSOR_IDS[index % len(SENSOR_IDS)]
+        message = struct.pack("<BHH", constants.LORA_BINARY_PREAMBLE | 1, 5000, 9000)
+        chip.receive(bytes((HUB_ADDRESS, HUB_ADDRESS | sensor_id, index & 0xff, constants.LORA_FLAG_MEASUREMENT)) + message)
+        await asyncio.sleep(PACKET_INTERVAL)
+
+
+def test_slow_backend_drops_no_packets(hub, backend):
+    import main
+
+    async def run():
+        tasks = [asyncio.create_task(main._radio_task()), asyncio.create_task(main._upload_task())]
+        await _transmit()
+        while len(backend.measurements) < PACKETS:
+            await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    assert hub.lora.cache.dropped == 0
+    assert hub.journal.counters()["dropped"] == 0
+    assert len(backend.requests) == 2  # Both batches were uploaded while the radio received
+    assert len(backend.measurements) == PACKETS
+
+
+def test_idle_hub_gets_water_now_from_a_held_synchronization(hub):
+    import backend as hub_backend
+    import main
+    import watering
+    from poller import PollScheduler
+
+    mock = MockBackend().install(http)
+    pending_zones = []
+    arrivals = {}  # Request -> time it arrived
+
+    def sync(request):
+        arrival = arrivals.setdefault(request, time.monotonic())
+        if not pending_zones and time.monotonic() < arrival + request.json().get("hold", 0) / 1000:
+            return None  # Held until "water now" or the time the hub allowed
+        document = { "hub_id": constants.HUB_ID, "user": 1, "features": [constants.FEATURE_SYNC_HOLD] }
+        return 200, { "hub": document, "pending_zones": pending_zones, "zones": [{ "zone_id": 1 }, { "zone_id": 2 }, { "zone_id": 3 }],
+                      "sensors": [{ "zone_id": sensor_id + 1 } for sensor_id in SENSOR_IDS] }
+
+    mock.route("POST", "hub/sync", sync)
+    hub_backend._sync_supported = True
+    hub_backend._sync_hold = None
+    watering._zone_states.clear()
+    main._poller = PollScheduler(20, 800)
+
+    async def run():
+        task = asyncio.create_task(main._backend_task())
+        while not any(request.json().get("hold", 0) >= 400 for request in arrivals):  # Idle for a while
+            await asyncio.sleep(0.01)
+        requests = len(mock.requests)
+        tapped = time.monotonic()
+        pending_zones.append(2)
+        while not hub.outlets_mask[1]:
+            await asyncio.sleep(0.001)
+        latency = time.monotonic() - tapped
+        task.cancel()
+        return requests, latency
+
+    try:
+        requests, latency = asyncio.run(asyncio.wait_for(run(), 10))
+    finally:
+        mock.uninstall(http)
+    assert latency < 0.2  # The held request answered, not the next one after the ceiling
+    assert len(mock.requests) == requests
+    assert all(request.json().get("hold", 0) <= 800 for request in mock.requests)
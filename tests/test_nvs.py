@@ -0,0 +1,62 @@
+# BLOOM Hub
+# Tests of the configuration record on the fake NVS (see fakes/esp32.py)
+# Author: Simon Aschenbrenner
+
+import pytest
+import constants
+import esp32
+from nvs import NVS
+
+
+@pytest.fixture
+def configuration():
+    esp32.reset()
+    return NVS()
+
+
+def test_values_survive_reboot(configuration):
+    configuration.write_str(constants.NVS_KEY_WLAN_ESSID, "garden")
+    configuration.write_int(constants.NVS_KEY_LORA_HUB_ID, 3)
+    configuration = NVS()
+    assert configuration.read_str(constants.NVS_KEY_WLAN_ESSID) == "garden"
+    assert configuration.read_int(constants.NVS_KEY_LORA_HUB_ID) == 3
+    assert configuration.read_int(constants.NVS_KEY_REBOOT_COUNTER) is None
+
+
+def test_transaction_commits_once(configuration):
+    commits = configuration.commits
+    with configuration.transaction():
+        configuration.write_int(constants.NVS_KEY_REBOOT_COUNTER, 1)
+        with configuration.transaction():
+            configuration.write_int(constants.NVS_KEY_LAST_REBOOT_TIMESTAMP, 1000)
+        configuration.delete(constants.NVS_KEY_LORA_HUB_ID)
+    assert configuration.commits == commits + 1
+    assert NVS().read_int(constants.NVS_KEY_LAST_REBOOT_TIMESTAMP) == 1000
+
+
+def test_failed_transaction_is_rolled_back(configuration):
+    configuration.write_int(constants.NVS_KEY_REBOOT_COUNTER, 1)
+    with pytest.raises(ValueError):
+        with configuration.transaction():
+            configuration.write_int(constants.NVS_KEY_REBOOT_COUNTER, 2)
+            raise ValueError()
+    assert configuration.read_int(constants.NVS_KEY_REBOOT_COUNTER) == 1
+    assert NVS().read_int(constants.NVS_KEY_REBOOT_COUNTER) == 1
+
+
+def test_values_of_earlier_firmware_are_migrated():
+    esp32.reset()
+    earlier = esp32.NVS(constants.NVS_NAMESPACE)
+    earlier.set_blob(constants.NVS_KEY_WLAN_PASSWORD, "secret")
+    earlier.set_i32(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + "4", 1000)
+    earlier.commit()
+    configuration = NVS()
+    assert configuration.read_str(constants.NVS_KEY_WLAN_PASSWORD) == "secret"
+    assert configuration.read_int(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + "4") == 1000
+    with pytest.raises(OSError):
+        esp32.NVS(constants.NVS_NAMESPACE).get_i32(constants.NVS_KEY_PAIRED_SENSOR_PREFIX + "4")  # Moved into the record
+
+
+def test_too_long_string_is_refused(configuration):
+    with pytest.raises(ValueError):
+        configuration.write_str(constants.NVS_KEY_WLAN_ESSID, "x" * (constants.NVS_MAX_BUFFER_SIZE + 1))
@@ -0,0 +1,72 @@
+# BLOOM Hub
+# Tests of the adaptive backend polling
+# Author: Simon Aschenbrenner
+
+import pytest
+import constants
+import poller
+from poller import PollScheduler
+
+MIN_DELAY = 1000
+MAX_DELAY = 30000
+
+
+@pytest.fixture
+def scheduler():
+    return PollScheduler(MIN_DELAY, MAX_DELAY)
+
+
+def jitter(monkeypatch, bits):
+    monkeypatch.setattr(poller, "getrandbits", lambda count: bits)
+
+
+def test_defaults_are_the_configured_floor_and_ceiling():
+    scheduler = PollScheduler()
+    assert (scheduler.min_delay, scheduler.max_delay) == (constants.BACKEND_POLL_MIN_DELAY, constants.BACKEND_POLL_MAX_DELAY)
+    assert scheduler.interval == constants.BACKEND_POLL_MIN_DELAY
+
+
+def test_interval_doubles_while_idle_up_to_the_ceiling(scheduler):
+    intervals = []
+    for _ in range(7):
+        scheduler.update(False)
+        intervals.append(scheduler.interval)
+    assert intervals == [2000, 4000, 8000, 16000, 30000, 30000, 30000]
+    assert scheduler.counters() == { "interval": MAX_DELAY, "polls": 7, "wakeups": 0 }
+
+
+def test_activity_resets_the_interval_to_the_floor(scheduler):
+    for _ in range(3):
+        scheduler.update(False)
+    scheduler.update(True)
+    assert scheduler.interval == MIN_DELAY
+    scheduler.update(False)
+    assert scheduler.interval == 2 * MIN_DELAY
+
+
+def test_wake_resets_the_interval_and_is_counted(scheduler):
+    for _ in range(5):
+        scheduler.update(False)
+    scheduler.wake()
+    assert scheduler.interval == MIN_DELAY
+    assert scheduler.counters()["wakeups"] == 1
+
+
+def test_jitter_spreads_the_delay_between_three_and_five_quarters(scheduler, monkeypatch):
+    for _ in range(3):
+        scheduler.update(False)  # 8 seconds
+    jitter(monkeypatch, 0)
+    assert scheduler.delay() == 6000
+    jitter(monkeypatch, 0xffff)
+    assert 9999 <= scheduler.delay() < 10000
+    jitter(monkeypatch, 0x8000)
+    assert scheduler.delay() == 8000
+
+
+def test_jittered_delay_stays_within_floor_and_ceiling(scheduler, monkeypatch):
+    jitter(monkeypatch, 0)
+    assert scheduler.delay() == MIN_DELAY  # 3/4 of the floor
+    for _ in range(10):
+        scheduler.update(False)
+    jitter(monkeypatch, 0xffff)
+    assert scheduler.delay() == MAX_DELAY  # 5/4 of the ceiling
@@ -0,0 +1,253 @@
+# BLOOM Hub
+# Tests of the LoRa radio driver against the fake SX1276 (see fakes/machine.py)
+# Author: Simon Aschenbrenner
+
+import asyncio
+import pytest
+import constants
+import machine
+import micropython
+from machine import chip
+import radio
+from radio import LoRa, FLAGS_ACK, REG_01_OP_MODE, REG_1D_MODEM_CONFIG1, REG_1E_MODEM_CONFIG2, REG_26_MODEM_CONFIG3, ModemConfig
+
+HUB_ADDRESS = 1
+SENSOR_ADDRESS = 7
+
+
+@pytest.fixture
+def lora():
+    chip.reset()
+    micropython._scheduled.clear()
+    machine._timers.clear()
+    lora = LoRa(address=HUB_ADDRESS)
+    lora.receive_continuously()
+    yield lora
+    micropython.run_scheduled()
+
+
+def test_send_writes_header_and_data(lora):
+    assert lora.send(b"hello", SENSOR_ADDRESS, header_id=3)
+    assert chip.sent == [bytes((SENSOR_ADDRESS, HUB_ADDRESS, 3, 0)) + b"hello"]
+    assert chip.mode == radio.MODE_RXCONTINUOUS
+
+
+def test_send_reliably_waits_for_acknowledgement(lora):
+    chip.auto_acknowledge = True
+    assert lora.send_reliably(b"hello", SENSOR_ADDRESS)
+    assert len(chip.sent) == 1
+    assert lora.collisions == 0
+
+
+def test_received_packet_is_cached_and_acknowledged(lora):
+    chip.receive(bytes((HUB_ADDRESS, SENSOR_ADDRESS, 9, 0)) + b"data")
+    machine.idle()
+    packets = []
+    lora.drain(lambda packet: packets.append((packet.header_from, bytes(packet.message))))
+    assert packets == [(SENSOR_ADDRESS, b"data")]
+    assert chip.sent == [bytes((SENSOR_ADDRESS, HUB_ADDRESS, 9, FLAGS_ACK)) + b"!"]
+
+
+def test_interrupt_during_register_write_is_deferred(lora):
+    # The interrupt handler runs between filling the command buffer and the transfer, its own register accesses must not interleave
+    transactions = chip.transactions
+    chip.on_select = lambda: chip.receive_now(bytes((HUB_ADDRESS, SENSOR_ADDRESS, 4, 0)) + b"data")
+    lora.set_modem_config(ModemConfig.Bw125Cr45Sf2048)
+    assert chip.registers[REG_1D_MODEM_CONFIG1] == ModemConfig.Bw125Cr45Sf2048[0]
+    assert chip.registers[REG_1E_MODEM_CONFIG2] == ModemConfig.Bw125Cr45Sf2048[1]
+    assert chip.registers[REG_26_MODEM_CONFIG3] == ModemConfig.Bw125Cr45Sf2048[2]
+    machine.idle()
+    assert len(lora.cache) == 1
+    assert chip.sent == [bytes((SENSOR_ADDRESS, HUB_ADDRESS, 4, FLAGS_ACK)) + b"!"]
+    assert chip.mode == radio.MODE_RXCONTINUOUS
+    assert chip.transactions > transactions
+
+
+def test_packet_received_before_sending_is_read_first(lora):
+    # The receive callback is still scheduled when the application sends, the FIFO must be read before it gets overwritten
+    chip.on_select = lambda: chip.receive_now(bytes((HUB_ADDRESS, SENSOR_ADDRESS, 5, 0)) + b"first")
+    lora.cad_retries = 0
+    assert lora.send(b"second", SENSOR_ADDRESS)
+    packets = []
+    lora.drain(lambda packet: packets.append(bytes(packet.message)))
+    assert packets == [b"first"]
+    assert chip.sent[-1] == bytes((SENSOR_ADDRESS, HUB_ADDRESS, 0, 0)) + b"second"
+
+
+def test_send_reliably_async_lets_other_tasks_run(lora):
+    chip.auto_acknowledge = True
+    chip.cad_delay = 20
+    chip.tx_delay = 100
+    chip.ack_delay = 50
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0.01)
+
+    async def send():
+        task = asyncio.create_task(ticker())
+        acknowledged = await lora.send_reliably_async(b"hello", SENSOR_ADDRESS)
+        task.cancel()
+        return acknowledged
+
+    assert asyncio.run(send())
+    assert chip.cads == 1
+    assert len(chip.sent) == 1
+    assert len(ticks) >= 10  # About 170 ms of waiting for the radio
+
+
+def test_send_reliably_async_retries_without_acknowledgement(lora):
+    lora.receive_timeout = 20
+    assert not asyncio.run(lora.send_reliably_async(b"hello", SENSOR_ADDRESS))
+    assert len(chip.sent) == lora.send_retries
+    assert lora.collisions == lora.send_retries
+
+
+def test_received_packet_is_acknowledged_while_sending_async(lora):
+    # A packet that comes in while a task waits for its acknowledgement is cached and acknowledged by the receive callback
+    chip.auto_acknowledge = True
+    chip.ack_delay = 50
+
+    async def send():
+        sending = asyncio.create_task(lora.send_reliably_async(b"hello", SENSOR_ADDRESS))
+        await asyncio.sleep(0.01)
+        chip.receive(bytes((HUB_ADDRESS, SENSOR_ADDRESS + 1, 8, 0)) + b"data")
+        return await sending
+
+    assert asyncio.run(send())
+    assert len(lora.cache) == 1
+    assert chip.sent[-1] == bytes((SENSOR_ADDRESS + 1, HUB_ADDRESS, 8, FLAGS_ACK)) + b"!"
+
+
+def test_busy_channel_backoff_lets_other_tasks_run(lora):
+    chip.busy_cads = 3
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0)
+
+    async def send():
+        task = asyncio.create_task(ticker())
+        sent = await lora.send_reliably_async(b"beacon", radio.BROADCAST_ADDRESS)
+        task.cancel()
+        return sent
+
+    assert asyncio.run(send())
+    assert chip.cads == 4
+    assert lora.channel_busy == 3
+    assert len(ticks) > 3
+
+
+def test_busy_channel_gives_up_after_cad_retries(lora):
+    chip.busy_cads = lora.cad_retries * lora.send_retries
+    assert not asyncio.run(lora.send_reliably_async(b"beacon", radio.BROADCAST_ADDRESS))
+    assert chip.cads == lora.cad_retries * lora.send_retries
+    assert lora.channel_access_failures == lora.send_retries
+    assert chip.sent == []
+
+
+def test_zero_cad_retries_sends_without_listening(lora):
+    lora.cad_retries = 0
+    chip.busy_cads = 1
+    assert asyncio.run(lora.send_reliably_async(b"beacon", radio.BROADCAST_ADDRESS))
+    assert lora.send(b"beacon", radio.BROADCAST_ADDRESS)
+    assert chip.cads == 0
+    assert len(chip.sent) == 2
+
+
+def test_retransmissions_after_lost_acknowledgements_are_delivered_once(lora):
+    # Replay of a sensor sending 20 measurements: the first acknowledgement of every other measurement is lost, so the sensor retransmits it with the same header ID
+    delivered = []
+    for header_id in range(20):
+        attempts = 2 if header_id % 2 else 1
+        for _ in range(attempts):
+            chip.receive(bytes((HUB_ADDRESS, SENSOR_ADDRESS, header_id, 0)) + b"measurement")
+            machine.idle()
+        lora.drain(lambda packet: delivered.append(packet.header_id))
+    assert delivered == list(range(20))  # A single backend upload per measurement
+    assert lora.duplicates == 10
+    assert len(chip.sent) == 30  # Every retransmission is acknowledged again
+    assert all(packet[3] == FLAGS_ACK for packet in chip.sent)
+
+
+def test_same_header_id_is_delivered_again_after_duplicate_window(lora):
+    chip.receive(bytes((HUB_ADDRESS, SENSOR_ADDRESS, 3, 0)) + b"first")
+    machine.idle()
+    lora._last_receptions[SENSOR_ADDRESS] -= constants.LORA_DUPLICATE_WINDOW  # The sensor wrapped around its header IDs since
+    chip.receive(bytes((HUB_ADDRESS, SENSOR_ADDRESS, 3, 0)) + b"second")
+    machine.idle()
+    packets = []
+    lora.drain(lambda packet: packets.append(bytes(packet.message)))
+    assert packets == [b"first", b"second"]
+    assert lora.duplicates == 0
+
+
+def test_hub_without_address_receives_acknowledgement_of_its_probe():
+    # A fresh hub probes Hub IDs from the broadcast address (see hub._lora_setup()), the hub in use acknowledges to that address
+    chip.reset()
+    chip.auto_acknowledge = True
+    lora = LoRa()
+    lora.receive_continuously()
+    assert lora.send_reliably(constants.LORA_PREAMBLE, 0x1f, constants.LORA_FLAG_ADDRESS_AVL)
+    assert len(chip.sent) == 1
+
+
+def _receive(lora, *header_ids):
+    for header_id in header_ids:
+        chip.receive(bytes((HUB_ADDRESS, SENSOR_ADDRESS, header_id, 0)) + b"data")
+        machine.idle()
+
+
+def test_full_ring_drops_new_packets_and_counts_them():
+    chip.reset()
+    micropython._scheduled.clear()
+    lora = LoRa(address=HUB_ADDRESS, cache_size=2)
+    lora.receive_continuously()
+    _receive(lora, 1, 2, 3, 4)
+    counters = lora.counters()
+    assert (counters["received"], counters["dropped"], counters["overflows"], counters["waiting"]) == (2, 2, 1, 2)
+    assert [packet[2] for packet in chip.sent] == [1, 2]  # Dropped packets are not acknowledged, so the sensor retries
+    packets = []
+    lora.drain(lambda packet: packets.append(packet.header_id))
+    assert packets == [1, 2]  # The oldest are kept
+    _receive(lora, 5, 6)
+    lora.drain(lambda packet: packets.append(packet.header_id))
+    assert packets == [1, 2, 5, 6]
+    assert lora.counters()["overflows"] == 1
+
+
+def test_ring_tracks_high_water_mark(lora):
+    _receive(lora, 1, 2, 3)
+    lora.drain(lambda packet: None)
+    _receive(lora, 4)
+    counters = lora.counters()
+    assert (counters["high_water"], counters["waiting"], counters["capacity"]) == (3, 1, constants.LORA_DATA_CACHE_SIZE)
+
+
+def test_drain_stops_after_count(lora):
+    _receive(lora, 1, 2, 3)
+    packets = []
+    assert lora.drain(lambda packet: packets.append(packet.header_id), count=2) == 2
+    assert packets == [1, 2]
+    assert len(lora.cache) == 1
+    assert lora.drain(lambda packet: packets.append(packet.header_id), count=2) == 1
+    assert packets == [1, 2, 3]
+
+
+def test_packets_received_while_draining_are_not_lost(lora):
+    # The scheduled receive callback runs while the handler is busy (e.g. sending a reply), it must not overwrite the slot being handled
+    _receive(lora, 1, 2)
+    packets = []
+
+    def handle(packet):
+        if packet.header_id == 1:
+            _receive(lora, 3)
+        packets.append((packet.header_id, bytes(packet.message)))
+
+    assert lora.drain(handle) == 3
+    assert packets == [(1, b"data"), (2, b"data"), (3, b"data")]
+    assert lora.counters()["dropped"] == 0
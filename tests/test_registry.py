@@ -0,0 +1,75 @@
+# BLOOM Hub
+# Tests of the paired sensor registry on the fake NVS (see fakes/esp32.py)
+# Author: Simon Aschenbrenner
+
+import pytest
+import constants
+import esp32
+from nvs import NVS
+from registry import SensorRegistry
+
+SENSOR_ID = 5
+
+
+@pytest.fixture
+def registry():
+    esp32.reset()
+    return SensorRegistry(NVS())
+
+
+def test_registry_flush_threshold_covers_a_schedule_period():
+    assert constants.LORA_SCHEDULE_PERIOD < constants.REGISTRY_FLUSH_THRESHOLD < constants.LORA_MAX_SILENT_TIME
+
+
+def test_measurement_per_period_is_written_behind(registry):
+    registry.update(SENSOR_ID, 0)  # Pairing
+    for period in range(1, 4):
+        registry.update(SENSOR_ID, period * constants.LORA_SCHEDULE_PERIOD)
+        registry.flush()
+    assert registry.writes == 1 + 3  # Pairing and one per flush, none per measurement
+
+
+def test_unflushed_timestamp_lags_behind_by_threshold_at_most(registry):
+    registry.update(SENSOR_ID, 0)
+    for period in range(1, 7):
+        registry.update(SENSOR_ID, period * constants.LORA_SCHEDULE_PERIOD)
+        assert period * constants.LORA_SCHEDULE_PERIOD - registry._persisted[SENSOR_ID] <= constants.REGISTRY_FLUSH_THRESHOLD
+    assert registry.writes == 1 + 3  # Every other measurement
+
+
+def test_timestamp_lost_in_reboot_does_not_make_sensor_silent(registry):
+    registry.update(SENSOR_ID, 0)
+    last_transmit = constants.REGISTRY_FLUSH_THRESHOLD  # Not written yet, the hub reboots without flushing
+    registry.update(SENSOR_ID, last_transmit)
+    registry = SensorRegistry(NVS())
+    assert registry.last_seen(SENSOR_ID) == 0
+    assert registry.silent_ids(last_transmit + constants.LORA_SCHEDULE_PERIOD) == set()  # The sensor transmits again by then
+
+
+def test_silent_sensor(registry):
+    registry.update(SENSOR_ID, 0)
+    assert registry.silent_ids(constants.LORA_MAX_SILENT_TIME) == set()
+    assert registry.silent_ids(constants.LORA_MAX_SILENT_TIME + 1) == {SENSOR_ID}
+
+
+def test_rolled_back_unpairing_keeps_the_sensor_paired(registry):
+    registry.update(SENSOR_ID, 0)
+    with pytest.raises(RuntimeError):
+        with registry._configuration.transaction():
+            registry.unpair(SENSOR_ID)
+            raise RuntimeError()
+    assert registry.is_paired(SENSOR_ID)
+    assert registry.last_seen(SENSOR_ID) == 0
+    assert SensorRegistry(NVS()).is_paired(SENSOR_ID)
+
+
+def test_rolled_back_flush_keeps_the_timestamp_pending(registry):
+    registry.update(SENSOR_ID, 0)
+    registry.update(SENSOR_ID, constants.LORA_SCHEDULE_PERIOD)
+    with pytest.raises(RuntimeError):
+        with registry._configuration.transaction():
+            registry.flush()
+            raise RuntimeError()
+    assert registry.counters()["pending"] == 1
+    registry.flush()
+    assert SensorRegistry(NVS()).last_seen(SENSOR_ID) == constants.LORA_SCHEDULE_PERIOD
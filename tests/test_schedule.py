@@ -0,0 +1,27 @@
+# BLOOM Hub
+# Tests of the uplink slot schedule
+# Author: Simon Aschenbrenner
+
+import constants
+from schedule import SlotTable
+
+
+def test_sensors_of_a_hub_get_a_slot_each():
+    table = SlotTable()
+    slots = [table.assign(sensor_id, 3) for sensor_id in range(constants.LORA_MAX_PAIRED_SENSORS)]
+    assert len(set(slots)) == len(slots)
+    assert table.counters()["max_per_slot"] == 1
+
+
+def test_hubs_on_the_channel_fill_different_slots_first():
+    # The slots of all hubs are aligned to the wall clock, see bench_schedule.py
+    first, second = SlotTable(), SlotTable()
+    slots = set(first.assign(sensor_id, 0) for sensor_id in range(4))
+    assert not slots & set(second.assign(sensor_id, 1) for sensor_id in range(4))
+
+
+def test_released_slot_is_assigned_again():
+    table = SlotTable()
+    slots = [table.assign(sensor_id, 2) for sensor_id in range(3)]
+    table.release(1)
+    assert table.assign(7, 2) == slots[1]
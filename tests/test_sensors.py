@@ -0,0 +1,108 @@
+# BLOOM Hub
+# Tests of the measurement upload against the mock backend (see backend_mock.py) and a stand-in hub module (see hub_mock.py)
+# Author: Simon Aschenbrenner
+
+import asyncio
+import time
+import pytest
+import constants
+import esp32
+import hub_mock
+import http
+from backend_mock import MockBackend
+
+SENSOR_IDS = (1, 2, 3)
+
+
+@pytest.fixture
+def hub(tmp_path):
+    from adr import AdaptiveDataRate
+    from journal import Journal
+    from nvs import NVS
+    from registry import SensorRegistry
+    from schedule import SlotTable
+
+    esp32.reset()
+    hub = hub_mock.install(tmp_path)
+    hub.configuration = NVS()
+    hub.registry = SensorRegistry(hub.configuration)
+    hub.journal = Journal(str(tmp_path / "journal"))
+    hub.schedule = SlotTable()
+    hub.adr = AdaptiveDataRate(None, hub.registry)
+    for sensor_id in SENSOR_IDS:
+        hub.registry.update(sensor_id, 0)
+    return hub
+
+
+@pytest.fixture
+def backend():
+    import backend as hub_backend
+    backend = MockBackend().install(http)
+    backend.bulk = True  # Whether sensor/updateSensors exists
+    backend.route("GET", "hub/getHub", lambda request: (200, { "hub_id": 1, "user": 1, "features": backend.features }))
+    backend.route("PUT", "sensor/updateSensors", lambda request: (200 if backend.bulk else 404, None))
+    backend.route("PUT", "sensor/updateSensor?", lambda request: (200, None))
+    hub_backend._bulk_sensor_update = None
+    yield backend
+    backend.uninstall(http)
+
+
+def journal(hub, age=constants.UPLOAD_BATCH_WINDOW):
+    for sensor_id in SENSOR_IDS:
+        hub.journal.append(sensor_id, 0.5, 0.75, int(time.time()) - age)
+
+
+def upload():
+    import backend
+    import sensors
+
+    async def run():
+        await backend.get_hub_async()  # Advertises the features
+        await sensors.upload_async()
+
+    asyncio.run(run())
+
+
+def test_measurements_are_sent_in_one_batch(hub, backend):
+    backend.features = [constants.FEATURE_BULK_SENSOR_UPDATE]
+    journal(hub)
+    upload()
+    bulk = [request for request in backend.requests if request.method == "PUT"]
+    assert [request.path for request in bulk] == ["sensor/updateSensors"]
+    assert bulk[0].json() == { "hub_id": constants.HUB_ID, "sensors": [[sensor_id + 1, 0.5, 0.75] for sensor_id in SENSOR_IDS] }
+    assert len(hub.journal) == 0
+
+
+def test_batch_waits_for_more_measurements(hub, backend):
+    backend.features = [constants.FEATURE_BULK_SENSOR_UPDATE]
+    journal(hub, age=0)
+    upload()
+    assert [request.method for request in backend.requests] == ["GET"]
+    assert len(hub.journal) == len(SENSOR_IDS)
+
+
+def test_single_updates_if_bulk_endpoint_is_not_advertised(hub, backend):
+    backend.features = []
+    journal(hub)
+    upload()
+    assert [request.path.split("?")[0] for request in backend.requests if request.method == "PUT"] == ["sensor/updateSensor"] * len(SENSOR_IDS)
+    assert len(hub.journal) == 0
+
+
+def test_single_updates_if_bulk_endpoint_is_missing(hub, backend):
+    import backend as hub_backend
+    backend.features = [constants.FEATURE_BULK_SENSOR_UPDATE]
+    backend.bulk = False
+    journal(hub)
+    upload()
+    assert [request.path.split("?")[0] for request in backend.requests if request.method == "PUT"] == ["sensor/updateSensors"] + ["sensor/updateSensor"] * len(SENSOR_IDS)
+    assert hub_backend._bulk_sensor_update is False  # Not tried again
+    assert len(hub.journal) == 0
+
+
+def test_unpairing_all_sensors_commits_once(hub):
+    import sensors
+    commits = esp32.NVS.commits
+    sensors.unpair_all_sensors()
+    assert esp32.NVS.commits == commits + 1  # Was a commit per sensor
+    assert not hub.registry.paired_ids()
@@ -0,0 +1,49 @@
+# BLOOM Hub
+# Tests of the watering routines against the mock backend (see backend_mock.py) and a stand-in hub module (see hub_mock.py)
+# Author: Simon Aschenbrenner
+
+import asyncio
+import pytest
+import hub_mock
+import http
+from backend_mock import MockBackend
+
+
+@pytest.fixture
+def hub(tmp_path):
+    return hub_mock.install(tmp_path)
+
+
+@pytest.fixture
+def watering(hub):
+    import backend
+    import watering
+    backend._bulk_zone_update = None
+    backend.invalidate_zone_ids()
+    watering._zone_states.clear()
+    watering._zones_synced = False
+    hub.outlets_mask[:] = [False] * len(hub.outlets)
+    return watering
+
+
+@pytest.fixture
+def backend():
+    backend = MockBackend().install(http)
+    backend.route("GET", "zone/getAllZonesByHubId", lambda request: (200, [{ "zone_id": 1 }, { "zone_id": 2 }, { "zone_id": 3 }]))
+    backend.failing = set()
+    backend.route("PUT", "zone/updateZone?", lambda request: (500 if request.path.endswith(tuple("zone_id={}".format(zone_id) for zone_id in backend.failing)) else 200, None))
+    yield backend
+    backend.uninstall(http)
+
+
+def test_zones_acknowledged_one_by_one_are_not_sent_again(hub, watering, backend):
+    watering._set_outlets({0, 1, 2})
+    backend.failing.add(2)  # Zone 1 on the hub
+    with pytest.raises(http.BackendError):
+        asyncio.run(watering._update_zones_async())
+    assert watering._zone_states == { 0: True, 2: True }
+    backend.failing.clear()
+    backend.requests.clear()
+    asyncio.run(watering._update_zones_async())
+    assert [request.path for request in backend.requests] == ["zone/updateZone?hub_id=1&zone_id=2"]
+    assert watering.zone_changes() == {}